@@ -0,0 +1,99 @@
+"""Measure the time needed to rebuild a game state, by replaying all of its
+events from the deal versus restoring the latest snapshot and replaying the
+events recorded after it, for increasing game lengths.
+
+Usage: python benchmarks/replay.py [iterations]
+
+Games are simulated in memory between two players (longer games use bigger
+hands), so no database is needed."""
+from sixquiprend.models.card import Card
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_snapshot import GameSnapshot
+from sixquiprend.models.game_state import GameState
+from sixquiprend.sixquiprend import app
+import random
+import sys
+import time
+
+PLAYER_NUMBER = 2
+GAME_LENGTHS = [10, 20, 30, 40, 50]
+
+def get_column_value(cards):
+    return sum(Card.get_cow_value(card) for card in cards)
+
+def simulate(hand_size):
+    """Play a game with random choices, returning its events and the
+    snapshots taken every SNAPSHOT_INTERVAL turns"""
+    cards = list(range(1, app.config['MAX_CARD_NUMBER'] + 1))
+    random.shuffle(cards)
+    game_state = GameState(1)
+    events = []
+    snapshots = []
+    def record(type, user_id=None, data={}):
+        event = GameEvent(game_id=1, version=game_state.version + 1, type=type,
+                user_id=user_id, data=data)
+        game_state.apply(event)
+        events.append(event)
+    record(GameEvent.TYPE_DEAL, data={
+        'hands': {user_id: [cards.pop() for i in range(hand_size)] for
+            user_id in range(1, PLAYER_NUMBER + 1)},
+        'columns': {column_id: [cards.pop()] for column_id in
+            range(1, app.config['BOARD_SIZE'] + 1)}
+        })
+    while not game_state.is_finished:
+        for user_id, hand in list(game_state.hands.items()):
+            record(GameEvent.TYPE_CHOOSE, user_id, {'card': random.choice(hand)})
+        while game_state.is_resolving_turn:
+            user_id, card = min(game_state.chosen_cards.items(),
+                    key=lambda item: item[1])
+            columns = [(column_id, column) for column_id, column in
+                    game_state.columns.items() if column[-1] < card]
+            if len(columns) == 0:
+                column_id, column = min(game_state.columns.items(),
+                        key=lambda item: get_column_value(item[1]))
+            else:
+                column_id, column = max(columns, key=lambda item: item[1][-1])
+            if len(columns) == 0 or len(column) == app.config['COLUMN_CARD_SIZE']:
+                record(GameEvent.TYPE_TAKE_COLUMN, user_id,
+                        {'column_id': column_id, 'cards': list(column)})
+            record(GameEvent.TYPE_PLACE, user_id,
+                    {'column_id': column_id, 'card': card})
+        if game_state.turn % app.config['SNAPSHOT_INTERVAL'] == 0:
+            snapshots.append(GameSnapshot.from_state(game_state))
+    return events, snapshots
+
+def replay(events):
+    return GameState.from_events(1, events)
+
+def restore(events, snapshots):
+    snapshot = snapshots[-1]
+    game_state = snapshot.get_state()
+    for event in events[snapshot.version:]:
+        game_state.apply(event)
+    return game_state
+
+def measure(func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000000
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print('Snapshot interval: {} turns'.format(app.config['SNAPSHOT_INTERVAL']))
+    print('{:>6} {:>7} {:>10} {:>14} {:>14}'.format('turns', 'events',
+        'snapshot', 'replay (us)', 'restore (us)'))
+    for game_length in GAME_LENGTHS:
+        events, snapshots = simulate(game_length)
+        # Load the game one move before its end, so the tail is not empty
+        events = events[:-1]
+        snapshots = [snapshot for snapshot in snapshots
+                if snapshot.version <= len(events)]
+        assert replay(events).serialize() == restore(events, snapshots).serialize()
+        print('{:>6} {:>7} {:>8} B {:>14.1f} {:>14.1f}'.format(game_length,
+            len(events), len(snapshots[-1].data),
+            measure(lambda: replay(events), iterations),
+            measure(lambda: restore(events, snapshots), iterations)))
+
+if __name__ == '__main__':
+    main()
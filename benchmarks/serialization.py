@@ -0,0 +1,83 @@
+"""Measure JSON encoding throughput (bytes/sec) of the game snapshot payloads,
+for the standard library encoder and orjson when it is installed.
+
+Usage: python benchmarks/serialization.py [iterations]
+
+Models are built in memory, so no database is needed."""
+from sixquiprend.models.card import Card
+from sixquiprend.models.chosen_card import ChosenCard
+from sixquiprend.models.column import Column
+from sixquiprend.models.game import Game
+from sixquiprend.models.hand import Hand
+from sixquiprend.models.heap import Heap
+from sixquiprend.models.user import User
+from sixquiprend.sixquiprend import app
+import sixquiprend.serialization as serialization
+import random
+import sys
+import time
+
+def build_cards():
+    cards = []
+    for number in range(1, app.config['MAX_CARD_NUMBER'] + 1):
+        cards.append(Card(id=number, number=number, cow_value=number % 7 + 1))
+    random.shuffle(cards)
+    return cards
+
+def build_payloads():
+    cards = build_cards()
+    player_number = app.config['MAX_PLAYER_NUMBER']
+    users = [User(id=i, username='User #' + str(i), urole=User.ROLE_PLAYER)
+            for i in range(1, player_number + 1)]
+    game = Game(id=1, owner_id=1, status=Game.STATUS_STARTED,
+            is_resolving_turn=True)
+    game_dict = game.serialize([user.serialize() for user in users])
+    columns = []
+    for i in range(app.config['BOARD_SIZE']):
+        column = Column(id=i, game_id=game.id)
+        column.cards = [cards.pop() for j in range(app.config['COLUMN_CARD_SIZE'] - 1)]
+        columns.append(column)
+    hand = Hand(id=1, game_id=game.id, user_id=1)
+    hand.cards = [cards.pop() for i in range(app.config['HAND_SIZE'])]
+    heaps = []
+    chosen_cards = []
+    for user in users:
+        heap = Heap(id=user.id, game_id=game.id, user_id=user.id)
+        heap.cards = [cards.pop() for i in range(5)]
+        heaps.append(heap)
+        chosen_cards.append(ChosenCard(id=user.id, game_id=game.id,
+            user_id=user.id, card=cards.pop()))
+    results = {user.username: random.randint(0, 66) for user in users}
+    return {
+            'game': {'game': game_dict, 'results': results},
+            'columns': {'columns': columns},
+            'hand': {'hand': hand},
+            'heaps': {'heaps': heaps},
+            'chosen_cards': {'chosen_cards': chosen_cards},
+            }
+
+def run(name, payload, iterations):
+    size = len(serialization.dumps(payload))
+    start = time.perf_counter()
+    for i in range(iterations):
+        serialization.dumps(payload)
+    elapsed = time.perf_counter() - start
+    print('{:<14} {:>8} bytes {:>12.0f} bytes/sec {:>10.0f} payloads/sec'.format(
+        name, size, size * iterations / elapsed, iterations / elapsed))
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    payloads = build_payloads()
+    orjson = serialization.orjson
+    backends = [('stdlib', None)]
+    if orjson != None:
+        backends.append(('orjson', orjson))
+    for backend_name, backend in backends:
+        serialization.orjson = backend
+        print('Backend:', backend_name)
+        for name, payload in payloads.items():
+            run(name, payload, iterations)
+    serialization.orjson = orjson
+
+if __name__ == '__main__':
+    main()
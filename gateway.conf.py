@@ -0,0 +1,19 @@
+# Gunicorn settings for the nodes serving the WebSocket gateway
+# (/games/<id>/socket) and the long polls of /games/<id>/watch: gevent workers
+# handle each connection in greenlets, so that a node holds tens of thousands
+# of them.
+#
+# Usage: gunicorn -c gateway.conf.py sixquiprend:app
+# (requires the gateway extra: pip install sixquiprend[gateway])
+
+import os
+
+os.environ.setdefault('WATCH_LONG_POLL', 'True')
+
+worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+worker_connections = 20000
+
+def post_fork(server, worker):
+    # Make psycopg2 wait cooperatively, instead of blocking all greenlets
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -14,6 +14,11 @@ setup(
         'flask-login',
         'gunicorn',
     ],
+    extras_require={
+        'fast_json': ['orjson'],
+        'brotli': ['brotli'],
+        'gateway': ['gevent', 'gevent-websocket', 'psycogreen'],
+    },
     setup_requires=[
         'pytest-runner',
     ],
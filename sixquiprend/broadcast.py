@@ -0,0 +1,213 @@
+from contextlib import contextmanager
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sixquiprend.models.game import Game
+from sixquiprend.serialization import dumps
+from sixquiprend.sixquiprend import app, db
+import psycopg2
+import select
+import threading
+import time
+
+def load_game(game_id):
+    """Version and player ids of a game. The session is closed afterwards,
+    so that watchers hold no connection while waiting"""
+    game = Game.find(game_id)
+    version, user_ids = game.version, game.get_user_ids()
+    db.session.close()
+    return version, user_ids
+
+def load_state(game_id, version):
+    game_state = Game.find(game_id).get_state(version)
+    db.session.close()
+    return game_state
+
+def serialize_state(game_state, user_id):
+    return dumps({'type': 'state', 'version': game_state.version,
+        'state': game_state.serialize_for_user(user_id)})
+
+class Channel:
+    """Latest known version of a watched game, its viewers, and what was
+    serialized for them at that version"""
+
+    def __init__(self, game_id, version, player_ids, lock):
+        self.game_id = game_id
+        self.version = version
+        self.player_ids = player_ids
+        self.refreshed_at = time.monotonic()
+        self.changed = threading.Condition(lock)
+        self.viewer_counts = {Broadcaster.PLAYERS: 0, Broadcaster.SPECTATORS: 0}
+        self.payload_lock = threading.Lock()
+        self.game_state = None
+        self.payloads = {}
+
+class Broadcaster:
+    """Fan-out of game changes to the requests watching them. A change wakes
+    up the viewers of its game only, and the game state is loaded once per
+    version, then serialized once per visibility class: one payload shared by
+    all spectators, and one per player (each one sees their own hand)"""
+
+    PLAYERS = 'players'
+    SPECTATORS = 'spectators'
+
+    def __init__(self, load_game=load_game, load_state=load_state,
+            serialize_state=serialize_state, max_polled=10000):
+        self.lock = threading.Lock()
+        self.channels = {}
+        # Latest states of the games read by short polls (see poll)
+        self.polled_channels = {}
+        self.max_polled = max_polled
+        self.load_game = load_game
+        self.load_state = load_state
+        self.serialize_state = serialize_state
+
+    def publish(self, game_id, version):
+        with self.lock:
+            channel = self.channels.get(game_id)
+            if channel != None and version > channel.version:
+                channel.version = version
+                channel.changed.notify_all()
+
+    def get_viewer_class(self, channel, user_id):
+        if user_id in channel.player_ids:
+            return Broadcaster.PLAYERS
+        return Broadcaster.SPECTATORS
+
+    @contextmanager
+    def watch(self, game_id, user_id):
+        """Register a viewer of a game for the duration of the block. The game
+        is only loaded if nobody watches it yet"""
+        while True:
+            with self.lock:
+                channel = self.channels.get(game_id)
+                if channel != None:
+                    viewer_class = self.get_viewer_class(channel, user_id)
+                    channel.viewer_counts[viewer_class] += 1
+                    break
+            version, player_ids = self.load_game(game_id)
+            with self.lock:
+                if game_id not in self.channels:
+                    self.channels[game_id] = Channel(game_id, version,
+                            player_ids, self.lock)
+        try:
+            yield channel
+        finally:
+            with self.lock:
+                channel.viewer_counts[viewer_class] -= 1
+                if sum(channel.viewer_counts.values()) == 0 and \
+                        self.channels.get(game_id) == channel:
+                    del self.channels[game_id]
+
+    def wait(self, channel, since, timeout, stopped=None):
+        """Wait until the game changes after version since, the timeout
+        expires or the stopped event is set (see wake), and return its latest
+        version. Notifications may be lost (if the listener reconnects), so a
+        timed out channel is reloaded, once per timeout for all of its
+        viewers"""
+        with self.lock:
+            if channel.changed.wait_for(lambda: channel.version > since or
+                    (stopped != None and stopped.is_set()), timeout):
+                return channel.version
+            if time.monotonic() - channel.refreshed_at < timeout:
+                return channel.version
+            channel.refreshed_at = time.monotonic()
+        version, player_ids = self.load_game(channel.game_id)
+        with self.lock:
+            channel.player_ids = player_ids
+            if version > channel.version:
+                channel.version = version
+                channel.changed.notify_all()
+            return channel.version
+
+    def wake(self, channel):
+        """Wake up the viewers of a channel, for those which stopped"""
+        with self.lock:
+            channel.changed.notify_all()
+
+    def poll(self, game_id, since, user_id):
+        """Latest version of a game and, if newer than since, its JSON state
+        for a viewer (else None), without waiting nor subscribing to its
+        changes. The latest state of each polled game is kept, so that it is
+        still loaded once per version and serialized once per visibility
+        class in this process"""
+        version, player_ids = self.load_game(game_id)
+        if version <= since:
+            return version, None
+        with self.lock:
+            channel = self.channels.get(game_id) or \
+                    self.polled_channels.get(game_id)
+            if channel == None:
+                if len(self.polled_channels) >= self.max_polled:
+                    self.polled_channels.clear()
+                channel = Channel(game_id, version, player_ids, self.lock)
+                self.polled_channels[game_id] = channel
+            channel.player_ids = player_ids
+        return version, self.get_payload(channel, version, user_id)
+
+    def get_payload(self, channel, version, user_id):
+        """JSON state of the given version for a viewer. The state is loaded
+        once per version, and serialized once per visibility class (user_id
+        being None for spectators)"""
+        key = user_id if user_id in channel.player_ids else None
+        with channel.payload_lock:
+            if channel.game_state == None or channel.game_state.version != version:
+                channel.game_state = self.load_state(channel.game_id, version)
+                channel.payloads = {}
+            if key not in channel.payloads:
+                channel.payloads[key] = self.serialize_state(channel.game_state, key)
+            return channel.payloads[key]
+
+    def get_viewer_counts(self, game_id):
+        """Viewers watching a game through this process (long polls and
+        WebSockets), short polls not being counted"""
+        with self.lock:
+            channel = self.channels.get(game_id)
+            if channel == None:
+                return {Broadcaster.PLAYERS: 0, Broadcaster.SPECTATORS: 0}
+            return dict(channel.viewer_counts)
+
+    def clear(self):
+        with self.lock:
+            self.channels.clear()
+            self.polled_channels.clear()
+
+def listen(broadcaster):
+    """Publish the game changes notified by Postgres (see
+    Game.record_event), reconnecting on errors. Meant to run in a daemon
+    thread"""
+    while True:
+        connection = None
+        try:
+            connection = psycopg2.connect(app.config['SQLALCHEMY_DATABASE_URI'])
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            connection.cursor().execute('LISTEN ' + Game.CHANGES_CHANNEL)
+            while True:
+                if select.select([connection], [], [], 5) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    game_id, version = notify.payload.split(':')
+                    broadcaster.publish(int(game_id), int(version))
+        except psycopg2.Error:
+            time.sleep(1)
+        finally:
+            if connection != None:
+                connection.close()
+
+broadcaster = None
+listener = None
+broadcaster_lock = threading.Lock()
+
+def get_broadcaster(listen_changes=False):
+    """Broadcaster of this process. Waiting for changes (long polls and
+    WebSockets) requires listen_changes, which opens the process' LISTEN
+    connection the first time"""
+    global broadcaster, listener
+    with broadcaster_lock:
+        if broadcaster == None:
+            broadcaster = Broadcaster()
+        if listen_changes and listener == None:
+            listener = threading.Thread(target=listen, args=(broadcaster,),
+                    name='broadcast-listener', daemon=True)
+            listener.start()
+    return broadcaster
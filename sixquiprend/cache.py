@@ -0,0 +1,71 @@
+from concurrent.futures import Future
+import threading
+import time
+
+class TimedCache:
+    """In-process, thread-safe key/value cache. Entries are considered stale
+    once older than the timeout given when reading them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, timeout):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry == None or time.monotonic() - entry[1] > timeout:
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+
+    def get_or_set(self, key, timeout, compute):
+        value = self.get(key, timeout)
+        if value == None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key: the first caller
+    computes the value, and the callers arriving meanwhile wait for it and
+    share it (or its exception). Nothing is kept once the computation is
+    over, so keys must tell apart the values which may differ (versions)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def do(self, key, compute):
+        with self.lock:
+            future = self.futures.get(key)
+            is_leader = future == None
+            if is_leader:
+                future = Future()
+                self.futures[key] = future
+        if not is_leader:
+            return future.result()
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.futures[key]
+        return future.result()
+
+    def count(self):
+        """Number of computations in progress"""
+        with self.lock:
+            return len(self.futures)
@@ -1,4 +1,5 @@
 from sixquiprend.sixquiprend import app
+from datetime import timedelta
 import os
 
 # Load default config and override config from an environment variable
@@ -9,16 +10,59 @@ app.config.update(dict(
     DATABASE_HOST='localhost',
     DATABASE_NAME='sixquiprend',
     SECRET_KEY='development key',
+    PERMANENT_SESSION_LIFETIME=timedelta(days=int(os.environ.get('SESSION_LIFETIME_DAYS', 14))),
+    REMEMBER_COOKIE_DURATION=timedelta(days=int(os.environ.get('SESSION_LIFETIME_DAYS', 14))),
     ADMIN_USERNAME=os.environ.get('ADMIN_USER', 'admin'),
     ADMIN_PASSWORD=os.environ.get('ADMIN_PASSWORD', 'admin'),
     ALLOW_REGISTER_USERS=os.environ.get('ALLOW_REGISTER_USERS', 'True') == 'True',
     ACTIVATE_ALL_USERS=os.environ.get('ACTIVATE_ALL_USERS', 'True') == 'True',
     BOT_NAMES=['Azrael','Valdamar','Lüdwig','Seelöwe','Gallù'],
+    BOT_INSERT_SIZE=1000,
     HAND_SIZE=10,
     BOARD_SIZE=4,
     MAX_PLAYER_NUMBER=6,
     COLUMN_CARD_SIZE=5,
-    MAX_CARD_NUMBER=104
+    MAX_CARD_NUMBER=104,
+    MATCHMAKING_TIMEOUT=int(os.environ.get('MATCHMAKING_TIMEOUT', 30)),
+    # Tables formed (and tickets locked) by a match at most
+    MATCHMAKING_BATCH_TABLES=10,
+    # Seconds players have to play a turn, only enforced by a running
+    # scheduler (0 to wait for them forever)
+    TURN_TIMEOUT=int(os.environ.get('TURN_TIMEOUT', 0)),
+    TURN_LEASE=30,
+    TURN_SCHEDULER_ENABLED=os.environ.get('TURN_SCHEDULER_ENABLED', 'False') == 'True',
+    SCHEDULER_REFRESH_INTERVAL=5,
+    SCHEDULER_BATCH_SIZE=1000,
+    SNAPSHOT_INTERVAL=int(os.environ.get('SNAPSHOT_INTERVAL', 5)),
+    CHANGES_MAX_EVENTS=100,
+    # Share the computation of identical concurrent game reads (only useful
+    # with threaded or gevent workers)
+    COALESCE_READS=os.environ.get('COALESCE_READS', 'False') == 'True',
+    WATCH_TIMEOUT=20,
+    # Hold /watch requests open until a change (only with gevent workers, see
+    # gateway.conf.py), instead of answering right away
+    WATCH_LONG_POLL=os.environ.get('WATCH_LONG_POLL', 'False') == 'True',
+    COUNT_CACHE_TIMEOUT=int(os.environ.get('COUNT_CACHE_TIMEOUT', 5)),
+    # Rows each counter is spread over (see models/counter.py)
+    COUNTER_SHARDS=int(os.environ.get('COUNTER_SHARDS', 8)),
+    USER_CACHE_TIMEOUT=int(os.environ.get('USER_CACHE_TIMEOUT', 10)),
+    BCRYPT_ROUNDS=int(os.environ.get('BCRYPT_ROUNDS', 12)),
+    HASHING_THREADS=int(os.environ.get('HASHING_THREADS', 2)),
+    HASHING_QUEUE_SIZE=int(os.environ.get('HASHING_QUEUE_SIZE', 8)),
+    HASHING_RETRY_AFTER=1,
+    RATE_LIMIT_ENABLED=os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True',
+    # memory (per process) or database (shared by all processes)
+    RATE_LIMIT_STORE=os.environ.get('RATE_LIMIT_STORE', 'memory'),
+    # (tokens per second, burst) of each route class, per user
+    RATE_LIMITS={'read': (10, 40), 'action': (5, 10)},
+    # Number of proxies in front of the app (1 on Heroku), whose
+    # X-Forwarded-For gives the client addresses of logged out users
+    PROXY_FIX_X_FOR=int(os.environ.get('PROXY_FIX_X_FOR', 0)),
+    BATCH_MAX_SIZE=20,
+    IDEMPOTENCY_CLAIM_TIMEOUT=60,
+    COMPRESS_MIN_SIZE=500,
+    GZIP_LEVEL=6,
+    BROTLI_QUALITY=4
 ))
 app.config.from_envvar('SIXQUIPREND_SETTINGS', silent=True)
 db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
@@ -0,0 +1,119 @@
+from sqlalchemy.exc import IntegrityError
+from sixquiprend.models.game import Game
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.rate_limit import get_client_key, take_token
+from sixquiprend.serialization import dumps
+from sixquiprend.sixquiprend import app, db
+import json
+import threading
+
+class Gateway:
+    """Serves a game to one of its players over a WebSocket: its state is
+    pushed on every change, and the actions sent by the player are performed
+    with the same Game methods as the REST routes.
+
+    Actions are sent as {"id": ..., "action": ..., ...} with action being
+    choose_card (with card_id), choose_column (with column_id), place_card
+    or choose_cards_for_bots, and answered with {"id": ..., "result": ...}
+    or {"id": ..., "error": ..., "code": ...}, rate limited actions getting
+    a "retry_after" number of seconds too. States are pushed as
+    {"type": "state", "version": ..., "state": ...}.
+
+    The websocket must provide receive (returning None once closed) and send,
+    as the ones of gevent-websocket. Under gevent, each connection costs two
+    greenlets, and no database connection while idle."""
+
+    def __init__(self, websocket, game_id, user_id, broadcaster):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.user_id = user_id
+        self.broadcaster = broadcaster
+        self.send_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.channel = None
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def run(self):
+        """Serve the connection until it is closed"""
+        pusher = threading.Thread(target=self.push_states, daemon=True)
+        pusher.start()
+        try:
+            while True:
+                message = self.websocket.receive()
+                if message == None:
+                    break
+                self.send(self.handle(message))
+        finally:
+            self.closed.set()
+            if self.channel != None:
+                self.broadcaster.wake(self.channel)
+            pusher.join()
+
+    def push_states(self):
+        with app.app_context():
+            with self.broadcaster.watch(self.game_id, self.user_id) as channel:
+                self.channel = channel
+                version = -1
+                while not self.closed.is_set():
+                    new_version = self.broadcaster.wait(channel, version,
+                            app.config['WATCH_TIMEOUT'], self.closed)
+                    if new_version > version and not self.closed.is_set():
+                        version = new_version
+                        self.send(self.broadcaster.get_payload(channel, version,
+                            self.user_id))
+
+    def send(self, payload):
+        with self.send_lock:
+            self.websocket.send(payload.decode('utf-8'))
+
+    def handle(self, message):
+        """Perform the action of a message, and return the JSON answer"""
+        request_id = None
+        try:
+            request = json.loads(message)
+            request_id = request.get('id')
+            result = self.perform(request)
+            return dumps({'id': request_id, 'result': result})
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return dumps({'id': request_id, 'error': 'Invalid message', 'code': 400})
+        except SixQuiPrendException as e:
+            answer = {'id': request_id, 'error': e.message, 'code': e.code}
+            if 'Retry-After' in e.headers:
+                answer['retry_after'] = int(e.headers['Retry-After'])
+            return dumps(answer)
+        except IntegrityError:
+            # A concurrent move recorded the same version first
+            db.session.rollback()
+            app.logger.exception('Conflicting action on game %s', self.game_id)
+            return dumps({'id': request_id, 'error': 'Conflicting action, retry',
+                'code': 409})
+        except Exception:
+            # Answered like any other error, instead of closing the WebSocket
+            db.session.rollback()
+            app.logger.exception('Action on game %s failed', self.game_id)
+            return dumps({'id': request_id, 'error': 'Internal server error',
+                'code': 500})
+        finally:
+            db.session.close()
+
+    def perform(self, request):
+        take_token('action', get_client_key(self.user_id))
+        game = Game.find(self.game_id)
+        action = request['action']
+        if action == 'choose_card':
+            chosen_card = game.choose_card_for_user(self.user_id, int(request['card_id']))
+            return {'chosen_card': chosen_card}
+        elif action == 'choose_column':
+            [chosen_column, user_heap] = game.choose_column_for_user(self.user_id,
+                    int(request['column_id']))
+        elif action == 'place_card':
+            [chosen_column, user_heap] = game.place_card(self.user_id)
+        elif action == 'choose_cards_for_bots':
+            game.choose_cards_for_bots(self.user_id)
+            return {}
+        else:
+            raise SixQuiPrendException('Unknown action', 400)
+        return {'chosen_column': chosen_column, 'user_heap': user_heap}
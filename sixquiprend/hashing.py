@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from passlib.hash import bcrypt
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.sixquiprend import app
+import threading
+
+class HashingPool:
+    """Bounded thread pool for password hashing. At most max_workers hashes
+    run at once (bcrypt releases the GIL), and at most max_pending more may
+    wait; further submissions are rejected with a 429 instead of piling up
+    and starving the request workers."""
+
+    def __init__(self, max_workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                thread_name_prefix='hashing')
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise SixQuiPrendException('Too many authentication requests, retry later',
+                    429, {'Retry-After': str(app.config['HASHING_RETRY_AFTER'])})
+        try:
+            future = self.executor.submit(func, *args)
+        except:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        return future
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool == None:
+            pool = HashingPool(app.config['HASHING_THREADS'],
+                    app.config['HASHING_QUEUE_SIZE'])
+    return pool
+
+def get_hasher():
+    return bcrypt.using(rounds=app.config['BCRYPT_ROUNDS'])
+
+def hash_password(password):
+    return get_pool().run(get_hasher().hash, password)
+
+def verify_password(password, password_hash):
+    return get_pool().run(bcrypt.verify, password, password_hash)
+
+def needs_rehash(password_hash):
+    """Whether a hash was made with another cost factor than BCRYPT_ROUNDS"""
+    return get_hasher().needs_update(password_hash)
@@ -0,0 +1,61 @@
+from flask import Response, request
+from flask_login import current_user
+from sixquiprend.models.idempotency_key import IdempotencyKey
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.serialization import dumps
+from sixquiprend.sixquiprend import app, db
+from functools import wraps
+
+def idempotent(func):
+    """Make a route idempotent for the requests sent with an Idempotency-Key
+    header: the first request with a key is performed and its response
+    (successful or client error) is stored, and the retries with the same key
+    get that response again (with an Idempotent-Replayed header) without
+    performing the request. Keys are per user, so the route must require
+    login. A retry arriving while the request is still being performed gets a
+    409, and server errors are not stored so that they can be retried.
+
+    The response is stored once the request is done, in its own transaction:
+    a process dying in between leaves the key claimed until
+    IDEMPOTENCY_CLAIM_TIMEOUT, after which the request is performed again"""
+    @wraps(func)
+    def func_wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key == None:
+            return func(*args, **kwargs)
+        user_id = current_user.id
+        idempotency_key = IdempotencyKey.claim(user_id, key, request.full_path)
+        if idempotency_key != None:
+            return replay(idempotency_key)
+        try:
+            response = app.make_response(func(*args, **kwargs))
+        except SixQuiPrendException as e:
+            db.session.rollback()
+            if e.code >= 500 or e.code == 429:
+                IdempotencyKey.release(user_id, key)
+            else:
+                IdempotencyKey.save(user_id, key, e.code, dumps({'error': e.message}))
+            raise
+        except:
+            db.session.rollback()
+            IdempotencyKey.release(user_id, key)
+            raise
+        if response.status_code >= 500:
+            IdempotencyKey.release(user_id, key)
+        else:
+            IdempotencyKey.save(user_id, key, response.status_code,
+                    response.get_data())
+        return response
+    return func_wrapper
+
+def replay(idempotency_key):
+    if idempotency_key.path != request.full_path:
+        raise SixQuiPrendException('Idempotency-Key already used for another request',
+                422)
+    if idempotency_key.status == None:
+        raise SixQuiPrendException('A request with this Idempotency-Key is in progress',
+                409, {'Retry-After': '1'})
+    response = Response(idempotency_key.body, idempotency_key.status,
+            mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
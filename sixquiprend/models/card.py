@@ -16,6 +16,26 @@ class Card(db.Model):
             raise SixQuiPrendException('Card doesn\'t exist', 404)
         return card
 
+    def find_by_number(number):
+        card = Card.query.filter(Card.number == number).first()
+        if not card:
+            raise SixQuiPrendException('Card doesn\'t exist', 404)
+        return card
+
+    def get_cow_value(number):
+        """Cow value of a card, derived from its number: 2 for multiples of 5,
+        3 for multiples of 10, 5 for multiples of 11, and 1 otherwise"""
+        cow_value = 0
+        if number % 10 == 5:
+            cow_value += 2
+        if number % 10 == 0:
+            cow_value += 3
+        if number % 11 == 0:
+            cow_value += 5
+        if cow_value == 0:
+            cow_value = 1
+        return cow_value
+
     ################################################################################
     ## Serializer
     ################################################################################
@@ -26,3 +46,6 @@ class Card(db.Model):
                 'number': self.number,
                 'cow_value': self.cow_value
                 }
+
+    def serialize_compact(self):
+        return self.number
@@ -2,8 +2,8 @@ from sixquiprend.sixquiprend import app, db
 
 class ChosenCard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'))
     card_id = db.Column(db.Integer, db.ForeignKey('card.id'))
     card = db.relationship('Card', backref='chosen_card', lazy=True)
 
@@ -1,14 +1,14 @@
 from sixquiprend.sixquiprend import app, db
 
 column_cards = db.Table('column_cards',
-        db.Column('column_id', db.Integer, db.ForeignKey('column.id')),
+        db.Column('column_id', db.Integer, db.ForeignKey('column.id', ondelete='CASCADE')),
         db.Column('card_id', db.Integer, db.ForeignKey('card.id'))
 )
 
 class Column(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
-    cards = db.relationship('Card', secondary=column_cards,
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'))
+    cards = db.relationship('Card', secondary=column_cards, passive_deletes=True,
             backref=db.backref('columns', lazy='dynamic'))
 
     ################################################################################
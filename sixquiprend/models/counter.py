@@ -0,0 +1,76 @@
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sixquiprend.cache import TimedCache
+from sixquiprend.sixquiprend import app, db
+import random
+
+class Counter(db.Model):
+    """Row counts maintained incrementally in the same transaction as the rows
+    they count, so that counting never scans the counted table. Each counter
+    is spread over COUNTER_SHARDS rows summed on read, so that concurrent
+    transactions seldom wait for the same row lock"""
+
+    name = db.Column(db.String(50), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False,
+            default=0, server_default='0')
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    cache = TimedCache()
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def get_value(names):
+        """Sum of the given counters, possibly stale by up to
+        COUNT_CACHE_TIMEOUT seconds"""
+        key = tuple(sorted(names))
+        return Counter.cache.get_or_set(key, app.config['COUNT_CACHE_TIMEOUT'],
+                lambda: Counter.get_exact_value(names))
+
+    def get_exact_value(names):
+        value = db.session.query(db.func.sum(Counter.value)) \
+                .filter(Counter.name.in_(names)) \
+                .scalar()
+        return int(value or 0)
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def increment(connection, name, delta=1):
+        """Add delta to a counter using the given connection, so that it can
+        be called from flush events. Each connection sticks to a random
+        shard, so that the counters updated by a transaction are always
+        locked in the same shard. The cache is cleared once committed"""
+        shard = connection.info.setdefault('counter_shard',
+                random.randrange(app.config['COUNTER_SHARDS']))
+        statement = insert(Counter.__table__).values(name=name, shard=shard,
+                value=delta)
+        statement = statement.on_conflict_do_update(
+                index_elements=[Counter.__table__.c.name, Counter.__table__.c.shard],
+                set_={'value': Counter.__table__.c.value + delta})
+        connection.execute(statement)
+        db.session.info['has_changed_counters'] = True
+
+    def rebuild(counts):
+        """Overwrite counters with the given {name: value} dict, used to
+        resynchronize them with the counted tables"""
+        db.session.query(Counter).delete()
+        for name, value in counts.items():
+            db.session.add(Counter(name=name, value=value))
+        db.session.commit()
+        Counter.cache.clear()
+
+################################################################################
+## Cache
+################################################################################
+
+@event.listens_for(db.session, 'after_commit')
+def _(session):
+    if session.info.pop('has_changed_counters', False):
+        Counter.cache.clear()
+
+@event.listens_for(db.session, 'after_rollback')
+def _(session):
+    session.info.pop('has_changed_counters', None)
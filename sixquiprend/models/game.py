@@ -1,10 +1,19 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime, timedelta
+from sixquiprend.cache import SingleFlight
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
-from sixquiprend.models.column import Column
+from sixquiprend.models.column import Column, column_cards
+from sixquiprend.models.counter import Counter
+from sixquiprend.models.game_archive import GameArchive
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_snapshot import GameSnapshot
+from sixquiprend.models.game_state import GameState
 from sixquiprend.models.hand import Hand
-from sixquiprend.models.heap import Heap
+from sixquiprend.models.heap import Heap, heap_cards
 from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
-from sixquiprend.models.user import User
+from sixquiprend.models.user import User, user_games
 from sixquiprend.sixquiprend import app, db
 import random
 
@@ -13,18 +22,56 @@ class Game(db.Model):
     STATUS_STARTED = 1
     STATUS_FINISHED = 2
 
+    # Postgres notification channel of the new versions of games
+    CHANGES_CHANNEL = 'game_changes'
+
+    # Concurrent identical reads of games, computed once (see get_read_key)
+    reads = SingleFlight()
+
+    __table_args__ = (
+            db.Index('ix_game_status_id', 'status', 'id'),
+            db.Index('ix_game_open_id', 'id',
+                postgresql_where=db.text('status = ' + str(STATUS_CREATED))),
+            db.Index('ix_game_created_at', 'created_at'),
+            db.Index('ix_game_turn_deadline', 'turn_deadline',
+                postgresql_where=db.text('turn_deadline IS NOT NULL')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    status = db.Column(db.Integer, nullable=False, default=STATUS_CREATED)
+    status = db.column_property(db.Column(db.Integer, nullable=False,
+        default=STATUS_CREATED), active_history=True)
     is_resolving_turn = db.Column(db.Boolean, default=False)
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+            server_default=db.func.now())
+    finished_at = db.Column(db.DateTime)
+    # Once passed, the current turn is played on behalf of the idle players
+    # (see scheduler)
+    turn_deadline = db.Column(db.DateTime)
+    user_count = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=0,
+            server_default='0')
+    # Children are deleted by the database (ON DELETE CASCADE) rather than
+    # loaded to be deleted one by one
+    users = db.relationship('User', secondary=user_games, lazy='dynamic',
+            back_populates='games', passive_deletes=True)
     hands = db.relationship('Hand', backref='game', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     heaps = db.relationship('Heap', backref='game', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     columns = db.relationship('Column', backref='game', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     chosen_cards = db.relationship('ChosenCard', backref='game', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
+    # Joining on the partition key restricts event queries to one partition
+    events = db.relationship('GameEvent', backref='game', lazy='dynamic',
+            cascade="all, delete, delete-orphan", passive_deletes=True,
+            order_by='GameEvent.version',
+            primaryjoin='and_(Game.id == foreign(GameEvent.game_id), '
+                'Game.created_at == foreign(GameEvent.game_created_at))')
+    snapshots = db.relationship('GameSnapshot', backref='game', lazy='dynamic',
+            cascade="all, delete, delete-orphan", passive_deletes=True)
 
     ################################################################################
     ## Getters
@@ -36,6 +83,139 @@ class Game(db.Model):
             raise SixQuiPrendException('Game doesn\'t exist', 404)
         return game
 
+    def find_or_archive(game_id):
+        """Same as find, but falls back on the archive of the game, which
+        provides get_results, get_replay_states, get_columns, get_user_heap,
+        get_user_hand, get_user_status and serialize"""
+        game = Game.query.get(game_id)
+        if not game:
+            return GameArchive.find(game_id)
+        return game
+
+    def get_read_key(game_id):
+        """What the reads of a game depend on: its version (bumped by each
+        event), status and user count (which change without events while it
+        is created). None if the game doesn't exist (it may be archived)"""
+        return db.session.query(Game.version, Game.status, Game.user_count) \
+                .filter(Game.id == game_id) \
+                .first()
+
+    def count(status=None):
+        if status != None:
+            statuses = [status]
+        else:
+            statuses = [Game.STATUS_CREATED, Game.STATUS_STARTED, Game.STATUS_FINISHED]
+        return Counter.get_value([Game.get_status_counter_name(status) for
+            status in statuses])
+
+    def get_status_counter_name(status):
+        return 'game_status_' + str(status)
+
+    def get_open_games(limit, after_id=None):
+        games = Game.query.filter(Game.status == Game.STATUS_CREATED,
+                Game.user_count < app.config['MAX_PLAYER_NUMBER'])
+        if after_id != None:
+            games = games.filter(Game.id > after_id)
+        return games.order_by(Game.id).limit(limit).all()
+
+    def get_user_dashboard(user_id):
+        """Created and started games of a user, with the same flags as
+        get_user_status, can_place_card and can_choose_cards_for_bots (false
+        for games the user doesn't own), computed for all games at once in
+        four queries"""
+        games = Game.query.join(user_games, user_games.c.game_id == Game.id) \
+                .filter(user_games.c.user_id == user_id,
+                        Game.status != Game.STATUS_FINISHED) \
+                .order_by(Game.id) \
+                .all()
+        game_ids = [game.id for game in games if game.status == Game.STATUS_STARTED]
+        chosen_cards = {game_id: {} for game_id in game_ids}
+        column_tops = {game_id: [] for game_id in game_ids}
+        bot_counts = {}
+        if len(game_ids) > 0:
+            for game_id, chosen_card_user_id, number, urole in db.session.query(
+                    ChosenCard.game_id, ChosenCard.user_id, Card.number, User.urole) \
+                    .join(Card, Card.id == ChosenCard.card_id) \
+                    .join(User, User.id == ChosenCard.user_id) \
+                    .filter(ChosenCard.game_id.in_(game_ids)):
+                chosen_cards[game_id][chosen_card_user_id] = (number, urole)
+            for game_id, number in db.session.query(Column.game_id,
+                    db.func.max(Card.number)) \
+                    .join(column_cards, column_cards.c.column_id == Column.id) \
+                    .join(Card, Card.id == column_cards.c.card_id) \
+                    .filter(Column.game_id.in_(game_ids)) \
+                    .group_by(Column.game_id, Column.id):
+                column_tops[game_id].append(number)
+            bot_counts = dict(db.session.query(user_games.c.game_id,
+                db.func.count(User.id)) \
+                    .join(User, User.id == user_games.c.user_id) \
+                    .filter(user_games.c.game_id.in_(game_ids),
+                        User.urole == User.ROLE_BOT) \
+                    .group_by(user_games.c.game_id) \
+                    .all())
+        dashboard = []
+        for game in games:
+            game_dict = game.serialize_for_dashboard()
+            game_dict.update({
+                'has_chosen_card': False,
+                'needs_to_choose_column': False,
+                'can_place_card': False,
+                'can_choose_cards_for_bots': False
+                })
+            dashboard.append(game_dict)
+            if game.status != Game.STATUS_STARTED:
+                continue
+            game_chosen_cards = chosen_cards[game.id]
+            def needs_to_choose_column(chosen_card_user_id):
+                # No column ends lower than the card, which is the lowest
+                number = game_chosen_cards[chosen_card_user_id][0]
+                return game.is_resolving_turn and \
+                        all(top > number for top in column_tops[game.id]) and \
+                        all(other_number >= number for other_number, urole in
+                                game_chosen_cards.values())
+            game_dict['has_chosen_card'] = user_id in game_chosen_cards
+            game_dict['needs_to_choose_column'] = user_id in game_chosen_cards and \
+                    needs_to_choose_column(user_id)
+            if game.owner_id != user_id:
+                continue
+            if game.is_resolving_turn:
+                if len(game_chosen_cards) > 0:
+                    lowest_user_id = min(game_chosen_cards,
+                            key=lambda chosen_card_user_id:
+                            game_chosen_cards[chosen_card_user_id][0])
+                    game_dict['can_place_card'] = \
+                            game_chosen_cards[lowest_user_id][1] == User.ROLE_BOT or \
+                            not needs_to_choose_column(lowest_user_id)
+            else:
+                game_dict['can_place_card'] = len(game_chosen_cards) == game.user_count
+            bot_chosen_card_count = len([urole for number, urole in
+                game_chosen_cards.values() if urole == User.ROLE_BOT])
+            game_dict['can_choose_cards_for_bots'] = \
+                    not game_dict['can_place_card'] and \
+                    bot_chosen_card_count < bot_counts.get(game.id, 0)
+        return dashboard
+
+    def get_turn_deadlines(limit):
+        """Earliest turn deadlines of started games, as (id, deadline)"""
+        return db.session.query(Game.id, Game.turn_deadline) \
+                .filter(Game.status == Game.STATUS_STARTED,
+                        Game.turn_deadline != None) \
+                .order_by(Game.turn_deadline) \
+                .limit(limit) \
+                .all()
+
+    def get_counter_values():
+        counts = db.session.query(Game.status, db.func.count(Game.id)) \
+                .group_by(Game.status) \
+                .all()
+        counts = {Game.get_status_counter_name(status): count for status, count in
+                counts}
+        # Archived games are still counted as finished games
+        counter_name = Game.get_status_counter_name(Game.STATUS_FINISHED)
+        counts[counter_name] = counts.get(counter_name, 0) + \
+                GameArchive.query.count()
+        return counts
+
     def find_user(self, user_id):
         user = self.users.filter(User.id==user_id).first()
         if not user:
@@ -56,6 +236,10 @@ class Game(db.Model):
             raise SixQuiPrendException('Chosen card not found', 404)
         return chosen_card
 
+    def get_user_ids(self):
+        return {user_id for user_id, in db.session.query(user_games.c.user_id) \
+                .filter(user_games.c.game_id == self.id)}
+
     def get_user_hand(self, user_id):
         user = self.find_user(user_id)
         hand = self.hands.filter(Hand.user_id == user.id).first()
@@ -87,13 +271,104 @@ class Game(db.Model):
             raise SixQuiPrendException('User is not game owner', 403)
 
     def get_results(self):
-        results = {}
         if self.status == Game.STATUS_CREATED:
-            return results
-        for user in self.users.all():
-            user_game_heap = self.get_user_heap(user.id)
-            results[user.username] = user_game_heap.get_value()
-        return results
+            return {}
+        results = db.session.query(User.username,
+                db.func.coalesce(db.func.sum(Card.cow_value), 0)) \
+                .join(Heap, Heap.user_id == User.id) \
+                .outerjoin(heap_cards, heap_cards.c.heap_id == Heap.id) \
+                .outerjoin(Card, Card.id == heap_cards.c.card_id) \
+                .filter(Heap.game_id == self.id) \
+                .group_by(User.username) \
+                .all()
+        return dict(results)
+
+    def get_latest_snapshot(self, version=None):
+        snapshots = self.snapshots
+        if version != None:
+            snapshots = snapshots.filter(GameSnapshot.version <= version)
+        return snapshots.order_by(GameSnapshot.version.desc()).first()
+
+    def has_event_log(self):
+        """Whether the game was dealt after the event log existed, so that its
+        state can be rebuilt from its events"""
+        first_event = self.events.first()
+        return first_event != None and first_event.type == GameEvent.TYPE_DEAL
+
+    def get_table_state(self):
+        """Current state of the game, read from its tables rather than rebuilt
+        from its events. The turn is derived from the cards left in hand"""
+        game_state = GameState(self.id)
+        game_state.version = self.version
+        game_state.is_started = self.status != Game.STATUS_CREATED
+        game_state.is_finished = self.status == Game.STATUS_FINISHED
+        game_state.is_resolving_turn = bool(self.is_resolving_turn)
+        for hand in self.hands.options(selectinload(Hand.cards)):
+            game_state.hands[hand.user_id] = sorted(card.number for card in hand.cards)
+        for heap in self.heaps.options(selectinload(Heap.cards)):
+            game_state.heaps[heap.user_id] = [card.number for card in heap.cards]
+        for column in self.get_columns():
+            game_state.columns[column.id] = sorted(card.number for card in column.cards)
+        for chosen_card in self.chosen_cards.options(joinedload(ChosenCard.card)):
+            game_state.chosen_cards[chosen_card.user_id] = chosen_card.card.number
+        if len(game_state.hands) > 0:
+            game_state.turn = app.config['HAND_SIZE'] - max(len(cards) for cards in
+                    game_state.hands.values()) - (1 if game_state.is_resolving_turn else 0)
+        return game_state
+
+    def get_state(self, version=None):
+        """Rebuild the game state, up to the given version if any, from the
+        latest snapshot and the events recorded after it. Games started before
+        the event log existed only have their current state, read from their
+        tables"""
+        if self.status != Game.STATUS_CREATED and not self.has_event_log():
+            if version != None and version < self.version:
+                raise SixQuiPrendException('No state available for this version', 404)
+            return self.get_table_state()
+        events = self.events
+        if version != None:
+            events = events.filter(GameEvent.version <= version)
+        snapshot = self.get_latest_snapshot(version)
+        if snapshot == None:
+            return GameState.from_events(self.id, events.all())
+        game_state = snapshot.get_state()
+        for event in events.filter(GameEvent.version > snapshot.version):
+            game_state.apply(event)
+        return game_state
+
+    def get_replay_states(self):
+        """Generate the state of a finished game after the deal and after each
+        turn. Events are fetched and replayed lazily, and the same GameState
+        is updated between two iterations"""
+        if self.status != Game.STATUS_FINISHED:
+            raise SixQuiPrendException('Game is not finished', 400)
+        if not self.has_event_log():
+            raise SixQuiPrendException('No replay available for this game', 404)
+        return GameState.replay_turns(self.id, self.events.yield_per(100))
+
+    def get_changes(self, since, user_id=None):
+        """Status of the game, with the events recorded after version since
+        as seen by the given user, or its whole state when too many of them
+        were (more than CHANGES_MAX_EVENTS)"""
+        changes = {
+                'version': self.version,
+                'status': self.status,
+                'is_resolving_turn': self.is_resolving_turn,
+                'user_count': self.user_count
+                }
+        if 0 <= since <= self.version and \
+                self.version - since <= app.config['CHANGES_MAX_EVENTS']:
+            events = self.events.filter(GameEvent.version > since)
+            changes['events'] = [event.serialize_for_user(user_id) for event in
+                    events]
+        else:
+            changes['state'] = self.get_state().serialize_for_user(user_id)
+        return changes
+
+    def get_columns(self):
+        return self.columns.options(selectinload(Column.cards)) \
+                .order_by(Column.id) \
+                .all()
 
     def get_lowest_value_column(self):
         column_value = 9000
@@ -136,7 +411,7 @@ class Game(db.Model):
             chosen_cards = self.chosen_cards.filter(ChosenCard.user_id == current_user_id)
             if chosen_cards.count() == 0:
                 raise SixQuiPrendException('You haven\'t chosen a card', 400)
-        return self.chosen_cards.all()
+        return self.chosen_cards.options(joinedload(ChosenCard.card)).all()
 
     def user_needs_to_choose_column(self, user_id):
         self.check_is_started()
@@ -189,26 +464,114 @@ class Game(db.Model):
         db.session.commit()
         return game
 
+    def create_started(users):
+        """Create a game with the given users, owned by the first one, and
+        deal it, without committing"""
+        game = Game(status=Game.STATUS_CREATED, owner_id=users[0].id)
+        for user in users:
+            game.users.append(user)
+        db.session.add(game)
+        db.session.flush()
+        game.deal()
+        return game
+
     def delete(game_id):
         game = Game.find(game_id)
         db.session.delete(game)
         db.session.commit()
 
+    def purge(game_ids):
+        """Delete the given games in one statement, their rows being deleted
+        by the database. Returns the number of deleted games"""
+        rows = db.session.execute(Game.__table__.delete() \
+                .where(Game.__table__.c.id.in_(game_ids)) \
+                .returning(Game.__table__.c.status)) \
+                .fetchall()
+        # Bulk deletes bypass the ORM events maintaining counters
+        status_counts = {}
+        for status, in rows:
+            status_counts[status] = status_counts.get(status, 0) + 1
+        for status, count in status_counts.items():
+            Counter.increment(db.session.connection(),
+                    Game.get_status_counter_name(status), -count)
+        db.session.commit()
+        return len(rows)
+
+    def sync_user_counts():
+        user_count = db.select([db.func.count()]) \
+                .where(user_games.c.game_id == Game.id) \
+                .as_scalar()
+        Game.query.update({Game.user_count: user_count}, synchronize_session=False)
+        db.session.commit()
+
+    def archive_games(finished_before, limit):
+        """Archive up to limit games finished before the given date, or
+        before finish dates were recorded. Returns the number of archived
+        games"""
+        games = Game.query \
+                .filter(Game.status == Game.STATUS_FINISHED) \
+                .filter(db.or_(Game.finished_at == None,
+                    Game.finished_at < finished_before)) \
+                .order_by(Game.id) \
+                .limit(limit) \
+                .all()
+        for game in games:
+            game.archive()
+        db.session.commit()
+        return len(games)
+
+    def archive(self):
+        """Replace a finished game by its archive. Changes are not
+        committed"""
+        if self.status != Game.STATUS_FINISHED:
+            raise SixQuiPrendException('Only finished games can be archived', 400)
+        heaps = self.heaps.options(selectinload(Heap.cards)).all()
+        game_archive = GameArchive(id=self.id,
+                owner_id=self.owner_id,
+                version=self.version,
+                finished_at=self.finished_at,
+                user_ids=[user.id for user in self.users.order_by(User.id)],
+                results=self.get_results(),
+                heaps={heap.user_id: sorted(card.number for card in heap.cards)
+                    for heap in heaps},
+                columns=[[card.number for card in column.cards] for column in
+                    self.get_columns()],
+                events=GameArchive.pack_events(self.events))
+        db.session.add(game_archive)
+        db.session.delete(self)
+        Counter.increment(db.session.connection(),
+                Game.get_status_counter_name(Game.STATUS_FINISHED))
+        return game_archive
+
+    def lock(self):
+        """Reload the game with its row locked until commit, so that
+        concurrent moves are played one after the other instead of recording
+        events of the same version. Pending changes to the game are lost, so
+        it is called before any"""
+        db.session.refresh(self, with_for_update=True)
+
     def setup(self, current_user_id):
+        self.lock()
         self.check_is_owner(current_user_id)
         if self.status != Game.STATUS_CREATED:
             raise SixQuiPrendException('Can only start a created game', 400)
         if self.users.count() < 2:
             raise SixQuiPrendException('Cannot start game with less than 2 players', 400)
+        self.deal()
+        db.session.commit()
+
+    def deal(self):
+        """Start the game, dealing hands and columns, without committing"""
         self.status = Game.STATUS_STARTED
+        self.set_turn_deadline()
+        cards = {card.number: card for card in Card.query.all()}
         card_set = list(range(1, app.config['MAX_CARD_NUMBER'] + 1))
         for user in self.users.all():
             user_hand = Hand(game_id=self.id, user_id=user.id)
             for i in range(app.config['HAND_SIZE']):
                 index = random.randrange(len(card_set))
                 card_number = card_set.pop(index)
-                card = Card.query.filter(Card.number == card_number).first()
-                user_hand.cards.append(card)
+                user_hand.cards.append(cards[card_number])
                 db.session.add(user_hand)
             user_heap = Heap(game_id=self.id, user_id=user.id)
             db.session.add(user_heap)
@@ -216,16 +579,24 @@ class Game(db.Model):
             column = Column(game_id=self.id)
             index = random.randrange(len(card_set))
             card_number = card_set.pop(index)
-            card = Card.query.filter(Card.number == card_number).first()
-            column.cards.append(card)
+            column.cards.append(cards[card_number])
             db.session.add(column)
+        db.session.flush()
+        self.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {hand.user_id: [card.number for card in hand.cards] for
+                hand in self.hands},
+            'columns': {column.id: [card.number for card in column.cards] for
+                column in self.columns}
+            })
         db.session.add(self)
-        db.session.commit()
 
     def add_user(self, user):
+        # Locking the game until commit keeps concurrent entries from going
+        # past MAX_PLAYER_NUMBER
+        self.lock()
         if self.status != Game.STATUS_CREATED:
             raise SixQuiPrendException('Cannot enter an already started game', 400)
-        if self.users.count() == app.config['MAX_PLAYER_NUMBER']:
+        if self.user_count >= app.config['MAX_PLAYER_NUMBER']:
             max_number = str(app.config['MAX_PLAYER_NUMBER'])
             error = 'Game has already ' + max_number + ' players'
             raise SixQuiPrendException(error, 400)
@@ -245,6 +616,7 @@ class Game(db.Model):
         self.add_user(bot)
 
     def remove_user(self, user):
+        self.lock()
         if user not in self.users.all():
             raise SixQuiPrendException('Not in game', 400)
         if user.is_game_owner(self):
@@ -255,11 +627,15 @@ class Game(db.Model):
             db.session.delete(self.get_user_heap(user.id))
         if self.get_user_chosen_card(user.id):
             db.session.delete(self.get_user_chosen_card(user.id))
+        if self.status != Game.STATUS_CREATED:
+            self.record_event(GameEvent.TYPE_LEAVE, user.id)
         self.users.remove(user)
         db.session.add(self)
         db.session.commit()
 
     def remove_owner(self, user_id):
+        """Hand the game over to another non-bot player. Changes are not
+        committed"""
         self.check_is_owner(user_id)
         new_owner = self.users.filter(User.id != user_id,
                 User.urole != User.ROLE_BOT).first()
@@ -268,20 +644,25 @@ class Game(db.Model):
         else:
             self.owner_id = new_owner.id
             db.session.add(self)
-            db.session.commit()
 
     def place_card(self, current_user_id):
+        self.lock()
         self.check_is_started()
         if not self.can_place_card(current_user_id):
             raise SixQuiPrendException('Cannot place a card right now', 422)
+        return self.place_lowest_card()
+
+    def place_lowest_card(self):
         chosen_card = self.chosen_cards.join(Card).order_by(Card.number.asc()).first()
         user_game_heap = self.get_user_heap(chosen_card.user_id)
         try:
             chosen_column = self.get_suitable_column(chosen_card)
             if len(chosen_column.cards) == app.config['COLUMN_CARD_SIZE']:
+                self.record_take_column(chosen_card.user_id, chosen_column)
                 user_game_heap.cards += chosen_column.cards
                 db.session.add(user_game_heap)
                 chosen_column.cards = []
+            self.record_place(chosen_card, chosen_column)
             chosen_column.cards.append(chosen_card.card)
             db.session.add(chosen_column)
             db.session.delete(chosen_card)
@@ -289,6 +670,8 @@ class Game(db.Model):
         except SixQuiPrendException as e:
             if chosen_card.user.urole == User.ROLE_BOT:
                 chosen_column = self.get_lowest_value_column()
+                self.record_take_column(chosen_card.user_id, chosen_column)
+                self.record_place(chosen_card, chosen_column)
                 chosen_column.replace_by_card(chosen_card)
             else:
                 raise e
@@ -296,6 +679,7 @@ class Game(db.Model):
         return [chosen_column, user_game_heap]
 
     def choose_cards_for_bots(self, current_user_id):
+        self.lock()
         self.check_is_owner(current_user_id)
         self.check_is_started()
         if self.is_resolving_turn:
@@ -310,6 +694,7 @@ class Game(db.Model):
         db.session.commit()
 
     def choose_card_for_user(self, user_id, card_id=None):
+        self.lock()
         self.check_is_started()
         user = self.find_user(user_id)
         if self.is_resolving_turn:
@@ -330,6 +715,7 @@ class Game(db.Model):
         db.session.add(hand)
         chosen_card = ChosenCard(game_id=self.id, user_id=user_id, card_id=card.id)
         db.session.add(chosen_card)
+        self.record_event(GameEvent.TYPE_CHOOSE, user_id, {'card': card.number})
         if self.chosen_cards.count() == self.users.count():
             self.is_resolving_turn = True
             db.session.add(self)
@@ -337,25 +723,126 @@ class Game(db.Model):
         return chosen_card
 
     def choose_column_for_user(self, user_id, column_id):
+        self.lock()
         self.check_is_started()
         user = self.find_user(user_id)
         chosen_column = self.find_column(column_id)
         chosen_card = self.find_chosen_card(user_id)
+        if not self.user_needs_to_choose_column(user_id):
+            raise SixQuiPrendException('User cannot choose a column right now', 400)
+        self.record_take_column(user_id, chosen_column)
+        self.record_place(chosen_card, chosen_column)
         user_heap = chosen_column.replace_by_card(chosen_card)
         return [chosen_column, user_heap]
 
+    def auto_play(self):
+        """Play the current turn on behalf of the idle players: random cards
+        for the players (and bots) who haven't chosen one, the lowest value
+        column for those who must choose one, and the cards placed in place
+        of the owner"""
+        self.check_is_started()
+        if not self.is_resolving_turn:
+            for user in self.users.order_by(User.id).all():
+                if self.get_user_chosen_card(user.id) == None:
+                    self.choose_card_for_user(user.id)
+        while self.status == Game.STATUS_STARTED and self.is_resolving_turn:
+            self.lock()
+            if self.status != Game.STATUS_STARTED or not self.is_resolving_turn:
+                break
+            chosen_card = self.chosen_cards.join(Card).order_by(Card.number.asc()).first()
+            if chosen_card.user.urole != User.ROLE_BOT and \
+                    self.user_needs_to_choose_column(chosen_card.user_id):
+                column = self.get_lowest_value_column()
+                self.choose_column_for_user(chosen_card.user_id, column.id)
+                self.update_status()
+            else:
+                self.place_lowest_card()
+
+    def claim_expired_turn(game_id, now):
+        """Take the lease of a game whose turn deadline passed, by pushing its
+        deadline TURN_LEASE seconds ahead, and return whether it was taken. A
+        single scheduler can take it, and another one will take it again if
+        the turn is not played by then"""
+        lease_until = now + timedelta(seconds=app.config['TURN_LEASE'])
+        game_id = db.session.execute(Game.__table__.update() \
+                .where(db.and_(Game.id == game_id,
+                    Game.status == Game.STATUS_STARTED,
+                    Game.turn_deadline <= now)) \
+                .values(turn_deadline=lease_until) \
+                .returning(Game.id)).scalar()
+        db.session.commit()
+        return game_id != None
+
+    def set_turn_deadline(self):
+        timeout = app.config['TURN_TIMEOUT']
+        if timeout > 0:
+            self.turn_deadline = datetime.utcnow() + timedelta(seconds=timeout)
+        else:
+            self.turn_deadline = None
+
+    def record_event(self, type, user_id=None, data=None):
+        """Append an event to the game's log. It is committed along with the
+        move it describes, and the (game_id, version) unique constraint makes
+        concurrent moves on the same game fail instead of interleaving"""
+        self.version = (self.version or 0) + 1
+        db.session.add(GameEvent(game_id=self.id,
+            game_created_at=self.created_at, version=self.version,
+            type=type, user_id=user_id, data=data or {}))
+        db.session.add(self)
+        # Delivered to the watchers of the game once committed
+        db.session.execute(db.text('SELECT pg_notify(:channel, :payload)'), {
+            'channel': Game.CHANGES_CHANNEL,
+            'payload': str(self.id) + ':' + str(self.version)
+            })
+
+    def record_take_column(self, user_id, column):
+        self.record_event(GameEvent.TYPE_TAKE_COLUMN, user_id, {
+            'column_id': column.id,
+            'cards': sorted(card.number for card in column.cards)
+            })
+
+    def record_place(self, chosen_card, column):
+        self.record_event(GameEvent.TYPE_PLACE, chosen_card.user_id, {
+            'column_id': column.id,
+            'card': chosen_card.card.number
+            })
+
+    def take_snapshot(self):
+        """Snapshot the state every SNAPSHOT_INTERVAL turns and once the game
+        is over. Games started before the event log existed cannot be
+        replayed, and are left without snapshots"""
+        snapshot = self.get_latest_snapshot()
+        if snapshot != None and snapshot.version == self.version:
+            return
+        if not self.has_event_log():
+            return
+        try:
+            game_state = self.get_state()
+        except SixQuiPrendException:
+            return
+        if not game_state.is_started or game_state.is_resolving_turn:
+            return
+        interval = app.config['SNAPSHOT_INTERVAL']
+        if game_state.is_finished or (interval > 0 and game_state.turn % interval == 0):
+            db.session.add(GameSnapshot.from_state(game_state))
+            db.session.commit()
+
     def update_status(self):
         self.check_is_started()
         if self.chosen_cards.count() > 0:
             return
         else:
             self.is_resolving_turn = False
+            self.set_turn_deadline()
             db.session.add(self)
             db.session.commit()
+            self.take_snapshot()
         for user in self.users:
             if len(self.get_user_hand(user.id).cards) > 0:
                 return
         self.status = Game.STATUS_FINISHED
+        self.finished_at = datetime.utcnow()
+        self.turn_deadline = None
         db.session.add(self)
         db.session.commit()
 
@@ -363,11 +850,117 @@ class Game(db.Model):
     ## Serializer
     ################################################################################
 
-    def serialize(self):
+    def serialize_games(games):
+        """Serialize a list of games, loading all their users in one query"""
+        users_by_game = {game.id: [] for game in games}
+        if games:
+            rows = db.session.query(user_games.c.game_id, User) \
+                    .join(User, User.id == user_games.c.user_id) \
+                    .filter(user_games.c.game_id.in_(users_by_game.keys())) \
+                    .order_by(User.id) \
+                    .all()
+            for game_id, user in rows:
+                users_by_game[game_id].append(user.serialize())
+        return [game.serialize(users_by_game[game.id]) for game in games]
+
+    def serialize(self, users=None):
+        if users == None:
+            users = self.users.order_by(User.id).all()
+        return {
+                'id': self.id,
+                'users': users,
+                'owner_id': self.owner_id,
+                'status': self.status,
+                'is_resolving_turn': self.is_resolving_turn,
+                'version': self.version,
+                'turn_deadline': self.turn_deadline and \
+                        self.turn_deadline.isoformat() + 'Z'
+                }
+
+    def serialize_for_dashboard(self):
         return {
                 'id': self.id,
-                'users': self.users.all(),
                 'owner_id': self.owner_id,
                 'status': self.status,
-                'is_resolving_turn': self.is_resolving_turn
+                'is_resolving_turn': self.is_resolving_turn,
+                'user_count': self.user_count,
+                'version': self.version,
+                'turn_deadline': self.turn_deadline and \
+                        self.turn_deadline.isoformat() + 'Z'
                 }
+
+    def serialize_for_lobby(self):
+        return {
+                'id': self.id,
+                'owner_id': self.owner_id,
+                'user_count': self.user_count,
+                'available_seats': app.config['MAX_PLAYER_NUMBER'] - self.user_count
+                }
+
+################################################################################
+## Counters
+################################################################################
+
+@event.listens_for(Game, 'after_insert')
+def _(mapper, connection, game):
+    Counter.increment(connection, Game.get_status_counter_name(game.status))
+
+@event.listens_for(Game, 'after_update')
+def _(mapper, connection, game):
+    history = inspect(game).attrs.status.history
+    if history.added and history.deleted:
+        Counter.increment(connection,
+                Game.get_status_counter_name(history.deleted[0]), -1)
+        Counter.increment(connection,
+                Game.get_status_counter_name(history.added[0]))
+
+@event.listens_for(Game, 'after_delete')
+def _(mapper, connection, game):
+    Counter.increment(connection, Game.get_status_counter_name(game.status), -1)
+
+################################################################################
+## Seats
+################################################################################
+
+@event.listens_for(Game.users, 'append')
+def _(game, user, initiator):
+    game.user_count = (game.user_count or 0) + 1
+
+@event.listens_for(Game.users, 'remove')
+def _(game, user, initiator):
+    game.user_count = (game.user_count or 0) - 1
+
+@event.listens_for(User, 'before_delete')
+def _(mapper, connection, user):
+    """Deleted users leave their games in the same transaction: their started
+    games log it (as remove_user does) and the games they own are handed over
+    to another non-bot player, if any. Their seats, hands and heaps are
+    deleted by the database"""
+    game_table = Game.__table__
+    user_game_ids = db.select([user_games.c.game_id]) \
+            .where(user_games.c.user_id == user.id)
+    rows = connection.execute(game_table.update() \
+            .where(db.and_(game_table.c.id.in_(user_game_ids),
+                game_table.c.status == Game.STATUS_STARTED)) \
+            .values(version=game_table.c.version + 1) \
+            .returning(game_table.c.id, game_table.c.version,
+                game_table.c.created_at)).fetchall()
+    for game_id, version, created_at in rows:
+        connection.execute(GameEvent.__table__.insert().values(game_id=game_id,
+            game_created_at=created_at, version=version,
+            type=GameEvent.TYPE_LEAVE, user_id=user.id, data={}))
+        connection.execute(db.text('SELECT pg_notify(:channel, :payload)'), {
+            'channel': Game.CHANGES_CHANNEL,
+            'payload': str(game_id) + ':' + str(version)
+            })
+    user_table = User.__table__
+    new_owner_id = db.select([db.func.min(user_table.c.id)]) \
+            .select_from(user_games.join(user_table,
+                user_table.c.id == user_games.c.user_id)) \
+            .where(db.and_(user_games.c.game_id == game_table.c.id,
+                user_table.c.id != user.id,
+                user_table.c.urole != User.ROLE_BOT)) \
+            .as_scalar()
+    connection.execute(game_table.update() \
+            .where(game_table.c.owner_id == user.id) \
+            .values(owner_id=new_owner_id))
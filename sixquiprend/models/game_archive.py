@@ -0,0 +1,111 @@
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sixquiprend.models.card import Card
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_state import GameState
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.models.user import User
+from sixquiprend.serialization import dumps
+from sixquiprend.sixquiprend import app, db
+import json
+import zlib
+
+class GameArchive(db.Model):
+    """Finished game moved out of the game tables: one row holding its users,
+    results, final heaps and columns (as card numbers) and its compressed
+    event log. It keeps the id of the game it replaces"""
+
+    # Same as Game.STATUS_FINISHED
+    STATUS_FINISHED = 2
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner_id = db.Column(db.Integer)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    finished_at = db.Column(db.DateTime)
+    user_ids = db.Column(ARRAY(db.Integer), nullable=False, default=list)
+    results = db.Column(JSONB, nullable=False, default=dict)
+    heaps = db.Column(JSONB, nullable=False, default=dict)
+    columns = db.Column(JSONB, nullable=False, default=list)
+    events = db.Column(db.LargeBinary)
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def find(game_id):
+        game_archive = GameArchive.query.get(game_id)
+        if not game_archive:
+            raise SixQuiPrendException('Game doesn\'t exist', 404)
+        return game_archive
+
+    def find_user(self, user_id):
+        if user_id not in self.user_ids:
+            raise SixQuiPrendException('User not in game', 404)
+        return User.find(user_id)
+
+    def get_cards(numbers):
+        """Cards of the given numbers, in the same order"""
+        cards = Card.query.filter(Card.number.in_(numbers)).all()
+        cards_by_number = {card.number: card for card in cards}
+        return [cards_by_number[number] for number in numbers]
+
+    def get_columns(self):
+        """Final columns, shaped as serialized columns (without ids)"""
+        cards = GameArchive.get_cards([number for column in self.columns for
+            number in column])
+        columns = []
+        for column in self.columns:
+            columns.append({'id': None, 'game_id': self.id,
+                'cards': cards[:len(column)]})
+            cards = cards[len(column):]
+        return columns
+
+    def get_user_heap(self, user_id):
+        """Final heap of a user, shaped as a serialized heap (without id)"""
+        self.find_user(user_id)
+        return {'id': None, 'user_id': user_id, 'game_id': self.id,
+                'cards': GameArchive.get_cards(self.heaps.get(str(user_id), []))}
+
+    def get_user_hand(self, user_id):
+        """Hand of a user, empty as the game is finished"""
+        self.find_user(user_id)
+        return {'id': None, 'user_id': user_id, 'game_id': self.id, 'cards': []}
+
+    def get_user_status(self, user_id):
+        user_dict = self.find_user(user_id).serialize()
+        user_dict['has_chosen_card'] = False
+        user_dict['needs_to_choose_column'] = False
+        return user_dict
+
+    def pack_events(events):
+        return zlib.compress(dumps([event.serialize() for event in events]))
+
+    def get_events(self):
+        if self.events == None:
+            return []
+        events = json.loads(zlib.decompress(self.events).decode('utf-8'))
+        return [GameEvent(**event) for event in events]
+
+    def get_results(self):
+        return self.results
+
+    def get_replay_states(self):
+        events = self.get_events()
+        if len(events) == 0 or events[0].type != GameEvent.TYPE_DEAL:
+            raise SixQuiPrendException('No replay available for this game', 404)
+        return GameState.replay_turns(self.id, events)
+
+    ################################################################################
+    ## Serializer
+    ################################################################################
+
+    def serialize(self):
+        return {
+                'id': self.id,
+                'users': User.query.filter(User.id.in_(self.user_ids)) \
+                        .order_by(User.id).all(),
+                'owner_id': self.owner_id,
+                'status': GameArchive.STATUS_FINISHED,
+                'is_resolving_turn': False,
+                'version': self.version,
+                'turn_deadline': None
+                }
@@ -0,0 +1,65 @@
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import JSONB
+from sixquiprend.sixquiprend import app, db
+
+class GameEvent(db.Model):
+    """Move of a game. The table is partitioned by month of creation of the
+    game (copied in game_created_at), so that all the events of a game lie in
+    a single partition"""
+
+    TYPE_DEAL = 0
+    TYPE_CHOOSE = 1
+    TYPE_TAKE_COLUMN = 2
+    TYPE_PLACE = 3
+    TYPE_LEAVE = 4
+
+    __table_args__ = (
+            db.UniqueConstraint('game_id', 'version', 'game_created_at'),
+            {'postgresql_partition_by': 'RANGE (game_created_at)'}
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    game_created_at = db.Column(db.DateTime, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'),
+            nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)
+    data = db.Column(JSONB, nullable=False, default=dict)
+
+    ################################################################################
+    ## Serializer
+    ################################################################################
+
+    def serialize(self):
+        return {
+                'game_id': self.game_id,
+                'version': self.version,
+                'type': self.type,
+                'user_id': self.user_id,
+                'data': self.data
+                }
+
+    def serialize_for_user(self, user_id):
+        """Same as serialize, without the cards the given user (None for
+        spectators) cannot see: other players' hands and chosen cards"""
+        data = self.data
+        if self.type == GameEvent.TYPE_DEAL:
+            data = {
+                    'hands': {hand_user_id: cards for hand_user_id, cards in
+                        data['hands'].items() if str(hand_user_id) == str(user_id)},
+                    'columns': data['columns']
+                    }
+        elif self.type == GameEvent.TYPE_CHOOSE and self.user_id != user_id:
+            data = {}
+        event = self.serialize()
+        event['data'] = data
+        return event
+
+################################################################################
+## Partitions
+################################################################################
+
+# Rows outside of the monthly partitions created by create_partitions
+event.listen(GameEvent.__table__, 'after_create',
+        DDL('CREATE TABLE game_event_default PARTITION OF game_event DEFAULT'))
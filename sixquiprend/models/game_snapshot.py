@@ -0,0 +1,32 @@
+from sixquiprend.models.game_state import GameState
+from sixquiprend.serialization import dumps
+from sixquiprend.sixquiprend import app, db
+import json
+import zlib
+
+class GameSnapshot(db.Model):
+    """Compressed copy of a game state at a given version, so that rebuilding
+    it only replays the events recorded after the snapshot"""
+
+    __table_args__ = (
+            db.UniqueConstraint('game_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'),
+            nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def from_state(game_state):
+        return GameSnapshot(game_id=game_state.game_id,
+                version=game_state.version,
+                data=zlib.compress(dumps(game_state.serialize())))
+
+    def get_state(self):
+        data = json.loads(zlib.decompress(self.data).decode('utf-8'))
+        return GameState.from_dict(self.game_id, data)
@@ -0,0 +1,166 @@
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+
+class GameState:
+    """In-memory state of a started game, built by applying its events in
+    order. Card numbers are used in place of cards, and users and columns
+    are designated by their ids. Each event is checked against the rules, so
+    that replaying an inconsistent log fails instead of producing a wrong
+    board."""
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.version = 0
+        self.turn = 0
+        self.is_started = False
+        self.is_finished = False
+        self.is_resolving_turn = False
+        self.hands = {}
+        self.heaps = {}
+        self.columns = {}
+        self.chosen_cards = {}
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def from_events(game_id, events):
+        game_state = GameState(game_id)
+        for event in events:
+            game_state.apply(event)
+        return game_state
+
+    def replay_turns(game_id, events):
+        """Generate the state after the deal and after each turn, applying
+        events as they are consumed. The same GameState is updated between two
+        iterations"""
+        game_state = GameState(game_id)
+        for event in events:
+            game_state.apply(event)
+            if event.type == GameEvent.TYPE_DEAL or \
+                    (event.type == GameEvent.TYPE_PLACE and \
+                    not game_state.is_resolving_turn):
+                yield game_state
+
+    def from_dict(game_id, data):
+        """Inverse of serialize, JSON object keys being strings"""
+        game_state = GameState(game_id)
+        game_state.version = data['version']
+        game_state.turn = data['turn']
+        game_state.is_started = data['is_started']
+        game_state.is_finished = data['is_finished']
+        game_state.is_resolving_turn = data['is_resolving_turn']
+        for attribute in ['hands', 'heaps', 'columns', 'chosen_cards']:
+            setattr(game_state, attribute, {int(key): value for key, value in
+                data[attribute].items()})
+        return game_state
+
+    def check(self, condition, event, error):
+        if not condition:
+            raise SixQuiPrendException('Invalid event ' + str(event.version) +
+                    ' for game ' + str(self.game_id) + ': ' + error, 500)
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def apply(self, event):
+        self.check(event.version == self.version + 1, event, 'unexpected version')
+        if event.type == GameEvent.TYPE_DEAL:
+            self.apply_deal(event)
+        elif event.type == GameEvent.TYPE_CHOOSE:
+            self.apply_choose(event)
+        elif event.type == GameEvent.TYPE_TAKE_COLUMN:
+            self.apply_take_column(event)
+        elif event.type == GameEvent.TYPE_PLACE:
+            self.apply_place(event)
+        elif event.type == GameEvent.TYPE_LEAVE:
+            self.apply_leave(event)
+        else:
+            self.check(False, event, 'unknown type')
+        self.version = event.version
+
+    def apply_deal(self, event):
+        self.check(not self.is_started, event, 'game already dealt')
+        self.is_started = True
+        for user_id, cards in event.data['hands'].items():
+            self.hands[int(user_id)] = sorted(cards)
+            self.heaps[int(user_id)] = []
+        for column_id, cards in event.data['columns'].items():
+            self.columns[int(column_id)] = list(cards)
+
+    def apply_choose(self, event):
+        card = event.data['card']
+        self.check(self.is_started and not self.is_finished, event, 'game not started')
+        self.check(not self.is_resolving_turn, event, 'turn is being resolved')
+        self.check(event.user_id not in self.chosen_cards, event, 'card already chosen')
+        self.check(card in self.hands.get(event.user_id, []), event, 'card not owned')
+        self.hands[event.user_id].remove(card)
+        self.chosen_cards[event.user_id] = card
+        if len(self.chosen_cards) == len(self.hands):
+            self.is_resolving_turn = True
+
+    def apply_take_column(self, event):
+        column_id = event.data['column_id']
+        self.check(self.is_resolving_turn, event, 'turn is not being resolved')
+        self.check(column_id in self.columns, event, 'unknown column')
+        self.check(sorted(event.data['cards']) == self.columns[column_id], event,
+                'cards are not the column\'s')
+        self.heaps[event.user_id] += self.columns[column_id]
+        self.columns[column_id] = []
+
+    def apply_place(self, event):
+        card = event.data['card']
+        column_id = event.data['column_id']
+        self.check(self.is_resolving_turn, event, 'turn is not being resolved')
+        self.check(self.chosen_cards.get(event.user_id) == card, event,
+                'card not chosen')
+        self.check(card == min(self.chosen_cards.values()), event,
+                'card is not the lowest chosen card')
+        self.check(column_id in self.columns, event, 'unknown column')
+        column = self.columns[column_id]
+        self.check(len(column) == 0 or column[-1] < card, event,
+                'card is lower than the column\'s last card')
+        column.append(card)
+        del self.chosen_cards[event.user_id]
+        if len(self.chosen_cards) == 0:
+            self.is_resolving_turn = False
+            self.turn += 1
+            if all(len(hand) == 0 for hand in self.hands.values()):
+                self.is_finished = True
+
+    def apply_leave(self, event):
+        self.hands.pop(event.user_id, None)
+        self.heaps.pop(event.user_id, None)
+        self.chosen_cards.pop(event.user_id, None)
+
+    ################################################################################
+    ## Serializer
+    ################################################################################
+
+    def serialize(self):
+        return {
+                'game_id': self.game_id,
+                'version': self.version,
+                'turn': self.turn,
+                'is_started': self.is_started,
+                'is_finished': self.is_finished,
+                'is_resolving_turn': self.is_resolving_turn,
+                'hands': self.hands,
+                'heaps': self.heaps,
+                'columns': self.columns,
+                'chosen_cards': self.chosen_cards
+                }
+
+    def serialize_for_user(self, user_id):
+        """Same as serialize, without the cards the given user (None for
+        spectators) cannot see: other players' hands, and their chosen cards
+        until the turn is resolved"""
+        game_state = self.serialize()
+        game_state['hands'] = {hand_user_id: cards for hand_user_id, cards in
+                self.hands.items() if hand_user_id == user_id}
+        if not self.is_resolving_turn:
+            game_state['chosen_cards'] = {chosen_card_user_id: card if
+                    chosen_card_user_id == user_id else None for
+                    chosen_card_user_id, card in self.chosen_cards.items()}
+        return game_state
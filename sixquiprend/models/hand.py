@@ -1,15 +1,15 @@
 from sixquiprend.sixquiprend import app, db
 
 hand_cards = db.Table('hand_cards',
-        db.Column('hand_id', db.Integer, db.ForeignKey('hand.id')),
+        db.Column('hand_id', db.Integer, db.ForeignKey('hand.id', ondelete='CASCADE')),
         db.Column('card_id', db.Integer, db.ForeignKey('card.id'))
 )
 
 class Hand(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
-    cards = db.relationship('Card', secondary=hand_cards,
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'))
+    cards = db.relationship('Card', secondary=hand_cards, passive_deletes=True,
             backref=db.backref('hands', lazy='dynamic'))
 
     ################################################################################
@@ -1,15 +1,15 @@
 from sixquiprend.sixquiprend import app, db
 
 heap_cards = db.Table('heap_cards',
-        db.Column('heap_id', db.Integer, db.ForeignKey('heap.id')),
+        db.Column('heap_id', db.Integer, db.ForeignKey('heap.id', ondelete='CASCADE')),
         db.Column('card_id', db.Integer, db.ForeignKey('card.id'))
 )
 
 class Heap(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
-    cards = db.relationship('Card', secondary=heap_cards,
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'))
+    cards = db.relationship('Card', secondary=heap_cards, passive_deletes=True,
             backref=db.backref('heaps', lazy='dynamic'))
 
     ################################################################################
@@ -0,0 +1,76 @@
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, timedelta
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.sixquiprend import app, db
+
+class IdempotencyKey(db.Model):
+    """Response to a request sent with an Idempotency-Key header, returned
+    again to the retries of the request (see idempotency.idempotent). The
+    status is null while the request is being performed"""
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+            primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    path = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.Integer)
+    body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def find(user_id, key):
+        return IdempotencyKey.query.get((user_id, key))
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def claim(user_id, key, path):
+        """Record that a request is being performed with the given key, and
+        return None, or the request already recorded with the key. Requests
+        still being performed after IDEMPOTENCY_CLAIM_TIMEOUT seconds are
+        considered dead and claimed again"""
+        if len(key) == 0 or len(key) > 100:
+            raise SixQuiPrendException('Idempotency-Key must have 1 to 100 characters',
+                    400)
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=app.config['IDEMPOTENCY_CLAIM_TIMEOUT'])
+        table = IdempotencyKey.__table__
+        statement = insert(table).values(user_id=user_id, key=key, path=path,
+                created_at=now)
+        statement = statement.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.key],
+                set_={'path': statement.excluded.path, 'created_at': now},
+                where=db.and_(table.c.status == None,
+                    table.c.created_at < stale_before,
+                    table.c.path == statement.excluded.path))
+        claimed = db.session.execute(statement.returning(table.c.key)).first()
+        db.session.commit()
+        if claimed != None:
+            return None
+        return IdempotencyKey.find(user_id, key)
+
+    def release(user_id, key):
+        """Forget a claimed key, so that the request can be retried"""
+        IdempotencyKey.query.filter(IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.status == None) \
+                        .delete(synchronize_session=False)
+        db.session.commit()
+
+    def save(user_id, key, status, body):
+        IdempotencyKey.query.filter(IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key) \
+                        .update({'status': status, 'body': body},
+                                synchronize_session=False)
+        db.session.commit()
+
+    def purge(created_before):
+        """Delete the keys older than the given date, and return their count"""
+        count = IdempotencyKey.query \
+                .filter(IdempotencyKey.created_at < created_before) \
+                .delete(synchronize_session=False)
+        db.session.commit()
+        return count
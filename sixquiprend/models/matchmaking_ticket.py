@@ -0,0 +1,111 @@
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, timedelta
+from sixquiprend.models.game import Game
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.models.user import User
+from sixquiprend.sixquiprend import app, db
+
+class MatchmakingTicket(db.Model):
+    """Player waiting in the matchmaking queue, until matched into a game
+    (game_id being set). A user has at most one ticket"""
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+            primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+            index=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'))
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def find(user_id):
+        ticket = MatchmakingTicket.query.get(user_id)
+        if not ticket:
+            raise SixQuiPrendException('Not in matchmaking queue', 404)
+        return ticket
+
+    def get_tables(tickets, now):
+        """Split waiting tickets, oldest first, into tables of
+        MAX_PLAYER_NUMBER players. The last, incomplete table is only kept
+        once its oldest player waited for MATCHMAKING_TIMEOUT seconds"""
+        table_size = app.config['MAX_PLAYER_NUMBER']
+        tables = [tickets[i:i + table_size] for i in range(0, len(tickets),
+            table_size)]
+        if len(tables) > 0 and len(tables[-1]) < table_size:
+            timeout = timedelta(seconds=app.config['MATCHMAKING_TIMEOUT'])
+            if now - tables[-1][0].created_at < timeout:
+                tables.pop()
+        return tables
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def join(user):
+        """Put a user in the queue, unless already waiting"""
+        if user.get_urole() == User.ROLE_BOT:
+            raise SixQuiPrendException('Bots cannot join the matchmaking queue', 400)
+        table = MatchmakingTicket.__table__
+        now = datetime.utcnow()
+        statement = insert(table).values(user_id=user.id, created_at=now)
+        statement = statement.on_conflict_do_update(
+                index_elements=[table.c.user_id],
+                set_={'created_at': now, 'game_id': None},
+                where=table.c.game_id != None)
+        db.session.execute(statement)
+        db.session.commit()
+
+    def leave(user_id):
+        count = MatchmakingTicket.query.filter(
+                MatchmakingTicket.user_id == user_id,
+                MatchmakingTicket.game_id == None) \
+                        .delete(synchronize_session=False)
+        db.session.commit()
+        if count == 0:
+            raise SixQuiPrendException('Not waiting in matchmaking queue', 404)
+
+    def match(now=None):
+        """Form and start games with the waiting players, adding bots to the
+        incomplete table once timed out, all in one transaction. The oldest
+        waiting tickets, up to MATCHMAKING_BATCH_TABLES tables' worth, are
+        locked, skipping those locked by concurrent matches. Returns the
+        started games"""
+        now = now or datetime.utcnow()
+        tickets = MatchmakingTicket.query \
+                .filter(MatchmakingTicket.game_id == None) \
+                .order_by(MatchmakingTicket.created_at, MatchmakingTicket.user_id) \
+                .limit(app.config['MATCHMAKING_BATCH_TABLES'] *
+                        app.config['MAX_PLAYER_NUMBER']) \
+                .with_for_update(skip_locked=True) \
+                .all()
+        games = []
+        for table in MatchmakingTicket.get_tables(tickets, now):
+            users = {user.id: user for user in User.query.filter(
+                User.id.in_([ticket.user_id for ticket in table]))}
+            users = [users[ticket.user_id] for ticket in table]
+            bot_count = app.config['MAX_PLAYER_NUMBER'] - len(users)
+            if bot_count > 0:
+                users += User.query.filter(User.urole == User.ROLE_BOT) \
+                        .order_by(db.func.random()) \
+                        .limit(bot_count) \
+                        .all()
+            if len(users) < 2:
+                continue
+            game = Game.create_started(users)
+            for ticket in table:
+                ticket.game_id = game.id
+            games.append(game)
+        db.session.commit()
+        return games
+
+    ################################################################################
+    ## Serializer
+    ################################################################################
+
+    def serialize(self):
+        return {
+                'user_id': self.user_id,
+                'created_at': self.created_at.isoformat(),
+                'game_id': self.game_id
+                }
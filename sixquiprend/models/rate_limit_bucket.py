@@ -0,0 +1,39 @@
+from sqlalchemy.dialects.postgresql import insert
+from sixquiprend.sixquiprend import app, db
+
+class RateLimitBucket(db.Model):
+    """Token bucket shared by all the processes of the application (see
+    rate_limit.DatabaseRateLimiter). The table is unlogged: buckets are lost
+    on a crash, which only resets the limits"""
+
+    __table_args__ = {'prefixes': ['UNLOGGED']}
+
+    key = db.Column(db.String(100), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    is_allowed = db.Column(db.Boolean, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def take(connection, key, rate, burst):
+        """Refill a bucket with rate tokens per second up to burst, and take a
+        token if there is one, in a single statement using the given
+        connection. Returns whether a token was taken, and the tokens left"""
+        table = RateLimitBucket.__table__
+        now = db.func.now()
+        tokens = db.func.least(burst, table.c.tokens +
+                db.extract('epoch', now - table.c.updated_at) * rate)
+        statement = insert(table).values(key=key, tokens=burst - 1,
+                is_allowed=True, updated_at=now)
+        statement = statement.on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={
+                    'tokens': db.case([(tokens >= 1, tokens - 1)], else_=tokens),
+                    'is_allowed': tokens >= 1,
+                    'updated_at': now
+                    })
+        statement = statement.returning(table.c.is_allowed, table.c.tokens)
+        is_allowed, tokens = connection.execute(statement).first()
+        return is_allowed, tokens
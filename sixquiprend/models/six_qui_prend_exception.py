@@ -1,5 +1,6 @@
 class SixQuiPrendException(Exception):
-    def __init__(self, message, code):
+    def __init__(self, message, code, headers=None):
         super(Exception, self).__init__()
         self.message = message
         self.code = code
+        self.headers = headers or {}
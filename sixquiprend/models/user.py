@@ -1,11 +1,17 @@
-from passlib.hash import bcrypt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sixquiprend.cache import TimedCache
+from sixquiprend.hashing import hash_password, verify_password, needs_rehash
+from sixquiprend.models.counter import Counter
 from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
 from sixquiprend.sixquiprend import app, db
 import random
 
 user_games = db.Table('user_games',
-        db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-        db.Column('game_id', db.Integer, db.ForeignKey('game.id'))
+        db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+            index=True),
+        db.Column('game_id', db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'),
+            index=True)
 )
 
 class User(db.Model):
@@ -16,17 +22,21 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), nullable=False, unique=True)
     password = db.Column(db.String(255), nullable=False, server_default='')
-    authenticated = db.Column(db.Boolean, default=False)
-    active = db.Column(db.Boolean, default=app.config['ACTIVATE_ALL_USERS'])
+    active = db.column_property(db.Column(db.Boolean,
+        default=app.config['ACTIVATE_ALL_USERS']), active_history=True)
     urole = db.Column(db.Integer, default=ROLE_PLAYER)
+    # Children are deleted by the database (ON DELETE CASCADE) rather than
+    # loaded to be deleted one by one
     chosen_cards = db.relationship('ChosenCard', backref='user', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     hands = db.relationship('Hand', backref='user', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     heaps = db.relationship('Heap', backref='user', lazy='dynamic',
-            cascade="all, delete, delete-orphan")
+            cascade="all, delete, delete-orphan", passive_deletes=True)
     games = db.relationship('Game', secondary=user_games,
-            backref=db.backref('users', lazy='dynamic'))
+            back_populates='users', passive_deletes=True)
+
+    cache = TimedCache()
 
     ################################################################################
     ## Getters
@@ -38,6 +48,50 @@ class User(db.Model):
             raise SixQuiPrendException('User doesn\'t exist', 404)
         return user
 
+    def load(username):
+        """Find a user by username for Flask-Login. Column values are cached
+        for up to USER_CACHE_TIMEOUT seconds, and the user is attached to the
+        current session without querying the database"""
+        values = User.cache.get(username, app.config['USER_CACHE_TIMEOUT'])
+        if values == None:
+            user = User.query.filter(User.username == username).first()
+            if user:
+                User.cache.set(username, user.get_cache_values())
+            return user
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def get_cache_values(self):
+        return {
+                'id': self.id,
+                'username': self.username,
+                'password': self.password,
+                'active': self.active,
+                'urole': self.urole
+                }
+
+    def count(active=None):
+        if active != None:
+            actives = [active]
+        else:
+            actives = [True, False]
+        return Counter.get_value([User.get_active_counter_name(active) for
+            active in actives])
+
+    def get_active_counter_name(active):
+        return 'user_active_' + str(active == True).lower()
+
+    def get_counter_values():
+        counts = db.session.query(User.active, db.func.count(User.id)) \
+                .group_by(User.active) \
+                .all()
+        counters = {}
+        for active, count in counts:
+            name = User.get_active_counter_name(active)
+            counters[name] = counters.get(name, 0) + count
+        return counters
+
     def is_active(self):
         return self.active
 
@@ -49,14 +103,16 @@ class User(db.Model):
         return self.username
 
     def is_authenticated(self):
-        return self.authenticated
+        """True, as users are only loaded from a valid signed session.
+        Authentication state is not stored in the database."""
+        return True
 
     def is_anonymous(self):
         """False, as anonymous users aren't supported."""
         return False
 
     def verify_password(self, password):
-        return bcrypt.verify(password, self.password)
+        return verify_password(password, self.password)
 
     def is_game_owner(self, game):
         return game.owner_id == self.id
@@ -66,14 +122,21 @@ class User(db.Model):
     ################################################################################
 
     def delete(user_id):
+        """Delete a user, its hands, heaps, chosen cards and seats being
+        deleted by the database. Its started games record that it left, and
+        its games get another owner (see Game)"""
         user = User.find(user_id)
+        # Games are not loaded, so the seat count events are not triggered
+        db.session.execute(db.text('UPDATE game SET user_count = user_count - 1 '
+            'WHERE id IN (SELECT game_id FROM user_games WHERE user_id = :user_id)'),
+            {'user_id': user.id})
         db.session.delete(user)
         db.session.commit()
 
     def register(username, password):
         user = User.query.filter(User.username == username).first()
         if not user:
-            user = User(username=username, password=bcrypt.hash(password))
+            user = User(username=username, password=hash_password(password))
             db.session.add(user)
             db.session.commit()
             return user
@@ -88,20 +151,16 @@ class User(db.Model):
             if not user.is_active():
                 raise SixQuiPrendException('User is inactive', 403)
             if user.verify_password(password):
-                user.authenticated = True
-                db.session.add(user)
-                db.session.commit()
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
+                    db.session.add(user)
+                    db.session.commit()
                 return user
             else:
                 raise SixQuiPrendException('Password is invalid', 400)
         else:
             raise SixQuiPrendException('User doesn\'t exist', 404)
 
-    def logout(self):
-        self.authenticated = False
-        db.session.add(self)
-        db.session.commit()
-
     def change_active(self, active):
         self.active = active
         db.session.add(self)
@@ -117,3 +176,29 @@ class User(db.Model):
                 'username': self.username,
                 'urole': self.urole,
                 }
+
+################################################################################
+## Counters and cache
+################################################################################
+
+@event.listens_for(User, 'after_insert')
+def _(mapper, connection, user):
+    Counter.increment(connection, User.get_active_counter_name(user.active))
+    User.cache.delete(user.username)
+
+@event.listens_for(User, 'after_update')
+def _(mapper, connection, user):
+    User.cache.delete(user.username)
+    for username in inspect(user).attrs.username.history.deleted:
+        User.cache.delete(username)
+    history = inspect(user).attrs.active.history
+    if history.added and history.deleted:
+        Counter.increment(connection,
+                User.get_active_counter_name(history.deleted[0]), -1)
+        Counter.increment(connection,
+                User.get_active_counter_name(history.added[0]))
+
+@event.listens_for(User, 'after_delete')
+def _(mapper, connection, user):
+    User.cache.delete(user.username)
+    Counter.increment(connection, User.get_active_counter_name(user.active), -1)
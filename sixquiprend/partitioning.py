@@ -0,0 +1,74 @@
+from sqlalchemy.dialects import postgresql
+from sixquiprend.sixquiprend import app, db
+from datetime import datetime
+import re
+
+# Partitioned tables, by partition key. They are partitioned by month, and
+# have a default partition for the months without their own
+PARTITIONED_TABLES = {
+        'game_event': 'game_created_at'
+        }
+
+def get_month(date):
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return month.replace(year=month.year + years, month=month_index + 1)
+
+def get_partition_name(table_name, month):
+    return '{}_y{:04d}m{:02d}'.format(table_name, month.year, month.month)
+
+def create_partition(table_name, month):
+    """Create the partition of the given month unless it exists. Returns
+    whether it was created, which is not possible if the default partition
+    already holds rows of that month"""
+    partition_name = get_partition_name(table_name, month)
+    if db.session.execute('SELECT to_regclass(:name)',
+            {'name': partition_name}).scalar() != None:
+        return False
+    start = month.strftime('%Y-%m-%d')
+    end = add_months(month, 1).strftime('%Y-%m-%d')
+    partition_key = PARTITIONED_TABLES[table_name]
+    if db.session.execute('SELECT EXISTS (SELECT 1 FROM ' + table_name +
+            '_default WHERE ' + partition_key + ' >= :start AND ' +
+            partition_key + ' < :end)', {'start': start, 'end': end}).scalar():
+        return False
+    db.session.execute('CREATE TABLE ' + partition_name + ' PARTITION OF ' +
+            table_name + ' FOR VALUES FROM (\'' + start + '\') TO (\'' + end +
+            '\')')
+    db.session.commit()
+    return True
+
+def create_partitions(month_count, start=None):
+    """Create the partitions of month_count months, starting at the month of
+    start (the current one by default). Returns the names of the created
+    partitions"""
+    month = get_month(start or datetime.utcnow())
+    partition_names = []
+    for i in range(month_count):
+        for table_name in PARTITIONED_TABLES:
+            if create_partition(table_name, add_months(month, i)):
+                partition_names.append(get_partition_name(table_name,
+                    add_months(month, i)))
+    return partition_names
+
+def explain(query):
+    """Lines of the plan of a query, as chosen by the planner for its actual
+    parameters"""
+    statement = query.statement.compile(dialect=postgresql.dialect())
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute('EXPLAIN ' + str(statement), statement.params)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def get_scanned_partitions(query, table_name):
+    """Partitions of the given table scanned by a query, used to check that
+    the planner prunes the others"""
+    pattern = re.compile(r'\bon (' + table_name + r'_\w+)')
+    partition_names = set()
+    for line in explain(query):
+        partition_names.update(pattern.findall(line))
+    return partition_names
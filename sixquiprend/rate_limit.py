@@ -0,0 +1,108 @@
+from flask import request
+from flask_login import current_user
+from sixquiprend.models.rate_limit_bucket import RateLimitBucket
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.sixquiprend import app, db
+import math
+import threading
+import time
+
+class RateLimiter:
+    """In-process token buckets: each key gets rate tokens per second, up to
+    burst, and each request takes one. Buckets which are full again are
+    forgotten once there are more than max_size of them, at most once every
+    prune_interval seconds."""
+
+    def __init__(self, max_size=10000, prune_interval=10):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self.pruned_at = time.monotonic()
+
+    def take(self, key, rate, burst):
+        """Take a token from a bucket, and return 0, or the number of seconds
+        to wait for a token if there is none"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at, rate, burst = self.buckets.get(key,
+                    (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now, rate, burst)
+                if len(self.buckets) > self.max_size and \
+                        now - self.pruned_at >= self.prune_interval:
+                    self.prune(now)
+                return 0
+            self.buckets[key] = (tokens, now, rate, burst)
+            return (1 - tokens) / rate
+
+    def prune(self, now):
+        self.pruned_at = now
+        for key, (tokens, updated_at, rate, burst) in list(self.buckets.items()):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self.buckets[key]
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+class DatabaseRateLimiter:
+    """Same as RateLimiter, with the buckets stored in the database so that
+    all processes share them, at the cost of a write per request"""
+
+    def take(self, key, rate, burst):
+        with db.engine.begin() as connection:
+            is_allowed, tokens = RateLimitBucket.take(connection, key, rate, burst)
+        if is_allowed:
+            return 0
+        return (1 - tokens) / rate
+
+    def clear(self):
+        RateLimitBucket.query.delete()
+        db.session.commit()
+
+def get_route_class():
+    """Reads and actions have their own buckets, so that polling can't eat up
+    the tokens of the game actions"""
+    if request.method in ['GET', 'HEAD', 'OPTIONS']:
+        return 'read'
+    return 'action'
+
+def get_client_key(user_id=None):
+    if user_id != None:
+        return 'user:' + str(user_id)
+    if current_user.is_authenticated:
+        return 'user:' + str(current_user.id)
+    return 'ip:' + str(request.remote_addr)
+
+def take_token(route_class, client_key):
+    """Take a token for a client and route class, or raise a 429 with a
+    Retry-After header"""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return
+    rate, burst = app.config['RATE_LIMITS'][route_class]
+    retry_after = get_limiter().take(route_class + ':' + client_key, rate, burst)
+    if retry_after > 0:
+        raise SixQuiPrendException('Too many requests, retry later', 429,
+                {'Retry-After': str(math.ceil(retry_after))})
+
+def check_rate_limit():
+    """Rate limit the current request by user (or address) and route class.
+    Meant to be registered as a before_request hook"""
+    if request.endpoint in [None, 'static']:
+        return
+    take_token(get_route_class(), get_client_key())
+
+limiter = None
+limiter_lock = threading.Lock()
+
+def get_limiter():
+    global limiter
+    with limiter_lock:
+        if limiter == None:
+            if app.config['RATE_LIMIT_STORE'] == 'database':
+                limiter = DatabaseRateLimiter()
+            else:
+                limiter = RateLimiter()
+    return limiter
@@ -0,0 +1,62 @@
+from flask import request
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.serialization import jsonify
+from sixquiprend.sixquiprend import app, db
+from werkzeug.test import EnvironBuilder
+from urllib.parse import urlsplit
+import json
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Perform several requests at once, given in order as {"requests":
+    [{"method": ..., "path": ..., "body": ..., "headers": ...}]} (method
+    defaulting to GET, body being JSON, headers such as Idempotency-Key being
+    optional), and return their statuses and bodies in the same
+    order. Up to BATCH_MAX_SIZE requests, performed with the session of the
+    batch, each one taking its own rate limit token. Reads share the
+    database transaction of the batch, while actions commit as they would
+    alone; a failed request doesn't stop the following ones"""
+    sub_requests = (request.get_json(silent=True) or {}).get('requests')
+    if not isinstance(sub_requests, list) or len(sub_requests) == 0:
+        raise SixQuiPrendException('Requests must be a non-empty list', 400)
+    if len(sub_requests) > app.config['BATCH_MAX_SIZE']:
+        raise SixQuiPrendException('Too many requests in batch, maximum is ' +
+                str(app.config['BATCH_MAX_SIZE']), 400)
+    for sub_request in sub_requests:
+        if not isinstance(sub_request, dict) or \
+                not isinstance(sub_request.get('path'), str):
+            raise SixQuiPrendException('Each request must have a path', 400)
+        if not isinstance(sub_request.get('headers', {}), dict):
+            raise SixQuiPrendException('Headers must be an object', 400)
+        if urlsplit(sub_request['path']).path.rstrip('/') == '/batch':
+            raise SixQuiPrendException('Batches cannot be nested', 400)
+    return jsonify(responses=[perform_sub_request(sub_request) for sub_request in
+        sub_requests])
+
+def perform_sub_request(sub_request):
+    """Dispatch a request of a batch in its own request context. Responses are
+    left uncompressed, the batch response being compressed as a whole, and an
+    unexpected error is returned as a 500 response of its own, after rolling
+    back its changes, instead of failing the whole batch"""
+    headers = {name: value for name, value in (sub_request.get('headers') or
+        {}).items() if name.lower() != 'accept-encoding'}
+    if 'Cookie' in request.headers:
+        headers['Cookie'] = request.headers['Cookie']
+    builder = EnvironBuilder(path=sub_request['path'],
+            method=sub_request.get('method', 'GET').upper(),
+            base_url=request.host_url, headers=headers,
+            json=sub_request.get('body'),
+            environ_base={'REMOTE_ADDR': request.remote_addr})
+    try:
+        with app.request_context(builder.get_environ()):
+            response = app.full_dispatch_request()
+            data = response.get_data()
+    except Exception:
+        app.logger.exception('Batch request to ' + sub_request['path'] + ' failed')
+        db.session.rollback()
+        return {'status': 500, 'body': {'error': 'Internal server error'}}
+    if response.mimetype == 'application/json' and len(data) > 0:
+        body = json.loads(data)
+    else:
+        body = data.decode('utf-8')
+    return {'status': response.status_code, 'body': body}
@@ -1,34 +1,110 @@
-from flask import request, jsonify
+from flask import Response, request, stream_with_context
 from flask_login import login_required, current_user
+from sixquiprend.broadcast import get_broadcaster
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
 from sixquiprend.models.game import Game
 from sixquiprend.models.hand import Hand
 from sixquiprend.models.heap import Heap
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
 from sixquiprend.models.user import User
-from sixquiprend.sixquiprend import app, admin_required
+from sixquiprend.serialization import dumps, jsonify, jsonify_once
+from sixquiprend.sixquiprend import app, admin_required, db
 
 @app.route('/games')
 def get_games():
-    """Display all games. Accepts offset and limit (up to 50)"""
+    """Display all games. Accepts offset and limit (up to 50), after_id cursor
+    (games with a greater id, preferred over offset for later pages), and
+    status and user_id filters"""
     limit = max(0, min(50, int(request.args.get('limit', 50))))
     offset = max(0, int(request.args.get('offset', 0)))
-    games = Game.query.order_by(Game.id).limit(limit).offset(offset).all()
-    return jsonify(games=games)
+    after_id = request.args.get('after_id')
+    status = request.args.get('status')
+    user_id = request.args.get('user_id')
+    games = Game.query
+    if status != None:
+        games = games.filter(Game.status == int(status))
+    if user_id != None:
+        games = games.filter(Game.users.any(User.id == int(user_id)))
+    if after_id != None:
+        games = games.filter(Game.id > int(after_id))
+    games = games.order_by(Game.id).limit(limit).offset(offset).all()
+    return jsonify(games=Game.serialize_games(games))
+
+@app.route('/games/open')
+def get_open_games():
+    """Display created games which still have seats available, with their
+    seat counts. Accepts limit (up to 50) and after_id cursor"""
+    limit = max(0, min(50, int(request.args.get('limit', 50))))
+    after_id = request.args.get('after_id')
+    if after_id != None:
+        after_id = int(after_id)
+    games = Game.get_open_games(limit, after_id)
+    return jsonify(games=[game.serialize_for_lobby() for game in games])
 
 @app.route('/games/count')
 def count_games():
-    """Count all games."""
-    count = Game.query.count()
+    """Count all games. Accepts status filter. Counts may be stale by up to
+    COUNT_CACHE_TIMEOUT seconds"""
+    status = request.args.get('status')
+    if status != None:
+        status = int(status)
+    count = Game.count(status)
     return jsonify(count=count)
 
 @app.route('/games/<int:game_id>')
 def get_game(game_id):
-    """Display a game with its results"""
-    game = Game.find(game_id)
-    results = game.get_results()
-    return jsonify(game=game, results=results)
+    """Display a game with its results, archived or not. With
+    COALESCE_READS, concurrent requests for the same version of a game share a
+    single computation"""
+    def get_game_data():
+        game = Game.find_or_archive(game_id)
+        return dict(game=game, results=game.get_results())
+    return jsonify_once(Game.reads,
+            lambda: ('game', game_id, Game.get_read_key(game_id)), get_game_data)
+
+@app.route('/games/<int:game_id>/watch')
+def watch_game(game_id):
+    """Get the state of a game, as seen by the current user (or by
+    spectators), if it changed after the given version (since argument, or
+    get it right away). Answers 204 if nothing changed. With WATCH_LONG_POLL,
+    waits up to WATCH_TIMEOUT seconds for a change, which ties up a worker
+    unless served by gevent workers. States are serialized once per version
+    and visibility class in each process"""
+    since = int(request.args.get('since', -1))
+    user_id = current_user.id if current_user.is_authenticated else None
+    if not app.config['WATCH_LONG_POLL']:
+        version, payload = get_broadcaster().poll(game_id, since, user_id)
+        if payload == None:
+            return '', 204
+        return Response(payload, mimetype='application/json')
+    broadcaster = get_broadcaster(listen_changes=True)
+    with broadcaster.watch(game_id, user_id) as channel:
+        db.session.close()
+        version = broadcaster.wait(channel, since, app.config['WATCH_TIMEOUT'])
+        if version <= since:
+            return '', 204
+        payload = broadcaster.get_payload(channel, version, user_id)
+    return Response(payload, mimetype='application/json')
+
+@app.route('/games/<int:game_id>/viewers')
+def get_game_viewers(game_id):
+    """Count the players and spectators watching a game through this process
+    (long polls and WebSockets)"""
+    return jsonify(viewers=get_broadcaster().get_viewer_counts(game_id))
+
+@app.route('/games/<int:game_id>/replay')
+def get_game_replay(game_id):
+    """Stream the board states of a finished game, after the deal and after
+    each turn, as newline-delimited JSON"""
+    game = Game.find_or_archive(game_id)
+    game_states = game.get_replay_states()
+    def generate():
+        for game_state in game_states:
+            yield dumps(game_state.serialize()) + b'\n'
+    return Response(stream_with_context(generate()),
+            mimetype='application/x-ndjson')
 
 @app.route('/games', methods=['POST'])
 @login_required
@@ -45,6 +121,18 @@ def delete_game(game_id):
     Game.delete(game_id)
     return '', 204
 
+@app.route('/games/purge', methods=['POST'])
+@login_required
+@admin_required
+def purge_games():
+    """Delete many games at once, given their ids (admin only)"""
+    game_ids = (request.get_json(silent=True) or {}).get('game_ids')
+    if not isinstance(game_ids, list) or not all(type(game_id) == int for
+            game_id in game_ids):
+        raise SixQuiPrendException('Game ids must be a list of integers', 400)
+    count = Game.purge(game_ids)
+    return jsonify(count=count)
+
 @app.route('/games/<int:game_id>/enter', methods=['POST'])
 @login_required
 def enter_game(game_id):
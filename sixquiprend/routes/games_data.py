@@ -1,38 +1,55 @@
-from flask import session, jsonify
+from flask import request, session
 from flask_login import login_required, current_user
 from sixquiprend.models.game import Game
 from sixquiprend.models.user import User
+from sixquiprend.serialization import jsonify, jsonify_once
 from sixquiprend.sixquiprend import app, admin_required
 
 @app.route('/games/<int:game_id>/columns')
 @login_required
 def get_game_columns(game_id):
-    """Get columns for the given game"""
-    game = Game.find(game_id)
-    return jsonify(columns=game.columns.all())
+    """Get columns for the given game, archived or not. With COALESCE_READS,
+    concurrent requests for the same version of a game share a single
+    computation"""
+    return jsonify_once(Game.reads,
+            lambda: ('columns', game_id, Game.get_read_key(game_id)),
+            lambda: dict(columns=Game.find_or_archive(game_id).get_columns()))
+
+@app.route('/games/<int:game_id>/changes')
+@login_required
+def get_game_changes(game_id):
+    """Get what happened in a game since the given version (since argument):
+    its events, or its whole state if the version is too old. With
+    COALESCE_READS, identical concurrent requests share a single
+    computation"""
+    since = int(request.args.get('since', 0))
+    user_id = current_user.id
+    return jsonify_once(Game.reads,
+            lambda: ('changes', game_id, Game.get_read_key(game_id), since, user_id),
+            lambda: dict(changes=Game.find(game_id).get_changes(since, user_id)))
 
 @app.route('/games/<int:game_id>/users/<int:user_id>/status')
 @login_required
 def get_user_game_status(game_id, user_id):
-    """Get user status (has or not chosen a card) for a given game, and
-    specifies if he needs to choose a column for his card"""
-    game = Game.find(game_id)
+    """Get user status (has or not chosen a card) for a given game, archived
+    or not, and specifies if he needs to choose a column for his card"""
+    game = Game.find_or_archive(game_id)
     user = game.get_user_status(user_id)
     return jsonify(user=user)
 
 @app.route('/games/<int:game_id>/users/<int:user_id>/heap')
 @login_required
 def get_user_game_heap(game_id, user_id):
-    """Get a user's heap for a given game"""
-    game = Game.find(game_id)
+    """Get a user's heap for a given game, archived or not"""
+    game = Game.find_or_archive(game_id)
     heap = game.get_user_heap(user_id)
     return jsonify(heap=heap)
 
 @app.route('/games/<int:game_id>/users/current/hand')
 @login_required
 def get_current_user_game_hand(game_id):
-    """Get your hand for a given game"""
-    game = Game.find(game_id)
+    """Get your hand for a given game, archived or not"""
+    game = Game.find_or_archive(game_id)
     hand = game.get_user_hand(current_user.id)
     return jsonify(hand=hand)
 
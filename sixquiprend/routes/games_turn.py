@@ -1,7 +1,13 @@
-from flask import jsonify
+from flask import request
 from flask_login import login_required, current_user
+from sixquiprend.broadcast import get_broadcaster
+from sixquiprend.gateway import Gateway
+from sixquiprend.idempotency import idempotent
+from sixquiprend.models.card import Card
 from sixquiprend.models.game import Game
-from sixquiprend.sixquiprend import app
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.serialization import jsonify, is_compact
+from sixquiprend.sixquiprend import app, db
 
 @app.route('/games/<int:game_id>/status')
 @login_required
@@ -16,14 +22,19 @@ def get_game_status(game_id):
 
 @app.route('/games/<int:game_id>/card/<int:card_id>', methods=['POST'])
 @login_required
+@idempotent
 def choose_card_for_game(game_id, card_id):
-    """Choose your card to play for a game"""
+    """Choose your card to play for a game. With the compact format, cards are
+    designated by their number instead of their id"""
     game = Game.find(game_id)
+    if is_compact():
+        card_id = Card.find_by_number(card_id).id
     chosen_card = game.choose_card_for_user(current_user.id, card_id)
     return jsonify(chosen_card=chosen_card), 201
 
 @app.route('/games/<int:game_id>/bots/choose_cards', methods=['POST'])
 @login_required
+@idempotent
 def choose_cards_for_bots(game_id):
     """Choose cards for bots"""
     game = Game.find(game_id)
@@ -32,6 +43,7 @@ def choose_cards_for_bots(game_id):
 
 @app.route('/games/<int:game_id>/cards/place', methods=['POST'])
 @login_required
+@idempotent
 def place_game_card(game_id):
     """Tries to place a card for a game (only available to game owner). This call places the
     lowest value card if possible and returns the updated column and the user
@@ -42,9 +54,26 @@ def place_game_card(game_id):
 
 @app.route('/games/<int:game_id>/columns/<int:column_id>/choose', methods=['POST'])
 @login_required
+@idempotent
 def choose_column_for_card(game_id, column_id):
     """Choose a column for your card in a game (when a user must choose a
     column to replace)"""
     game = Game.find(game_id)
     [chosen_column, user_heap] = game.choose_column_for_user(current_user.id, column_id)
     return jsonify(chosen_column=chosen_column, user_heap=user_heap), 201
+
+@app.route('/games/<int:game_id>/socket')
+@login_required
+def game_socket(game_id):
+    """Open a WebSocket to receive the states of a game and play it (see
+    Gateway). Requires a server supporting WebSockets (see gateway.conf.py)"""
+    websocket = request.environ.get('wsgi.websocket')
+    if websocket == None:
+        raise SixQuiPrendException('WebSocket connection expected', 400)
+    game = Game.find(game_id)
+    user = game.find_user(current_user.id)
+    gateway = Gateway(websocket, game_id, user.id,
+            get_broadcaster(listen_changes=True))
+    db.session.close()
+    gateway.run()
+    return ''
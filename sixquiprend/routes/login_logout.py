@@ -1,19 +1,20 @@
-from flask import request, jsonify
+from flask import request, session
 from flask_login import login_required, current_user, \
      login_user, logout_user
 from sixquiprend.models.user import User
+from sixquiprend.serialization import jsonify
 from sixquiprend.sixquiprend import app
 
 @app.route('/login', methods=['POST'])
 def login():
     user = User.login(request.get_json()['username'], request.get_json()['password'])
+    session.permanent = True
     login_user(user, remember=True)
     return jsonify(user=user), 201
 
 @app.route('/logout', methods=['POST'])
 @login_required
 def logout():
-    current_user.logout()
     logout_user()
     return jsonify(), 201
 
@@ -0,0 +1,30 @@
+from flask_login import login_required, current_user
+from sixquiprend.models.matchmaking_ticket import MatchmakingTicket
+from sixquiprend.models.user import User
+from sixquiprend.serialization import jsonify
+from sixquiprend.sixquiprend import app
+
+@app.route('/matchmaking', methods=['POST'])
+@login_required
+def join_matchmaking():
+    """Wait for a game in the matchmaking queue. Players are grouped into
+    started games of MAX_PLAYER_NUMBER players, completed with bots after
+    MATCHMAKING_TIMEOUT seconds"""
+    MatchmakingTicket.join(User.find(current_user.id))
+    MatchmakingTicket.match()
+    return jsonify(ticket=MatchmakingTicket.find(current_user.id)), 201
+
+@app.route('/matchmaking')
+@login_required
+def get_matchmaking_ticket():
+    """Get current user's matchmaking ticket, with the id of their game once
+    matched (by the next player joining, or by the turn scheduler once timed
+    out)"""
+    return jsonify(ticket=MatchmakingTicket.find(current_user.id))
+
+@app.route('/matchmaking', methods=['DELETE'])
+@login_required
+def leave_matchmaking():
+    """Leave the matchmaking queue"""
+    MatchmakingTicket.leave(current_user.id)
+    return '', 204
@@ -1,6 +1,8 @@
-from flask import request, jsonify
+from flask import request
 from flask_login import login_required, current_user
+from sixquiprend.models.game import Game
 from sixquiprend.models.user import User
+from sixquiprend.serialization import jsonify
 from sixquiprend.sixquiprend import app, admin_required
 
 @app.route('/users', methods=['GET'])
@@ -8,13 +10,17 @@ from sixquiprend.sixquiprend import app, admin_required
 @admin_required
 def get_users():
     """Display all users (admin only). Accepts offset and limit (up to 50),
-    and active argument filter"""
+    after_id cursor (users with a greater id, preferred over offset for later
+    pages), and active argument filter"""
     limit = max(0, min(50, int(request.args.get('limit', 50))))
     offset = max(0, int(request.args.get('offset', 0)))
+    after_id = request.args.get('after_id')
     active = request.args.get('active')
     users = User.query
     if active != None:
         users = User.query.filter(User.active == (active != 'false'))
+    if after_id != None:
+        users = users.filter(User.id > int(after_id))
     users = users.order_by(User.id).limit(limit).offset(offset).all()
     return jsonify(users=users)
 
@@ -22,12 +28,12 @@ def get_users():
 @login_required
 @admin_required
 def count_users():
-    """Count all users (admin only). Accepts active argument filter"""
+    """Count all users (admin only). Accepts active argument filter. Counts may
+    be stale by up to COUNT_CACHE_TIMEOUT seconds"""
     active = request.args.get('active')
-    users = User.query
     if active != None:
-        users = User.query.filter(User.active == (active != 'false'))
-    count = users.count()
+        active = active != 'false'
+    count = User.count(active)
     return jsonify(count=count)
 
 @app.route('/users/<int:user_id>/activate', methods=['PUT'])
@@ -64,3 +70,13 @@ def get_current_user():
         return jsonify(user=user)
     else:
         return jsonify(user={})
+
+@app.route('/users/current/games')
+@login_required
+def get_current_user_games():
+    """Get current user's created and started games, with whether they have
+    chosen a card or need to choose a column, and for the games they own,
+    whether they can place a card or choose cards for bots. Meant to be
+    polled instead of each game's statuses"""
+    games = Game.get_user_dashboard(current_user.id)
+    return jsonify(games=games)
@@ -0,0 +1,113 @@
+from datetime import datetime
+from sixquiprend.models.game import Game
+from sixquiprend.models.matchmaking_ticket import MatchmakingTicket
+from sixquiprend.sixquiprend import app, db
+import heapq
+import threading
+
+class DeadlineScheduler:
+    """Plays the turns whose deadline passed (see Game.auto_play), and
+    matches the players waiting in the matchmaking queue on each run. The
+    upcoming deadlines are kept in a heap, reloaded from the database every
+    SCHEDULER_REFRESH_INTERVAL seconds to catch the ones set by other
+    processes, and the scheduler sleeps until the earliest one.
+
+    One scheduler runs per node, and a game is only played by the one which
+    claimed its expired deadline (Game.claim_expired_turn), so heap entries
+    made stale by moves or by other schedulers cost a single update."""
+
+    def __init__(self):
+        self.heap = []
+        self.refreshed_at = None
+        self.stopped = threading.Event()
+
+    def refresh(self, now):
+        self.heap = [(deadline, game_id) for game_id, deadline in
+                Game.get_turn_deadlines(app.config['SCHEDULER_BATCH_SIZE'])]
+        heapq.heapify(self.heap)
+        self.refreshed_at = now
+        db.session.close()
+
+    def run_once(self, now=None):
+        """Play the turns expired at the given time, each game at most once,
+        and return their games' ids. Then match the waiting players"""
+        now = now or datetime.utcnow()
+        if self.refreshed_at == None or (now - self.refreshed_at).total_seconds() >= \
+                app.config['SCHEDULER_REFRESH_INTERVAL']:
+            self.refresh(now)
+        expired_game_ids = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            deadline, game_id = heapq.heappop(self.heap)
+            expired_game_ids.append(game_id)
+        game_ids = [game_id for game_id in expired_game_ids if self.play(game_id,
+            now)]
+        self.match(now)
+        return game_ids
+
+    def play(self, game_id, now):
+        try:
+            if not Game.claim_expired_turn(game_id, now):
+                return False
+            game = Game.find(game_id)
+            game.auto_play()
+            if game.turn_deadline != None:
+                heapq.heappush(self.heap, (game.turn_deadline, game_id))
+            return True
+        except Exception:
+            # Retried once the lease expires
+            db.session.rollback()
+            app.logger.exception('Could not play the turn of game %s', game_id)
+            return False
+        finally:
+            db.session.close()
+
+    def match(self, now):
+        try:
+            MatchmakingTicket.match(now)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Could not match the waiting players')
+        finally:
+            db.session.close()
+
+    def get_timeout(self, now):
+        """Seconds until the earliest deadline or the next refresh"""
+        timeout = app.config['SCHEDULER_REFRESH_INTERVAL'] - \
+                (now - self.refreshed_at).total_seconds()
+        if len(self.heap) > 0:
+            timeout = min(timeout, (self.heap[0][0] - now).total_seconds())
+        return max(0, timeout)
+
+    def run(self):
+        """Run until stopped. Failed runs (e.g. while the database is down)
+        are logged and retried after SCHEDULER_REFRESH_INTERVAL seconds, as
+        nothing restarts the scheduler"""
+        with app.app_context():
+            while not self.stopped.is_set():
+                try:
+                    self.run_once()
+                    timeout = self.get_timeout(datetime.utcnow())
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Scheduler run failed')
+                    self.refreshed_at = None
+                    timeout = app.config['SCHEDULER_REFRESH_INTERVAL']
+                finally:
+                    db.session.close()
+                self.stopped.wait(timeout)
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def start_scheduler():
+    """Run a scheduler in a daemon thread of this process, if
+    TURN_SCHEDULER_ENABLED. Meant to be registered as a before_first_request
+    hook; dedicated processes use the run_scheduler command instead"""
+    global scheduler
+    if not app.config['TURN_SCHEDULER_ENABLED']:
+        return
+    with scheduler_lock:
+        if scheduler == None:
+            scheduler = DeadlineScheduler()
+            threading.Thread(target=scheduler.run, name='turn-scheduler',
+                    daemon=True).start()
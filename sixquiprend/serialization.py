@@ -0,0 +1,85 @@
+from flask import Response, current_app, has_request_context, request
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def serialize_default(obj):
+    """Called by the encoders for objects they can't encode natively (i.e.
+    models)"""
+    return obj.serialize()
+
+def serialize_compact_default(obj):
+    """Same as serialize_default, but prefers the compact representation of
+    models which have one (cards are reduced to their number)"""
+    if hasattr(obj, 'serialize_compact'):
+        return obj.serialize_compact()
+    return obj.serialize()
+
+def is_compact():
+    """Whether the current request asked for the compact format
+    (?format=compact)"""
+    return has_request_context() and request.args.get('format') == 'compact'
+
+def dumps(obj, compact=False):
+    """Encode obj to JSON bytes, using orjson when available and the standard
+    library otherwise"""
+    default = serialize_compact_default if compact else serialize_default
+    if orjson != None:
+        return orjson.dumps(obj, default=default,
+                option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default,
+            separators=(',', ':')).encode('utf-8')
+
+def jsonify(*args, **kwargs):
+    """Drop-in replacement for flask.jsonify using dumps"""
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    return Response(dumps(data, is_compact()), mimetype='application/json')
+
+def jsonify_once(flight, get_key, compute):
+    """Same as jsonify(compute()), but with COALESCE_READS, concurrent calls
+    with the same key (given by get_key, and format) share a single
+    computation and encoding, through the given SingleFlight. Calls only
+    overlap within a process with threaded or gevent workers, so this is
+    useless (and get_key a wasted query) with sync workers"""
+    if not current_app.config['COALESCE_READS']:
+        return jsonify(compute())
+    compact = is_compact()
+    data = flight.do(get_key() + (compact,), lambda: dumps(compute(), compact))
+    return Response(data, mimetype='application/json')
+
+def compress_response(response):
+    """Compress JSON responses with brotli (when installed) or gzip, depending
+    on the client's Accept-Encoding. Meant to be registered as an
+    after_request hook"""
+    if response.mimetype != 'application/json' or response.direct_passthrough \
+            or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    accept_encodings = request.accept_encodings
+    if brotli != None and accept_encodings['br'] > 0:
+        data = brotli.compress(data, quality=current_app.config['BROTLI_QUALITY'])
+        response.headers['Content-Encoding'] = 'br'
+    elif accept_encodings['gzip'] > 0:
+        data = gzip.compress(data, compresslevel=current_app.config['GZIP_LEVEL'])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.set_data(data)
+    return response
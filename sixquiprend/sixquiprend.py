@@ -2,6 +2,7 @@ from flask import Flask
 from flask.json import JSONEncoder
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 app.config.from_object(__name__) # load config from this file , sixquiprend.py
@@ -14,11 +15,22 @@ from sixquiprend.utils import *
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
+from sixquiprend.models.counter import Counter
 from sixquiprend.models.game import Game
+from sixquiprend.models.game_archive import GameArchive
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_snapshot import GameSnapshot
 from sixquiprend.models.hand import Hand
 from sixquiprend.models.heap import Heap
+from sixquiprend.models.idempotency_key import IdempotencyKey
+from sixquiprend.models.matchmaking_ticket import MatchmakingTicket
+from sixquiprend.models.rate_limit_bucket import RateLimitBucket
 from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
 from sixquiprend.models.user import User
+from sixquiprend.rate_limit import check_rate_limit
+from sixquiprend.scheduler import start_scheduler
+from sixquiprend.serialization import jsonify, serialize_default, \
+        compress_response
 from functools import wraps
 
 def admin_required(func):
@@ -35,13 +47,18 @@ login_manager.init_app(app)
 
 class MyJSONEncoder(JSONEncoder):
     def default(self, obj):
-        return obj.serialize()
+        return serialize_default(obj)
 
 app.json_encoder = MyJSONEncoder
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+        x_proto=0)
+app.before_first_request(start_scheduler)
+app.before_request(check_rate_limit)
+app.after_request(compress_response)
 
 @login_manager.user_loader
 def load_user(username):
-    return User.query.filter(User.username == username).first()
+    return User.load(username)
 
 @login_manager.unauthorized_handler
 def unauthorized():
@@ -49,11 +66,13 @@ def unauthorized():
 
 @app.errorhandler(SixQuiPrendException)
 def _(error):
-    return jsonify(error=error.message), error.code
+    return jsonify(error=error.message), error.code, error.headers
 
+from sixquiprend.routes.batch import *
 from sixquiprend.routes.games import *
 from sixquiprend.routes.games_data import *
 from sixquiprend.routes.games_turn import *
 from sixquiprend.routes.login_logout import *
+from sixquiprend.routes.matchmaking import *
 from sixquiprend.routes.templates import *
 from sixquiprend.routes.users import *
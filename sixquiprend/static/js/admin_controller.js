@@ -10,6 +10,7 @@ app.controller('AdminController', ['$scope', '$http', 'growl',
       limit: 25,
       user_active: 'true',
       display_users: false,
+      cursors: [0]
     };
 
     // Methods
@@ -22,7 +23,7 @@ app.controller('AdminController', ['$scope', '$http', 'growl',
         $http.get('/users', { params: {
           active: $scope.ui.user_active,
           limit: $scope.ui.limit,
-          offset: ($scope.ui.page - 1)*$scope.ui.limit
+          after_id: $scope.ui.cursors[$scope.ui.page - 1]
         } })
         .then(function(response) {
           $scope.users = response.data.users;
@@ -35,6 +36,7 @@ app.controller('AdminController', ['$scope', '$http', 'growl',
     };
 
     $scope.increase_users_page = function() {
+      $scope.ui.cursors[$scope.ui.page] = $scope.users[$scope.users.length - 1].id;
       $scope.ui.page = $scope.ui.page + 1;
       $scope.get_users();
     }
@@ -74,6 +76,8 @@ app.controller('AdminController', ['$scope', '$http', 'growl',
     // Events
 
     $scope.$watchGroup(['ui.user_active', 'ui.limit'], function() {
+      $scope.ui.page = 1;
+      $scope.ui.cursors = [0];
       $scope.get_users();
     });
 
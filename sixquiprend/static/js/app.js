@@ -5,3 +5,37 @@ var app = angular.module('SixQuiPrendApp', ['angular-growl']);
 app.config(['growlProvider', function(growlProvider) {
   growlProvider.globalTimeToLive(5000);
 }])
+
+// Wait for the Retry-After delay of rate limited (429) responses before
+// sending further requests
+app.factory('retryAfterInterceptor', ['$q', '$rootScope', '$timeout',
+  function($q, $rootScope, $timeout) {
+    $rootScope.throttled_until = 0;
+    $rootScope.throttle = function(retry_after) {
+      $rootScope.throttled_until = Math.max($rootScope.throttled_until,
+        Date.now() + (retry_after || 1) * 1000);
+    };
+    $rootScope.is_throttled = function() {
+      return Date.now() < $rootScope.throttled_until;
+    };
+    return {
+      request: function(config) {
+        var delay = $rootScope.throttled_until - Date.now();
+        if (delay <= 0)
+          return config;
+        return $timeout(function() {
+          return config;
+        }, delay, false);
+      },
+      responseError: function(response) {
+        if (response.status == 429)
+          $rootScope.throttle(parseInt(response.headers('Retry-After')));
+        return $q.reject(response);
+      }
+    };
+  }
+]);
+
+app.config(['$httpProvider', function($httpProvider) {
+  $httpProvider.interceptors.push('retryAfterInterceptor');
+}]);
@@ -1,7 +1,7 @@
 'use strict';
 
-app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval', 'growl',
-  function($rootScope, $scope, $http, $interval, growl) {
+app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval', '$q', 'growl',
+  function($rootScope, $scope, $http, $interval, $q, growl) {
 
     // Variables
 
@@ -11,6 +11,9 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
     $scope.game_statuses = ['created', 'started', 'ended'];
     $scope.user_roles = ['bot', 'user', 'admin'];
+    $scope.event_types = ['deal', 'choose', 'take_column', 'place', 'leave'];
+    $scope.socket = null;
+    var socket_request_id = 0;
 
     // Methods
 
@@ -21,6 +24,9 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
       .then(function(response) {
         $scope.current_game = response.data.game;
         $rootScope.is_in_game = true;
+        if (!$scope.socket && $scope.is_in_current_game() &&
+          $scope.current_game.status == $scope.game_statuses.indexOf('started'))
+          $scope.open_socket();
         $scope.is_resolving_turn = $scope.current_game.is_resolving_turn;
         switch($scope.current_game.status) {
           case $scope.game_statuses.indexOf('created'):
@@ -51,6 +57,206 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
       });
     };
 
+    // Game socket (players only), replacing polling and action requests
+
+    $scope.open_socket = function() {
+      $scope.close_socket();
+      var protocol = window.location.protocol == 'https:' ? 'wss://' : 'ws://';
+      var socket = new WebSocket(protocol + window.location.host + '/games/' +
+        $scope.current_game.id + '/socket');
+      socket.onmessage = function(event) {
+        var message = JSON.parse(event.data);
+        $scope.$apply(function() {
+          if (message.type == 'state') {
+            if ($scope.current_game && message.version != $scope.current_game.version)
+              $scope.get_changes();
+          } else if (message.error) {
+            if (message.retry_after)
+              $rootScope.throttle(message.retry_after);
+            growl.addErrorMessage(message.error);
+          }
+        });
+      };
+      socket.onclose = function() {
+        if ($scope.socket == socket)
+          $scope.socket = null;
+      };
+      $scope.socket = socket;
+    };
+
+    $scope.close_socket = function() {
+      if ($scope.socket) {
+        $scope.socket.close();
+        $scope.socket = null;
+      }
+    };
+
+    $scope.send_action = function(action, params) {
+      if (!$scope.socket || $scope.socket.readyState != WebSocket.OPEN)
+        return false;
+      var message = angular.extend({id: ++socket_request_id, action: action}, params);
+      $scope.socket.send(JSON.stringify(message));
+      return true;
+    };
+
+    // Moves are sent with an Idempotency-Key, so that they can be retried
+    // after a timeout without being played twice
+    $scope.post_move = function(url) {
+      var key = Date.now().toString(36) + Math.random().toString(36).slice(2);
+      var post = function(retries) {
+        return $http.post(url, null, {
+          headers: {'Idempotency-Key': key},
+          timeout: 10000
+        })
+        .catch(function(response) {
+          if (retries > 0 && (response.status <= 0 || response.status == 409))
+            return post(retries - 1);
+          return $q.reject(response);
+        });
+      };
+      return post(2);
+    };
+
+    // A single request at a time, so that events are applied once
+    var changes_request = null;
+    var changes_requested = false;
+
+    $scope.get_changes = function() {
+      if (changes_request) {
+        changes_requested = true;
+        return;
+      }
+      var game = $scope.current_game;
+      var since = game.version;
+      changes_request = $http.get('/games/' + game.id + '/changes', {
+        params: {since: since}
+      })
+      .then(function(response) {
+        var changes = response.data.changes;
+        if ($scope.current_game != game || game.version != since)
+          return;
+        if (changes.status != $scope.current_game.status || changes.state ||
+          !$scope.columns || !$scope.apply_events(changes.events)) {
+          $scope.get_game();
+          return;
+        }
+        $scope.current_game.version = changes.version;
+        if (changes.user_count != $scope.current_game.users.length) {
+          $scope.get_game();
+          return;
+        }
+        var was_resolving_turn = $scope.is_resolving_turn;
+        $scope.is_resolving_turn = $scope.current_game.is_resolving_turn =
+          changes.is_resolving_turn;
+        // Other players' cards are only revealed once the turn is resolved
+        if ($scope.is_resolving_turn && !was_resolving_turn)
+          $scope.get_chosen_cards().then($scope.update_column_choices);
+        else
+          $scope.update_column_choices();
+      }, function(response) {
+        growl.addErrorMessage(response.data.error);
+      })
+      .finally(function() {
+        changes_request = null;
+        if (changes_requested && $scope.current_game) {
+          changes_requested = false;
+          $scope.get_changes();
+        }
+      });
+    };
+
+    // Events received from /changes are applied to the local board, rather
+    // than reloading the whole game. Returns false for events that cannot be
+    // applied (deal), the game then being reloaded
+
+    $scope.apply_events = function(events) {
+      for (var i = 0; i < events.length; ++i) {
+        var event = events[i];
+        var user_id = event.user_id;
+        var column = find_by_key($scope.columns, 'id', event.data.column_id);
+        if ((event.type == $scope.event_types.indexOf('choose') ||
+          event.type == $scope.event_types.indexOf('place')) && !$scope.users[user_id])
+          return false;
+        if ((event.type == $scope.event_types.indexOf('take_column') ||
+          event.type == $scope.event_types.indexOf('place')) && !column)
+          return false;
+        switch(event.type) {
+          case $scope.event_types.indexOf('choose'):
+            $scope.users[user_id].has_chosen_card = true;
+            if (event.data.card !== undefined) {
+              $scope.user_chosen_cards[user_id] = get_card(event.data.card);
+              if (user_id == $rootScope.current_user.id && $scope.hand)
+                remove_by_key($scope.hand.cards, 'number', event.data.card);
+            }
+            break;
+          case $scope.event_types.indexOf('take_column'):
+            $scope.user_heaps[user_id] = ($scope.user_heaps[user_id] || []).concat(column.cards);
+            column.cards = [];
+            break;
+          case $scope.event_types.indexOf('place'):
+            column.cards.push(get_card(event.data.card));
+            delete $scope.user_chosen_cards[user_id];
+            $scope.users[user_id].has_chosen_card = false;
+            break;
+          case $scope.event_types.indexOf('leave'):
+            remove_by_key($scope.current_game.users, 'id', user_id);
+            delete $scope.users[user_id];
+            delete $scope.user_heaps[user_id];
+            delete $scope.user_chosen_cards[user_id];
+            break;
+          default:
+            return false;
+        }
+      }
+      return true;
+    };
+
+    // Same rule as the server: the lowest chosen card is lower than the last
+    // card of every column
+
+    $scope.update_column_choices = function() {
+      var lowest_user_id = null;
+      angular.forEach($scope.users, function(user, user_id) {
+        user.needs_to_choose_column = false;
+        var card = $scope.user_chosen_cards[user_id];
+        if (card && (lowest_user_id == null ||
+          card.number < $scope.user_chosen_cards[lowest_user_id].number))
+          lowest_user_id = user_id;
+      });
+      if (!$scope.is_resolving_turn || lowest_user_id == null)
+        return;
+      var number = $scope.user_chosen_cards[lowest_user_id].number;
+      $scope.users[lowest_user_id].needs_to_choose_column =
+        $scope.columns.every(function(column) {
+          return column.cards.length > 0 &&
+            column.cards[column.cards.length - 1].number > number;
+        });
+    };
+
+    // Cards already received keep their id, others are built from their
+    // number
+
+    var get_card = function(number) {
+      var cards = ($scope.hand ? $scope.hand.cards : []);
+      angular.forEach($scope.columns, function(column) {
+        cards = cards.concat(column.cards);
+      });
+      angular.forEach($scope.user_chosen_cards, function(card) {
+        cards.push(card);
+      });
+      var card = find_by_key(cards, 'number', number);
+      if (card)
+        return card;
+      var cow_value = 0;
+      if (number % 10 == 5)
+        cow_value += 2;
+      if (number % 10 == 0)
+        cow_value += 3;
+      if (number % 11 == 0)
+        cow_value += 5;
+      return {number: number, cow_value: cow_value || 1};
+    };
+
     $scope.get_game_status = function() {
       $http.get('/games/' + $scope.game_id + '/status')
       .then(function(response) {
@@ -109,7 +315,7 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
 
     $scope.get_chosen_cards = function() {
-      $http.get('/games/' + $scope.current_game.id + '/chosen_cards')
+      return $http.get('/games/' + $scope.current_game.id + '/chosen_cards')
       .then(function(response) {
         angular.forEach(response.data.chosen_cards, function(chosen_card) {
           $scope.user_chosen_cards[chosen_card.user_id] = chosen_card.card;
@@ -138,6 +344,7 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
       } else {
         $http.put('/games/' + $scope.current_game.id + '/leave')
         .then(function(response) {
+          $scope.close_socket();
           $scope.current_game = null;
           $rootScope.is_in_game = false;
         }, function(response) {
@@ -156,12 +363,15 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
 
     $scope.hide_game = function() {
+      $scope.close_socket();
       $scope.current_game = null;
       $rootScope.is_in_game = false;
     };
 
     $scope.choose_card = function(card_id) {
-      $http.post('/games/' + $scope.current_game.id + '/card/' + card_id)
+      if ($scope.send_action('choose_card', {card_id: card_id}))
+        return;
+      $scope.post_move('/games/' + $scope.current_game.id + '/card/' + card_id)
       .then(function(response) {
         $scope.get_user_status($scope.current_user.id);
         $scope.get_chosen_cards();
@@ -171,7 +381,9 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
 
     $scope.choose_cards_for_bots = function() {
-      $http.post('/games/' + $scope.current_game.id + '/bots/choose_cards')
+      if ($scope.send_action('choose_cards_for_bots', {}))
+        return;
+      $scope.post_move('/games/' + $scope.current_game.id + '/bots/choose_cards')
       .then(function(response) {
         $scope.get_game();
       }, function(response) {
@@ -180,7 +392,9 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
 
     $scope.place_card = function() {
-      $http.post('/games/' + $scope.current_game.id + '/cards/place')
+      if ($scope.send_action('place_card', {}))
+        return;
+      $scope.post_move('/games/' + $scope.current_game.id + '/cards/place')
       .then(function(response) {
         $scope.get_game();
       }, function(response) {
@@ -189,7 +403,9 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     };
 
     $scope.choose_column = function(column_id) {
-      $http.post('/games/' + $scope.current_game.id + '/columns/' + column_id + '/choose')
+      if ($scope.send_action('choose_column', {column_id: column_id}))
+        return;
+      $scope.post_move('/games/' + $scope.current_game.id + '/columns/' + column_id + '/choose')
       .then(function(response) {
         $scope.get_game();
       }, function(response) {
@@ -227,23 +443,30 @@ app.controller('GameController', ['$rootScope', '$scope', '$http', '$interval',
     // Events
 
     $scope.$on('game_chosen', function(event, game_id) {
+      $scope.close_socket();
       $scope.game_id = game_id;
       $scope.user_heaps = {};
       $scope.users = {};
       $scope.user_chosen_cards = {};
+      $scope.columns = null;
+      $scope.hand = null;
       $scope.get_game();
     });
 
+    // Polls are skipped while rate limited
     $interval(function() {
-      if ($scope.current_game &&
+      if (!$rootScope.is_throttled() && $scope.current_game &&
         $scope.current_game.owner_id == $rootScope.current_user.id &&
         $scope.game_statuses.indexOf('started') == $scope.current_game.status)
         $scope.get_game_status();
     }, 2000);
 
+    // Only reload the game when something happened, unless notified by the
+    // socket
     $interval(function() {
-      if ($scope.current_game && $scope.current_game.status < 2)
-        $scope.get_game();
+      if (!$scope.socket && !$rootScope.is_throttled() && $scope.current_game &&
+        $scope.current_game.status < 2)
+        $scope.get_changes();
     }, 2000);
   }
 ]);
@@ -1,13 +1,14 @@
 'use strict';
 
-app.controller('HomeController', ['$rootScope', '$scope', '$http', 'growl',
-  function($rootScope, $scope, $http, growl) {
+app.controller('HomeController', ['$rootScope', '$scope', '$http', '$interval', 'growl',
+  function($rootScope, $scope, $http, $interval, growl) {
 
     // Variables
 
     $scope.ui = {
       page: 1,
-      limit: 25
+      limit: 25,
+      cursors: [0]
     };
 
     $scope.game_statuses = ['created', 'started', 'ended'];
@@ -17,7 +18,7 @@ app.controller('HomeController', ['$rootScope', '$scope', '$http', 'growl',
     $scope.get_games = function() {
       $http.get('/games', { params: {
         limit: $scope.ui.limit,
-        offset: ($scope.ui.page - 1)*$scope.ui.limit
+        after_id: $scope.ui.cursors[$scope.ui.page - 1]
       } })
       .then(function(response) {
         $scope.games = response.data.games;
@@ -32,7 +33,63 @@ app.controller('HomeController', ['$rootScope', '$scope', '$http', 'growl',
       });
     };
 
+    // Current user's games, with what they have to do in each one
+    $scope.get_user_games = function() {
+      $http.get('/users/current/games')
+      .then(function(response) {
+        $scope.user_games = response.data.games;
+      }, function(response) {
+        $scope.user_games = [];
+      });
+    };
+
+    $scope.must_act = function(game) {
+      if (game.status != $scope.game_statuses.indexOf('started'))
+        return false;
+      return (!game.is_resolving_turn && !game.has_chosen_card) ||
+        game.needs_to_choose_column || game.can_place_card ||
+        game.can_choose_cards_for_bots;
+    };
+
+    // Matchmaking
+
+    $scope.join_matchmaking = function() {
+      $http.post('/matchmaking')
+      .then(function(response) {
+        $scope.update_ticket(response.data.ticket);
+      }, function(response) {
+        growl.addErrorMessage(response.data.error);
+      });
+    };
+
+    $scope.get_matchmaking_ticket = function() {
+      $http.get('/matchmaking')
+      .then(function(response) {
+        $scope.update_ticket(response.data.ticket);
+      }, function(response) {
+        $scope.ticket = null;
+      });
+    };
+
+    $scope.leave_matchmaking = function() {
+      $http.delete('/matchmaking')
+      .then(function(response) {
+        $scope.ticket = null;
+      }, function(response) {
+        growl.addErrorMessage(response.data.error);
+      });
+    };
+
+    $scope.update_ticket = function(ticket) {
+      $scope.ticket = ticket;
+      if (ticket.game_id) {
+        $scope.ticket = null;
+        $rootScope.$broadcast('game_chosen', ticket.game_id);
+      }
+    };
+
     $scope.increase_games_page = function() {
+      $scope.ui.cursors[$scope.ui.page] = $scope.games[$scope.games.length - 1].id;
       $scope.ui.page = $scope.ui.page + 1;
       $scope.get_games();
     }
@@ -100,7 +157,19 @@ app.controller('HomeController', ['$rootScope', '$scope', '$http', 'growl',
     // Events
 
     $scope.$watch('ui.limit', function() {
+      $scope.ui.page = 1;
+      $scope.ui.cursors = [0];
       $scope.get_games();
     });
+
+    $interval(function() {
+      if ($rootScope.current_user && !$rootScope.is_throttled())
+        $scope.get_user_games();
+    }, 5000);
+
+    $interval(function() {
+      if ($scope.ticket && !$rootScope.is_throttled())
+        $scope.get_matchmaking_ticket();
+    }, 2000);
   }
 ]);
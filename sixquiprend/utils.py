@@ -1,8 +1,16 @@
-from passlib.hash import bcrypt
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy.dialects.postgresql import insert
+from sixquiprend.hashing import hash_password
 from sixquiprend.models.card import Card
+from sixquiprend.models.counter import Counter
+from sixquiprend.models.game import Game
+from sixquiprend.models.idempotency_key import IdempotencyKey
 from sixquiprend.models.user import User
+from sixquiprend.partitioning import create_partitions
+from sixquiprend.scheduler import DeadlineScheduler
 from sixquiprend.sixquiprend import app, db
+from datetime import datetime, timedelta
+import click
 import psycopg2
 
 def create_db():
@@ -25,43 +33,68 @@ def populate_db():
     add_cards()
     add_admin()
     add_bots()
+    sync_counters()
 
 def add_cards():
     if Card.query.count() == 0:
-        for i in range(1, app.config['MAX_CARD_NUMBER'] + 1):
-            cow_value = 0
-            if i % 10 == 5:
-                cow_value += 2
-            if i % 10 == 0:
-                cow_value += 3
-            if i % 11 == 0:
-                cow_value += 5
-            if cow_value == 0:
-                cow_value = 1
-            card = Card(number=i, cow_value=cow_value)
-            db.session.add(card)
+        cards = [{'number': i, 'cow_value': Card.get_cow_value(i)}
+                for i in range(1, app.config['MAX_CARD_NUMBER'] + 1)]
+        db.session.execute(insert(Card.__table__).values(cards))
         db.session.commit()
         print('Added cards')
 
 def add_admin():
     if not User.query.filter(User.username == app.config['ADMIN_USERNAME']).first():
         admin = User(username=app.config['ADMIN_USERNAME'],
-                password=bcrypt.hash(app.config['ADMIN_PASSWORD']),
+                password=hash_password(app.config['ADMIN_PASSWORD']),
                 urole=User.ROLE_ADMIN, active=True)
         db.session.add(admin)
         db.session.commit()
         print('Added admin user')
 
-def add_bots():
-    for bot_name in app.config['BOT_NAMES']:
-        if not User.query.filter(User.username == bot_name).first():
-            # password is irrelevant, as bots cannot login
-            admin = User(username=bot_name,
-                    password=bcrypt.hash(bot_name),
-                    urole=User.ROLE_BOT, active=True)
-            db.session.add(admin)
-            db.session.commit()
-            print('Added bot', bot_name)
+def add_bots(bot_names=None):
+    """Insert missing bots in bulk, BOT_INSERT_SIZE at a time. Bots are given
+    no password, as they cannot login"""
+    if bot_names == None:
+        bot_names = app.config['BOT_NAMES']
+    bot_names = list(bot_names)
+    added_bot_count = 0
+    for i in range(0, len(bot_names), app.config['BOT_INSERT_SIZE']):
+        bots = [{'username': bot_name, 'urole': User.ROLE_BOT, 'active': True}
+                for bot_name in bot_names[i:i + app.config['BOT_INSERT_SIZE']]]
+        statement = insert(User.__table__).values(bots) \
+                .on_conflict_do_nothing(index_elements=['username']) \
+                .returning(User.__table__.c.id)
+        added_bot_count += len(db.session.execute(statement).fetchall())
+    # Bulk inserts bypass the ORM events maintaining counters
+    Counter.increment(db.session.connection(), User.get_active_counter_name(True),
+            added_bot_count)
+    db.session.commit()
+    print('Added', added_bot_count, 'bots')
+    return added_bot_count
+
+def sync_counters():
+    counts = Game.get_counter_values()
+    counts.update(User.get_counter_values())
+    Counter.rebuild(counts)
+    Game.sync_user_counts()
+    print('Synchronized counters')
+
+def archive_games(days, batch_size):
+    finished_before = datetime.utcnow() - timedelta(days=days)
+    archived_game_count = 0
+    while True:
+        game_count = Game.archive_games(finished_before, batch_size)
+        archived_game_count += game_count
+        if game_count < batch_size:
+            break
+    print('Archived', archived_game_count, 'games')
+    return archived_game_count
+
+def purge_idempotency_keys(hours):
+    count = IdempotencyKey.purge(datetime.utcnow() - timedelta(hours=hours))
+    print('Purged', count, 'idempotency keys')
+    return count
 
 @app.cli.command('create_db')
 def create_db_command():
@@ -73,6 +106,43 @@ def populate_db_command():
     populate_db()
     print('Created the database.')
 
+@app.cli.command('sync_counters')
+def sync_counters_command():
+    sync_counters()
+
+@app.cli.command('add_bots')
+@click.option('--count', default=0, help='Number of bots to create (default: BOT_NAMES)')
+@click.option('--prefix', default='Bot #', help='Name prefix of created bots')
+def add_bots_command(count, prefix):
+    if count > 0:
+        add_bots(prefix + str(i) for i in range(1, count + 1))
+    else:
+        add_bots()
+
+@app.cli.command('archive_games')
+@click.option('--days', default=30, help='Archive games finished for at least this many days')
+@click.option('--batch-size', default=100, help='Number of games archived per transaction')
+def archive_games_command(days, batch_size):
+    archive_games(days, batch_size)
+
+@app.cli.command('purge_idempotency_keys')
+@click.option('--hours', default=24, help='Purge idempotency keys older than this many hours')
+def purge_idempotency_keys_command(hours):
+    purge_idempotency_keys(hours)
+
+@app.cli.command('create_partitions')
+@click.option('--months', default=3, help='Number of months to create partitions for, starting with the current one')
+def create_partitions_command(months):
+    partition_names = create_partitions(months)
+    print('Created', len(partition_names), 'partitions')
+
+@app.cli.command('run_scheduler')
+def run_scheduler_command():
+    if app.config['TURN_TIMEOUT'] == 0:
+        print('TURN_TIMEOUT is not set, turns have no deadline')
+    print('Playing the turns of idle players')
+    DeadlineScheduler().run()
+
 @app.cli.command('init_db')
 def init_db_command():
     db.create_all()
@@ -52,5 +52,22 @@ class CardTestCase(unittest.TestCase):
             Card.find(-1)
             assert e.exception.code == 404
 
+    def test_find_by_number(self):
+        card = self.create_card(number=42)
+        assert Card.find_by_number(42) == card
+
+    def test_find_by_number_errors(self):
+        # Card not found
+        with self.assertRaises(SixQuiPrendException) as e:
+            Card.find_by_number(-1)
+            assert e.exception.code == 404
+
+    def test_get_cow_value(self):
+        assert Card.get_cow_value(1) == 1
+        assert Card.get_cow_value(5) == 2
+        assert Card.get_cow_value(10) == 3
+        assert Card.get_cow_value(11) == 5
+        assert Card.get_cow_value(55) == 7
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,17 +1,27 @@
 from flask import Flask
 from passlib.hash import bcrypt
+from sqlalchemy.exc import OperationalError
 from sixquiprend.config import *
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
+from sixquiprend.models.counter import Counter
 from sixquiprend.models.game import Game
-from sixquiprend.models.hand import Hand
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_snapshot import GameSnapshot
+from sixquiprend.models.game_state import GameState
+from sixquiprend.models.hand import Hand, hand_cards
 from sixquiprend.models.heap import Heap
 from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
-from sixquiprend.models.user import User
+from sixquiprend.models.user import User, user_games
+from sixquiprend.partitioning import *
+from sixquiprend.scheduler import DeadlineScheduler
 from sixquiprend.sixquiprend import app, db
 from sixquiprend.utils import *
+from datetime import datetime, timedelta
 import random
+import threading
+import time
 import unittest
 
 class GameTestCase(unittest.TestCase):
@@ -98,6 +108,20 @@ class GameTestCase(unittest.TestCase):
         db.session.commit()
         return card
 
+    def play_game(self, game, user):
+        """Play a started game until its end, user being the owner and all
+        other players bots"""
+        while game.status == Game.STATUS_STARTED:
+            game.choose_card_for_user(user.id)
+            game.choose_cards_for_bots(user.id)
+            while game.is_resolving_turn:
+                if game.user_needs_to_choose_column(user.id):
+                    column = game.get_lowest_value_column()
+                    game.choose_column_for_user(user.id, column.id)
+                    game.update_status()
+                else:
+                    game.place_card(user.id)
+
     ################################################################################
     ## Getters
     ################################################################################
@@ -112,6 +136,67 @@ class GameTestCase(unittest.TestCase):
             Game.find(-1)
             assert e.exception.code == 404
 
+    def test_count(self):
+        game1 = self.create_game(status=Game.STATUS_CREATED)
+        game2 = self.create_game(status=Game.STATUS_CREATED)
+        game3 = self.create_game(status=Game.STATUS_STARTED)
+        assert Game.count() == 3
+        assert Game.count(Game.STATUS_CREATED) == 2
+        assert Game.count(Game.STATUS_STARTED) == 1
+        assert Game.count(Game.STATUS_FINISHED) == 0
+        # Status changes move games between counters
+        game2.status = Game.STATUS_STARTED
+        db.session.add(game2)
+        db.session.commit()
+        assert Game.count(Game.STATUS_CREATED) == 1
+        assert Game.count(Game.STATUS_STARTED) == 2
+        Game.delete(game1.id)
+        assert Game.count() == 2
+        assert Game.count(Game.STATUS_CREATED) == 0
+        # Counters can be rebuilt from the games table
+        Counter.rebuild({})
+        assert Game.count() == 0
+        Counter.rebuild(Game.get_counter_values())
+        assert Game.count() == 2
+        assert Game.count(Game.STATUS_STARTED) == 2
+
+    def test_count_shards(self):
+        counter_name = Game.get_status_counter_name(Game.STATUS_CREATED)
+        for shard in range(3):
+            db.session.connection().info['counter_shard'] = shard
+            self.create_game(status=Game.STATUS_CREATED)
+        assert Counter.query.filter(Counter.name == counter_name).count() == 3
+        assert Game.count(Game.STATUS_CREATED) == 3
+        # Transactions on other shards are not blocked
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.info['counter_shard'] = 0
+        Counter.increment(connection, counter_name)
+        db.session.connection().info['counter_shard'] = 1
+        db.session.execute('SET LOCAL lock_timeout = \'1s\'')
+        self.create_game(status=Game.STATUS_CREATED)
+        transaction.rollback()
+        connection.close()
+        assert Game.count(Game.STATUS_CREATED) == 4
+        # The cache is only cleared once committed
+        db.session.add(Game(status=Game.STATUS_CREATED))
+        db.session.flush()
+        assert Game.count(Game.STATUS_CREATED) == 4
+        db.session.rollback()
+        assert Game.count(Game.STATUS_CREATED) == 4
+
+    def test_get_open_games(self):
+        user = self.create_user()
+        game1 = self.create_game(status=Game.STATUS_CREATED, users=[user])
+        game2 = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        game3 = self.create_game(status=Game.STATUS_CREATED)
+        full_game = self.create_game(status=Game.STATUS_CREATED)
+        for i in range(app.config['MAX_PLAYER_NUMBER']):
+            full_game.add_user(self.create_user())
+        assert Game.get_open_games(10) == [game1, game3]
+        assert Game.get_open_games(1) == [game1]
+        assert Game.get_open_games(10, game1.id) == [game3]
+
     def test_find_user(self):
         user = self.create_user()
         game = self.create_game(users=[user])
@@ -500,16 +585,51 @@ class GameTestCase(unittest.TestCase):
         user_heap = self.create_heap(game_id=game.id, user_id=user.id, cards=[card3])
         chosen_card = self.create_chosen_card(game_id=game.id, user_id=user.id,
                 card_id=card4.id)
+        column_id = column.id
+        user_hand_id = user_hand.id
+        user_heap_id = user_heap.id
+        chosen_card_id = chosen_card.id
         Game.delete(game.id)
         assert Card.find(card1.id) == card1
         assert User.find(user.id) == user
-        assert Column.query.get(column.id) == None
-        assert Hand.query.get(user_hand.id) == None
-        assert Heap.query.get(user_heap.id) == None
+        assert Column.query.get(column_id) == None
+        assert Hand.query.get(user_hand_id) == None
+        assert Heap.query.get(user_heap_id) == None
         with self.assertRaises(SixQuiPrendException) as e:
             Game.find(game.id)
             assert e.exception.code == 404
-        assert ChosenCard.query.get(chosen_card.id) == None
+        assert ChosenCard.query.get(chosen_card_id) == None
+
+    def test_purge(self):
+        user = self.create_user()
+        game1 = self.create_game(Game.STATUS_STARTED, users=[user])
+        game2 = self.create_game(Game.STATUS_FINISHED, users=[user])
+        game3 = self.create_game(Game.STATUS_FINISHED, users=[user])
+        card = self.create_card()
+        user_hand_id = self.create_hand(game_id=game1.id, user_id=user.id,
+                cards=[card]).id
+        game1.record_event(GameEvent.TYPE_LEAVE, user.id)
+        db.session.commit()
+        game1_id = game1.id
+        game_ids = [game1.id, game2.id]
+        queries = []
+        listener = lambda conn, cursor, statement, *args: queries.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
+        assert Game.purge(game_ids + [-1]) == 2
+        db.event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len([query for query in queries if query.startswith('DELETE')]) == 1
+        assert Game.query.filter(Game.id.in_(game_ids)).count() == 0
+        assert Game.query.get(game3.id) == game3
+        assert Hand.query.filter(Hand.game_id == game1_id).count() == 0
+        assert db.session.query(hand_cards) \
+                .filter(hand_cards.c.hand_id == user_hand_id).count() == 0
+        assert db.session.query(user_games) \
+                .filter(user_games.c.game_id.in_(game_ids)).count() == 0
+        assert GameEvent.query.filter(GameEvent.game_id == game1_id).count() == 0
+        assert Counter.get_exact_value([Game.get_status_counter_name(
+            Game.STATUS_STARTED)]) == 0
+        assert Counter.get_exact_value([Game.get_status_counter_name(
+            Game.STATUS_FINISHED)]) == 1
 
     def test_delete_errors(self):
         # Game not found
@@ -517,6 +637,87 @@ class GameTestCase(unittest.TestCase):
             Game.delete(-1)
             assert e.exception.code == 404
 
+    def test_archive_games(self):
+        populate_db()
+        user = self.create_user()
+        users = [user] + User.query.filter(User.urole == User.ROLE_BOT).all()
+        game = self.create_game(Game.STATUS_CREATED, users=users, owner_id=user.id)
+        game.setup(user.id)
+        self.play_game(game, user)
+        assert game.finished_at != None
+        game_id = game.id
+        version = game.version
+        results = game.get_results()
+        heap = sorted(card.number for card in game.get_user_heap(user.id).cards)
+        columns = [[card.number for card in column.cards] for column in
+                game.get_columns()]
+        # Recently finished games are kept
+        assert Game.archive_games(game.finished_at, 10) == 0
+        assert Game.archive_games(datetime.utcnow(), 10) == 1
+        assert Game.query.get(game_id) == None
+        assert Hand.query.filter(Hand.game_id == game_id).count() == 0
+        assert Heap.query.filter(Heap.game_id == game_id).count() == 0
+        assert GameEvent.query.filter(GameEvent.game_id == game_id).count() == 0
+        game_archive = Game.find_or_archive(game_id)
+        assert game_archive.get_results() == results
+        assert game_archive.heaps[str(user.id)] == heap
+        assert game_archive.columns == columns
+        assert game_archive.serialize()['users'] == \
+                User.query.filter(User.id.in_(user.id for user in users)) \
+                .order_by(User.id).all()
+        assert game_archive.serialize()['status'] == Game.STATUS_FINISHED
+        assert game_archive.serialize()['version'] == version
+        assert game_archive.serialize()['turn_deadline'] == None
+        assert [[card.number for card in column['cards']] for column in
+                game_archive.get_columns()] == columns
+        assert [card.number for card in
+                game_archive.get_user_heap(user.id)['cards']] == heap
+        assert game_archive.get_user_hand(user.id)['cards'] == []
+        assert game_archive.get_user_status(user.id)['has_chosen_card'] == False
+        turns = [game_state.turn for game_state in
+                game_archive.get_replay_states()]
+        assert turns == list(range(app.config['HAND_SIZE'] + 1))
+        # Archived games are still counted
+        counter_name = Game.get_status_counter_name(Game.STATUS_FINISHED)
+        assert Counter.get_exact_value([counter_name]) == 1
+        assert Game.get_counter_values()[counter_name] == 1
+
+    def test_archive_errors(self):
+        # Game not finished
+        game = self.create_game(Game.STATUS_STARTED)
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.archive()
+            assert e.exception.code == 400
+        # Game not found
+        with self.assertRaises(SixQuiPrendException) as e:
+            Game.find_or_archive(-1)
+            assert e.exception.code == 404
+
+    def test_events_partition_pruning(self):
+        user = self.create_user()
+        assert create_partitions(2, datetime(2026, 1, 15)) == \
+                ['game_event_y2026m01', 'game_event_y2026m02']
+        assert create_partitions(1, datetime(2026, 1, 15)) == []
+        january_game = self.create_game(users=[user])
+        january_game.created_at = datetime(2026, 1, 31, 23, 59)
+        february_game = self.create_game(users=[user])
+        february_game.created_at = datetime(2026, 2, 1)
+        default_game = self.create_game(users=[user])
+        default_game.created_at = datetime(2025, 6, 1)
+        db.session.commit()
+        for game in [january_game, february_game, default_game]:
+            game.record_event(GameEvent.TYPE_LEAVE, user.id)
+            db.session.commit()
+            assert game.events.count() == 1
+        assert get_scanned_partitions(january_game.events, 'game_event') == \
+                {'game_event_y2026m01'}
+        assert get_scanned_partitions(february_game.events, 'game_event') == \
+                {'game_event_y2026m02'}
+        assert get_scanned_partitions(default_game.events, 'game_event') == \
+                {'game_event_default'}
+        # The default partition holds rows of that month
+        assert create_partition('game_event', datetime(2025, 6, 1)) == False
+
     def test_setup_game(self):
         populate_db()
         user = self.create_user()
@@ -533,6 +734,387 @@ class GameTestCase(unittest.TestCase):
         assert len(game.get_user_hand(user.id).cards) == app.config['HAND_SIZE']
         assert len(game.get_user_heap(user.id).cards) == 0
 
+    def test_get_state(self):
+        populate_db()
+        user = self.create_user()
+        users = [user] + User.query.filter(User.urole == User.ROLE_BOT).all()
+        game = self.create_game(Game.STATUS_CREATED, users=users, owner_id=user.id)
+        game.setup(user.id)
+        state = game.get_state()
+        assert state.is_started == True
+        assert state.version == game.version == 1
+        assert len(state.hands[user.id]) == app.config['HAND_SIZE']
+        self.play_game(game, user)
+        state = game.get_state()
+        assert state.version == game.version
+        assert state.is_finished == True
+        assert state.chosen_cards == {}
+        for game_user in users:
+            assert state.hands[game_user.id] == []
+            assert sorted(state.heaps[game_user.id]) == \
+                    sorted(card.number for card in game.get_user_heap(game_user.id).cards)
+        for column in game.columns:
+            assert state.columns[column.id] == [card.number for card in column.cards]
+        # Replaying up to the deal
+        state = game.get_state(1)
+        assert state.version == 1
+        assert len(state.hands[user.id]) == app.config['HAND_SIZE']
+
+    def test_get_state_from_snapshots(self):
+        snapshot_interval = app.config['SNAPSHOT_INTERVAL']
+        app.config['SNAPSHOT_INTERVAL'] = 3
+        populate_db()
+        user = self.create_user()
+        users = [user] + User.query.filter(User.urole == User.ROLE_BOT).all()
+        game = self.create_game(Game.STATUS_CREATED, users=users, owner_id=user.id)
+        game.setup(user.id)
+        self.play_game(game, user)
+        snapshots = game.snapshots.order_by(GameSnapshot.version).all()
+        # Turns 3, 6, 9 and the end of the game
+        assert len(snapshots) == 4
+        assert snapshots[-1].version == game.version
+        replayed_state = GameState.from_events(game.id, game.events.all())
+        assert game.get_state().serialize() == replayed_state.serialize()
+        assert snapshots[-1].get_state().serialize() == replayed_state.serialize()
+        version = snapshots[0].version + 1
+        replayed_state = GameState.from_events(game.id,
+                game.events.filter(GameEvent.version <= version).all())
+        assert replayed_state.turn == 3
+        assert game.get_state(version).serialize() == replayed_state.serialize()
+        app.config['SNAPSHOT_INTERVAL'] = snapshot_interval
+
+    def test_get_changes(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game = self.create_game(users=[user1, user2], owner_id=user1.id)
+        game.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {user1.id: [10, 30], user2.id: [20, 40]},
+            'columns': {1: [5]}
+            })
+        game.record_event(GameEvent.TYPE_CHOOSE, user2.id, {'card': 20})
+        db.session.commit()
+        changes = game.get_changes(1, user1.id)
+        assert [event['data'] for event in changes['events']] == [{}]
+        changes = game.get_changes(0, user2.id)
+        assert changes['events'][0]['data']['hands'] == {str(user2.id): [20, 40]}
+        assert changes['events'][1]['data'] == {'card': 20}
+        # Spectators see no hand nor chosen card
+        changes = game.get_changes(0)
+        assert changes['events'][0]['data']['hands'] == {}
+        assert changes['events'][1]['data'] == {}
+        # Versions ahead of the game get the whole state
+        changes = game.get_changes(3, user1.id)
+        assert changes['state']['hands'] == {user1.id: [10, 30]}
+        assert changes['state']['chosen_cards'] == {user2.id: None}
+
+    def test_get_changes_without_event_log(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game = self.create_game(users=[user1, user2], owner_id=user1.id)
+        column = self.create_column(game.id, [self.create_card(5, 2)])
+        self.create_hand(game.id, user1.id, [self.create_card(10, 3)])
+        self.create_hand(game.id, user2.id, [self.create_card(20, 3)])
+        self.create_heap(game.id, user1.id, [self.create_card(1, 1)])
+        self.create_heap(game.id, user2.id)
+        self.create_chosen_card(game.id, user2.id, self.create_card(30, 3).id)
+        # Game started before the event log, without events or with some
+        for version in [0, 1]:
+            if version == 1:
+                game.record_event(GameEvent.TYPE_CHOOSE, user2.id, {'card': 30})
+                db.session.commit()
+            changes = game.get_changes(5, user1.id)
+            assert changes['version'] == version
+            assert changes['state']['version'] == version
+            assert changes['state']['is_started'] == True
+            assert changes['state']['turn'] == app.config['HAND_SIZE'] - 1
+            assert changes['state']['hands'] == {user1.id: [10]}
+            assert changes['state']['heaps'] == {user1.id: [1], user2.id: []}
+            assert changes['state']['columns'] == {column.id: [5]}
+            assert changes['state']['chosen_cards'] == {user2.id: None}
+
+    def test_get_replay_states(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game = self.create_game(Game.STATUS_FINISHED, users=[user1, user2],
+                owner_id=user1.id)
+        game.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {user1.id: [10, 30], user2.id: [20, 40]},
+            'columns': {1: [5]}
+            })
+        for [card1, card2] in [[10, 20], [30, 40]]:
+            game.record_event(GameEvent.TYPE_CHOOSE, user1.id, {'card': card1})
+            game.record_event(GameEvent.TYPE_CHOOSE, user2.id, {'card': card2})
+            game.record_event(GameEvent.TYPE_PLACE, user1.id,
+                    {'column_id': 1, 'card': card1})
+            game.record_event(GameEvent.TYPE_PLACE, user2.id,
+                    {'column_id': 1, 'card': card2})
+        db.session.commit()
+        columns = [list(game_state.columns[1]) for game_state in
+                game.get_replay_states()]
+        assert columns == [[5], [5, 10, 20], [5, 10, 20, 30, 40]]
+
+    def test_get_replay_states_errors(self):
+        # Game not finished
+        game = self.create_game(Game.STATUS_STARTED)
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.get_replay_states()
+            assert e.exception.code == 400
+        # No events
+        game = self.create_game(Game.STATUS_FINISHED)
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.get_replay_states()
+            assert e.exception.code == 404
+
+    def check_user_dashboard(self, user):
+        for game_dict in Game.get_user_dashboard(user.id):
+            game = Game.find(game_dict['id'])
+            assert game.status != Game.STATUS_FINISHED
+            if game.status == Game.STATUS_CREATED:
+                assert game_dict['has_chosen_card'] == False
+                assert game_dict['can_place_card'] == False
+                continue
+            user_status = game.get_user_status(user.id)
+            assert game_dict['has_chosen_card'] == user_status['has_chosen_card']
+            assert game_dict['needs_to_choose_column'] == \
+                    user_status['needs_to_choose_column']
+            if game.owner_id == user.id:
+                assert game_dict['can_place_card'] == game.can_place_card(user.id)
+                assert game_dict['can_choose_cards_for_bots'] == \
+                        game.can_choose_cards_for_bots(user.id)
+            else:
+                assert game_dict['can_place_card'] == False
+                assert game_dict['can_choose_cards_for_bots'] == False
+
+    def test_get_user_dashboard(self):
+        populate_db()
+        user = self.create_user()
+        other_user = self.create_user()
+        bots = User.query.filter(User.urole == User.ROLE_BOT).limit(2).all()
+        created_game = self.create_game(Game.STATUS_CREATED,
+                users=[user, other_user], owner_id=other_user.id)
+        finished_game = self.create_game(Game.STATUS_FINISHED, users=[user],
+                owner_id=user.id)
+        game = self.create_game(Game.STATUS_CREATED,
+                users=[user, other_user] + bots, owner_id=user.id)
+        game.setup(user.id)
+        dashboard = Game.get_user_dashboard(user.id)
+        assert [game_dict['id'] for game_dict in dashboard] == [created_game.id,
+                game.id]
+        assert dashboard[1]['version'] == game.version
+        for turn in range(app.config['HAND_SIZE']):
+            self.check_user_dashboard(user)
+            self.check_user_dashboard(other_user)
+            game.choose_card_for_user(user.id)
+            self.check_user_dashboard(user)
+            game.choose_cards_for_bots(user.id)
+            self.check_user_dashboard(user)
+            game.choose_card_for_user(other_user.id)
+            while game.is_resolving_turn:
+                self.check_user_dashboard(user)
+                self.check_user_dashboard(other_user)
+                for column_user in [user, other_user]:
+                    if game.user_needs_to_choose_column(column_user.id):
+                        column = game.get_lowest_value_column()
+                        game.choose_column_for_user(column_user.id, column.id)
+                        game.update_status()
+                        break
+                else:
+                    game.place_card(user.id)
+        assert game.status == Game.STATUS_FINISHED
+        assert [game_dict['id'] for game_dict in
+                Game.get_user_dashboard(user.id)] == [created_game.id]
+
+    def test_turn_deadline(self):
+        populate_db()
+        user = self.create_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        # No deadline by default
+        game = self.create_game(Game.STATUS_CREATED, users=[user, bot],
+                owner_id=user.id)
+        game.setup(user.id)
+        assert game.turn_deadline == None
+        assert Game.get_turn_deadlines(10) == []
+        app.config['TURN_TIMEOUT'] = 60
+        game = self.create_game(Game.STATUS_CREATED, users=[user, bot],
+                owner_id=user.id)
+        game.setup(user.id)
+        deadline = game.turn_deadline
+        timeout = timedelta(seconds=app.config['TURN_TIMEOUT'])
+        assert datetime.utcnow() < deadline <= datetime.utcnow() + timeout
+        assert Game.get_turn_deadlines(10) == [(game.id, deadline)]
+        assert Game.claim_expired_turn(game.id, datetime.utcnow()) == False
+        now = deadline + timedelta(seconds=1)
+        assert Game.claim_expired_turn(game.id, now) == True
+        # Leased
+        assert Game.claim_expired_turn(game.id, now) == False
+        db.session.refresh(game)
+        assert game.turn_deadline == now + timedelta(seconds=app.config['TURN_LEASE'])
+        # Reset by each turn, cleared once finished
+        self.play_game(game, user)
+        assert game.turn_deadline == None
+        assert Game.get_turn_deadlines(10) == []
+        app.config['TURN_TIMEOUT'] = 0
+
+    def test_auto_play(self):
+        populate_db()
+        user = self.create_user()
+        other_user = self.create_user()
+        bots = User.query.filter(User.urole == User.ROLE_BOT).limit(2).all()
+        game = self.create_game(Game.STATUS_CREATED,
+                users=[user, other_user] + bots, owner_id=user.id)
+        app.config['TURN_TIMEOUT'] = 60
+        game.setup(user.id)
+        for turn in range(app.config['HAND_SIZE']):
+            deadline = game.turn_deadline
+            if turn % 2 == 0:
+                game.choose_card_for_user(user.id)
+            game.auto_play()
+            assert game.is_resolving_turn == False
+            assert game.chosen_cards.count() == 0
+            for game_user in [user, other_user] + bots:
+                assert len(game.get_user_hand(game_user.id).cards) == \
+                        app.config['HAND_SIZE'] - turn - 1
+            if game.status == Game.STATUS_STARTED:
+                assert game.turn_deadline >= deadline
+        assert game.status == Game.STATUS_FINISHED
+        app.config['TURN_TIMEOUT'] = 0
+        game_state = game.get_state()
+        assert game_state.is_finished
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.auto_play()
+            assert e.exception.code == 400
+
+    def test_deadline_scheduler(self):
+        populate_db()
+        user = self.create_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        games = []
+        app.config['TURN_TIMEOUT'] = 60
+        for i in range(2):
+            game = self.create_game(Game.STATUS_CREATED, users=[user, bot],
+                    owner_id=user.id)
+            game.setup(user.id)
+            games.append(game)
+        game_ids = [game.id for game in games]
+        user_id, version = user.id, games[0].version
+        scheduler = DeadlineScheduler()
+        now = datetime.utcnow()
+        assert scheduler.run_once(now) == []
+        assert 0 < scheduler.get_timeout(now) <= app.config['SCHEDULER_REFRESH_INTERVAL']
+        # Played once expired, and scheduled again for the next turn
+        Game.query.filter(Game.id.in_(game_ids)).update({'turn_deadline':
+            datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False)
+        db.session.commit()
+        scheduler = DeadlineScheduler()
+        other_scheduler = DeadlineScheduler()
+        other_scheduler.refresh(datetime.utcnow())
+        assert sorted(scheduler.run_once()) == game_ids
+        assert len(scheduler.heap) == 2
+        assert scheduler.run_once() == []
+        for game_id in game_ids:
+            game = Game.find(game_id)
+            assert game.version > version
+            assert len(game.get_user_hand(user_id).cards) == \
+                    app.config['HAND_SIZE'] - 1
+            assert game.turn_deadline > datetime.utcnow()
+        # Other schedulers don't play them again
+        assert len(other_scheduler.heap) == 2
+        assert other_scheduler.run_once() == []
+        app.config['TURN_TIMEOUT'] = 0
+
+    def test_deadline_scheduler_errors(self):
+        refresh_interval = app.config['SCHEDULER_REFRESH_INTERVAL']
+        app.config['SCHEDULER_REFRESH_INTERVAL'] = 0.01
+        class FailingScheduler(DeadlineScheduler):
+            refresh_count = 0
+            def refresh(self, now):
+                self.refresh_count += 1
+                if self.refresh_count == 1:
+                    raise OperationalError('SELECT 1', {},
+                            Exception('Database is down'))
+                if self.refresh_count == 3:
+                    self.stopped.set()
+                DeadlineScheduler.refresh(self, now)
+        scheduler = FailingScheduler()
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        thread.join(5)
+        app.config['SCHEDULER_REFRESH_INTERVAL'] = refresh_interval
+        # Kept running after the failed run
+        assert not thread.is_alive()
+        assert scheduler.refresh_count == 3
+
+    def test_get_read_key(self):
+        user = self.create_user()
+        game = self.create_game(Game.STATUS_CREATED, users=[user],
+                owner_id=user.id)
+        key = Game.get_read_key(game.id)
+        assert key == (0, Game.STATUS_CREATED, 1)
+        game.add_user(self.create_user())
+        db.session.commit()
+        assert Game.get_read_key(game.id) != key
+        key = Game.get_read_key(game.id)
+        game.record_event(GameEvent.TYPE_CHOOSE, user.id, {'card': 1})
+        db.session.commit()
+        assert Game.get_read_key(game.id) != key
+        assert Game.get_read_key(-1) == None
+
+    def test_reads(self):
+        computing = threading.Event()
+        release = threading.Event()
+        calls = []
+        def compute():
+            calls.append(None)
+            computing.set()
+            assert release.wait(5)
+            return len(calls)
+        results = []
+        def read():
+            results.append(Game.reads.do(('test', 1), compute))
+        leader = threading.Thread(target=read)
+        leader.start()
+        assert computing.wait(5)
+        followers = [threading.Thread(target=read) for i in range(5)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        assert len(calls) == 1
+        assert results == [1] * 6
+        assert Game.reads.count() == 0
+        # Nothing is kept afterwards
+        assert Game.reads.do(('test', 1), compute) == 2
+        # Errors are raised for every caller
+        def fail():
+            raise SixQuiPrendException('Failed', 500)
+        with self.assertRaises(SixQuiPrendException) as e:
+            Game.reads.do(('test', 2), fail)
+            assert e.exception.code == 500
+        assert Game.reads.count() == 0
+
+    def test_get_state_errors(self):
+        user = self.create_user()
+        game = self.create_game(users=[user], owner_id=user.id)
+        game.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {user.id: [10, 30]},
+            'columns': {1: [5]}
+            })
+        game.record_event(GameEvent.TYPE_CHOOSE, user.id, {'card': 20})
+        db.session.commit()
+        # Choosing a card not in hand
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.get_state()
+            assert e.exception.code == 500
+        # Past versions of a game started before the event log
+        game = self.create_game(users=[user], owner_id=user.id)
+        game.record_event(GameEvent.TYPE_CHOOSE, user.id, {'card': 1})
+        db.session.commit()
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.get_state(0)
+            assert e.exception.code == 404
+
     def test_setup_game_errors(self):
         # User not in game
         game = self.create_game(Game.STATUS_CREATED)
@@ -563,6 +1145,54 @@ class GameTestCase(unittest.TestCase):
         assert game.users.count() == 0
         game.add_user(user)
         assert game.users.all() == [user]
+        assert game.user_count == 1
+        game.remove_user(user)
+        assert game.user_count == 0
+
+    def test_user_count(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game = self.create_game(Game.STATUS_CREATED, users=[user1, user2])
+        assert game.user_count == 2
+        User.delete(user2.id)
+        assert game.user_count == 1
+        # User counts can be rebuilt from the users in game
+        game.user_count = 0
+        db.session.add(game)
+        db.session.commit()
+        Game.sync_user_counts()
+        db.session.refresh(game)
+        assert game.user_count == 1
+
+    def test_add_user_concurrently(self):
+        game = self.create_game(Game.STATUS_CREATED)
+        for i in range(app.config['MAX_PLAYER_NUMBER'] - 1):
+            game.add_user(self.create_user())
+        game_id = game.id
+        user_ids = [self.create_user().id, self.create_user().id]
+        loaded = threading.Barrier(len(user_ids))
+        errors = []
+        def add_user(user_id):
+            with app.app_context():
+                try:
+                    thread_game = Game.find(game_id)
+                    loaded.wait(5)
+                    thread_game.add_user(User.find(user_id))
+                except SixQuiPrendException as e:
+                    errors.append(e.code)
+                finally:
+                    db.session.remove()
+        threads = [threading.Thread(target=add_user, args=(user_id,)) for user_id
+                in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert errors == [400]
+        db.session.expire_all()
+        game = Game.find(game_id)
+        assert game.user_count == game.users.count() == \
+                app.config['MAX_PLAYER_NUMBER']
 
     def test_add_user_errors(self):
         # Game not CREATED
@@ -651,6 +1281,27 @@ class GameTestCase(unittest.TestCase):
         assert Heap.query.get(user_heap.id) == None
         assert ChosenCard.query.get(chosen_card.id) == None
 
+    def test_remove_user_from_started_game(self):
+        populate_db()
+        user = self.create_user()
+        other_user = self.create_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(Game.STATUS_CREATED, users=[user, other_user, bot],
+                owner_id=user.id)
+        game.setup(user.id)
+        game.remove_user(user)
+        assert game.owner_id == other_user.id
+        assert game.version == 2
+        assert game.events.count() == 2
+        # Later moves are still recorded
+        game.choose_card_for_user(other_user.id)
+        game.choose_cards_for_bots(other_user.id)
+        assert game.version == 4
+        state = game.get_state()
+        assert state.version == game.version
+        assert user.id not in state.hands
+        assert state.is_resolving_turn == True
+
     def test_remove_user_errors(self):
         # User not in game
         user1 = self.create_user()
@@ -891,11 +1542,47 @@ class GameTestCase(unittest.TestCase):
             game.choose_card_for_user(user.id, card.id)
             assert e.exception.code == 400
 
+    def test_choose_card_for_user_concurrently(self):
+        populate_db()
+        users = [self.create_user(), self.create_user()]
+        game = self.create_game(Game.STATUS_CREATED, users=users,
+                owner_id=users[0].id)
+        game.setup(users[0].id)
+        game_id, version = game.id, game.version
+        user_ids = [user.id for user in users]
+        loaded = threading.Barrier(len(user_ids))
+        errors = []
+        def choose_card(user_id):
+            with app.app_context():
+                try:
+                    thread_game = Game.find(game_id)
+                    loaded.wait(5)
+                    thread_game.choose_card_for_user(user_id)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+        threads = [threading.Thread(target=choose_card, args=(user_id,)) for
+                user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert errors == []
+        db.session.expire_all()
+        game = Game.find(game_id)
+        assert game.version == version + 2
+        assert game.is_resolving_turn == True
+        state = game.get_state()
+        assert state.version == game.version
+        assert sorted(state.chosen_cards) == sorted(user_ids)
+
     def test_choose_column_for_user(self):
         user = self.create_user()
         game = self.create_game(users=[user])
-        card_one = self.create_card()
-        card_two = self.create_card()
+        game.is_resolving_turn = True
+        card_one = self.create_card(1, 1)
+        card_two = self.create_card(2, 2)
         column = self.create_column(game.id, cards=[card_two])
         user_heap = self.create_heap(game.id, user.id)
         chosen_card = self.create_chosen_card(game.id, user.id, card_one.id)
@@ -931,6 +1618,32 @@ class GameTestCase(unittest.TestCase):
         with self.assertRaises(SixQuiPrendException) as e:
             game.choose_column_for_user(user.id, column.id)
             assert e.exception.code == 404
+        # Turn not being resolved
+        populate_db()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(Game.STATUS_CREATED, users=[user, bot],
+                owner_id=user.id)
+        game.setup(user.id)
+        game.choose_card_for_user(user.id)
+        column = game.columns.first()
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.choose_column_for_user(user.id, column.id)
+        assert e.exception.code == 400
+        # User's card is not the lowest chosen card
+        game.choose_cards_for_bots(user.id)
+        bot_card = game.get_user_chosen_card(bot.id)
+        user_card = game.get_user_chosen_card(user.id)
+        lower_user_id = user.id if user_card.card.number < \
+                bot_card.card.number else bot.id
+        higher_user_id = bot.id if lower_user_id == user.id else user.id
+        version = game.version
+        with self.assertRaises(SixQuiPrendException) as e:
+            game.choose_column_for_user(higher_user_id, column.id)
+        assert e.exception.code == 400
+        assert game.version == version
+        state = game.get_state()
+        assert state.version == version
+        assert state.is_resolving_turn == True
 
     def test_update_status(self):
         # Users still have chosen cards to place
@@ -969,5 +1682,21 @@ class GameTestCase(unittest.TestCase):
             game.update_status()
             assert e.exception.code == 400
 
+    ################################################################################
+    ## Serializer
+    ################################################################################
+
+    def test_serialize_games(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game1 = self.create_game(users=[user2, user1])
+        game2 = self.create_game()
+        games = Game.serialize_games([game1, game2])
+        assert [game['id'] for game in games] == [game1.id, game2.id]
+        assert games[0]['users'] == [user1.serialize(), user2.serialize()]
+        assert games[1]['users'] == []
+        assert game1.serialize()['users'] == [user1, user2]
+        assert Game.serialize_games([]) == []
+
 if __name__ == '__main__':
     unittest.main()
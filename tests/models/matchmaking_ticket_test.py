@@ -0,0 +1,170 @@
+from flask import Flask
+from passlib.hash import bcrypt
+from sixquiprend.config import *
+from sixquiprend.models.counter import Counter
+from sixquiprend.models.game import Game
+from sixquiprend.models.matchmaking_ticket import MatchmakingTicket
+from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
+from sixquiprend.models.user import User
+from sixquiprend.scheduler import DeadlineScheduler
+from sixquiprend.sixquiprend import app, db
+from sixquiprend.utils import *
+from datetime import datetime, timedelta
+import unittest
+
+class MatchmakingTicketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DATABASE_NAME'] = 'sixquiprend_test'
+        db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
+        db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + db_path
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        ctx = app.app_context()
+        ctx.push()
+        create_db()
+        db.create_all()
+        populate_db()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def create_user(self, urole=User.ROLE_PLAYER):
+        username = 'User #'+str(User.query.count())
+        user = User(username=username,
+                password=bcrypt.hash('Password'),
+                active=True,
+                urole=urole)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def join(self, count):
+        users = []
+        for i in range(count):
+            user = self.create_user()
+            MatchmakingTicket.join(user)
+            users.append(user)
+        return users
+
+    ################################################################################
+    ## Getters
+    ################################################################################
+
+    def test_find(self):
+        user = self.create_user()
+        MatchmakingTicket.join(user)
+        assert MatchmakingTicket.find(user.id).game_id == None
+
+    def test_find_errors(self):
+        # Ticket not found
+        with self.assertRaises(SixQuiPrendException) as e:
+            MatchmakingTicket.find(-1)
+            assert e.exception.code == 404
+
+    ################################################################################
+    ## Actions
+    ################################################################################
+
+    def test_join(self):
+        user = self.create_user()
+        MatchmakingTicket.join(user)
+        created_at = MatchmakingTicket.find(user.id).created_at
+        # Joining again keeps the place in the queue
+        MatchmakingTicket.join(user)
+        assert MatchmakingTicket.find(user.id).created_at == created_at
+        assert MatchmakingTicket.query.count() == 1
+        # Once matched, joining queues again
+        ticket = MatchmakingTicket.find(user.id)
+        ticket.game_id = Game.create(user).id
+        db.session.commit()
+        MatchmakingTicket.join(user)
+        assert MatchmakingTicket.find(user.id).game_id == None
+
+    def test_join_errors(self):
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        with self.assertRaises(SixQuiPrendException) as e:
+            MatchmakingTicket.join(bot)
+            assert e.exception.code == 400
+
+    def test_leave(self):
+        user = self.create_user()
+        MatchmakingTicket.join(user)
+        MatchmakingTicket.leave(user.id)
+        assert MatchmakingTicket.query.count() == 0
+
+    def test_leave_errors(self):
+        user = self.create_user()
+        with self.assertRaises(SixQuiPrendException) as e:
+            MatchmakingTicket.leave(user.id)
+            assert e.exception.code == 404
+
+    def test_match(self):
+        table_size = app.config['MAX_PLAYER_NUMBER']
+        users = self.join(table_size * 2 + 1)
+        games = MatchmakingTicket.match()
+        assert len(games) == 2
+        for i, game in enumerate(games):
+            game_users = users[i * table_size:(i + 1) * table_size]
+            assert game.status == Game.STATUS_STARTED
+            assert game.owner_id == game_users[0].id
+            assert game.user_count == table_size
+            assert game.get_user_ids() == set(user.id for user in game_users)
+            assert len(game.get_user_hand(game_users[0].id).cards) == \
+                    app.config['HAND_SIZE']
+            assert game.version == 1
+            for user in game_users:
+                assert MatchmakingTicket.find(user.id).game_id == game.id
+        assert Counter.get_exact_value([Game.get_status_counter_name(
+            Game.STATUS_STARTED)]) == 2
+        # The last player waits for the timeout
+        assert MatchmakingTicket.find(users[-1].id).game_id == None
+        assert MatchmakingTicket.match() == []
+        now = datetime.utcnow() + timedelta(seconds=app.config['MATCHMAKING_TIMEOUT'])
+        [game] = MatchmakingTicket.match(now)
+        assert game.owner_id == users[-1].id
+        assert game.user_count == min(table_size, 1 + len(app.config['BOT_NAMES']))
+        assert MatchmakingTicket.find(users[-1].id).game_id == game.id
+        assert MatchmakingTicket.match(now) == []
+
+    def test_match_batch(self):
+        batch_tables = app.config['MATCHMAKING_BATCH_TABLES']
+        app.config['MATCHMAKING_BATCH_TABLES'] = 1
+        try:
+            users = self.join(app.config['MAX_PLAYER_NUMBER'] * 2)
+            [game] = MatchmakingTicket.match()
+            assert game.owner_id == users[0].id
+            [game] = MatchmakingTicket.match()
+            assert game.owner_id == users[app.config['MAX_PLAYER_NUMBER']].id
+            assert MatchmakingTicket.match() == []
+        finally:
+            app.config['MATCHMAKING_BATCH_TABLES'] = batch_tables
+
+    def test_match_scheduler(self):
+        [user] = self.join(1)
+        user_id = user.id
+        scheduler = DeadlineScheduler()
+        scheduler.run_once()
+        assert MatchmakingTicket.find(user_id).game_id == None
+        now = datetime.utcnow() + timedelta(seconds=app.config['MATCHMAKING_TIMEOUT'])
+        scheduler.run_once(now)
+        game_id = MatchmakingTicket.find(user_id).game_id
+        assert Game.find(game_id).status == Game.STATUS_STARTED
+
+    def test_match_without_bots(self):
+        User.query.filter(User.urole == User.ROLE_BOT).delete()
+        db.session.commit()
+        [user] = self.join(1)
+        now = datetime.utcnow() + timedelta(seconds=app.config['MATCHMAKING_TIMEOUT'])
+        assert MatchmakingTicket.match(now) == []
+        assert MatchmakingTicket.find(user.id).game_id == None
+        users = self.join(1)
+        [game] = MatchmakingTicket.match(now)
+        assert game.user_count == 2
+
+if __name__ == '__main__':
+    unittest.main()
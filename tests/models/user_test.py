@@ -4,14 +4,17 @@ from sixquiprend.config import *
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
+from sixquiprend.models.counter import Counter
 from sixquiprend.models.game import Game
 from sixquiprend.models.hand import Hand
 from sixquiprend.models.heap import Heap
 from sixquiprend.models.six_qui_prend_exception import SixQuiPrendException
 from sixquiprend.models.user import User
 from sixquiprend.sixquiprend import app, db
+from sixquiprend.hashing import HashingPool
 from sixquiprend.utils import *
 import random
+import threading
 import unittest
 
 class UserTestCase(unittest.TestCase):
@@ -37,14 +40,12 @@ class UserTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
 
-    def create_user(self, urole=User.ROLE_PLAYER, active=True,
-            authenticated=True):
+    def create_user(self, urole=User.ROLE_PLAYER, active=True):
         username = 'User #'+str(User.query.count())
         password = 'Password'
         user = User(username=username,
                 password=bcrypt.hash(password),
                 active=active,
-                authenticated=authenticated,
                 urole=urole)
         db.session.add(user)
         db.session.commit()
@@ -113,6 +114,49 @@ class UserTestCase(unittest.TestCase):
             User.find(-1)
             assert e.exception.code == 404
 
+    def test_load(self):
+        user = self.create_user()
+        assert User.load('Nobody') == None
+        loaded_user = User.load(user.username)
+        assert loaded_user == user
+        assert User.cache.get(user.username, 60) != None
+        # Cached users are attached to the session
+        db.session.remove()
+        queries = []
+        listener = lambda *args: queries.append(args)
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
+        loaded_user = User.load(user.username)
+        db.event.remove(db.engine, 'before_cursor_execute', listener)
+        assert queries == []
+        assert loaded_user in db.session
+        assert loaded_user.id == user.id
+        assert loaded_user.is_active() == True
+        # Changes invalidate the cache
+        loaded_user.change_active(False)
+        assert User.cache.get(user.username, 60) == None
+        assert User.load(user.username).is_active() == False
+        User.delete(user.id)
+        assert User.cache.get(user.username, 60) == None
+        assert User.load(user.username) == None
+
+    def test_count(self):
+        user1 = self.create_user(active=True)
+        user2 = self.create_user(active=False)
+        assert User.count() == 2
+        assert User.count(True) == 1
+        assert User.count(False) == 1
+        user2.change_active(True)
+        assert User.count(True) == 2
+        assert User.count(False) == 0
+        User.delete(user1.id)
+        assert User.count() == 1
+        # Counters can be rebuilt from the users table
+        Counter.rebuild({})
+        assert User.count() == 0
+        Counter.rebuild(User.get_counter_values())
+        assert User.count() == 1
+        assert User.count(True) == 1
+
     ################################################################################
     ## Actions
     ################################################################################
@@ -129,16 +173,54 @@ class UserTestCase(unittest.TestCase):
         user_heap = self.create_heap(game_id=game.id, user_id=user.id, cards=[card3])
         chosen_card = self.create_chosen_card(game_id=game.id, user_id=user.id,
                 card_id=card4.id)
+        other_user = self.create_user()
+        game.users.append(other_user)
+        game.owner_id = user.id
+        db.session.add(game)
+        db.session.commit()
+        assert game.user_count == 2
+        column_id = column.id
+        user_hand_id = user_hand.id
+        user_heap_id = user_heap.id
+        chosen_card_id = chosen_card.id
         User.delete(user.id)
         with self.assertRaises(SixQuiPrendException) as e:
             User.find(user.id)
             assert e.exception.code == 404
+        assert game.user_count == 1
+        assert game.users.all() == [other_user]
+        # Ownership goes to another non-bot player
+        assert game.owner_id == other_user.id
         assert Card.find(card1.id) == card1
         assert Game.find(game.id) == game
-        assert Column.query.get(column.id) == column
-        assert Hand.query.get(user_hand.id) == None
-        assert Heap.query.get(user_heap.id) == None
-        assert ChosenCard.query.get(chosen_card.id) == None
+        assert Column.query.get(column_id) == column
+        assert Hand.query.get(user_hand_id) == None
+        assert Heap.query.get(user_heap_id) == None
+        assert ChosenCard.query.get(chosen_card_id) == None
+
+    def test_delete_from_started_game(self):
+        populate_db()
+        user = self.create_user()
+        other_user = self.create_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(Game.STATUS_CREATED, users=[user, other_user, bot],
+                owner_id=user.id)
+        game.setup(user.id)
+        game_id, user_id, other_user_id = game.id, user.id, other_user.id
+        version = game.version
+        User.delete(user_id)
+        game = Game.find(game_id)
+        assert game.version == version + 1
+        assert game.owner_id == other_user_id
+        assert game.user_count == 2
+        state = game.get_state()
+        assert state.version == game.version
+        assert user_id not in state.hands
+        # The game goes on without the deleted user
+        game.choose_card_for_user(other_user_id)
+        game.choose_cards_for_bots(other_user_id)
+        assert game.is_resolving_turn == True
+        assert game.get_state().version == game.version
 
     def test_delete_errors(self):
         # User not found
@@ -159,8 +241,40 @@ class UserTestCase(unittest.TestCase):
 
     def test_login(self):
         user = User.register('toto', 'titi')
+        queries = []
+        listener = lambda conn, cursor, statement, *args: queries.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
         assert User.login('toto', 'titi') == user
+        db.event.remove(db.engine, 'before_cursor_execute', listener)
         assert user.is_anonymous() == False
+        assert user.is_authenticated() == True
+        # Login doesn't write to the database
+        assert [query for query in queries if not query.startswith('SELECT')] == []
+
+    def test_login_rehash(self):
+        bcrypt_rounds = app.config['BCRYPT_ROUNDS']
+        app.config['BCRYPT_ROUNDS'] = 5
+        user = User.register('toto', 'titi')
+        assert user.password.startswith('$2b$05$')
+        app.config['BCRYPT_ROUNDS'] = 6
+        User.login('toto', 'titi')
+        assert user.password.startswith('$2b$06$')
+        assert User.login('toto', 'titi') == user
+        app.config['BCRYPT_ROUNDS'] = bcrypt_rounds
+
+    def test_hashing_pool_errors(self):
+        # Pool is saturated
+        pool = HashingPool(1, 1)
+        release = threading.Event()
+        futures = [pool.submit(release.wait) for i in range(2)]
+        with self.assertRaises(SixQuiPrendException) as e:
+            pool.run(lambda: None)
+        assert e.exception.code == 429
+        assert 'Retry-After' in e.exception.headers
+        release.set()
+        for future in futures:
+            future.result()
+        assert pool.run(lambda: 42) == 42
 
     def test_login_errors(self):
         # User is not found
@@ -183,11 +297,16 @@ class UserTestCase(unittest.TestCase):
             User.login(user.username, 'NotPassword')
             assert e.exception.code == 400
 
-    def test_logout(self):
-        user = self.create_user(authenticated=True)
-        assert user.is_authenticated() == True
-        user.logout()
-        assert user.is_authenticated() == False
+    def test_add_bots(self):
+        assert add_bots(['Bot #1', 'Bot #2']) == 2
+        assert add_bots(['Bot #2', 'Bot #3']) == 1
+        bots = User.query.filter(User.urole == User.ROLE_BOT).order_by(User.id).all()
+        assert [bot.username for bot in bots] == ['Bot #1', 'Bot #2', 'Bot #3']
+        assert User.count(True) == 3
+        # Bots cannot login
+        with self.assertRaises(SixQuiPrendException) as e:
+            User.login('Bot #1', '')
+            assert e.exception.code == 403
 
     def test_change_active(self):
         user = self.create_user(active=True)
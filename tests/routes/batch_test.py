@@ -0,0 +1,171 @@
+from flask import Flask
+from passlib.hash import bcrypt
+from sixquiprend.config import *
+from sixquiprend.models.game import Game
+from sixquiprend.models.user import User
+from sixquiprend.rate_limit import get_limiter
+from sixquiprend.sixquiprend import app, db
+from sixquiprend.utils import *
+import json
+import unittest
+
+class BatchTestCase(unittest.TestCase):
+
+    USERNAME = 'User'
+    PASSWORD = 'Password'
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
+        app.config['DATABASE_NAME'] = 'sixquiprend_test'
+        db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
+        db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + db_path
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        ctx = app.app_context()
+        ctx.push()
+        create_db()
+        db.create_all()
+        user = User(username=self.USERNAME,
+                password=bcrypt.hash(self.PASSWORD),
+                active=True)
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def login(self):
+        rv = self.app.post('/login', data=json.dumps(dict(
+            username=self.USERNAME,
+            password=self.PASSWORD,
+        )), content_type='application/json')
+        assert rv.status_code == 201
+
+    def get_current_user(self):
+        rv = self.app.get('/users/current')
+        assert rv.status_code == 200
+        result = json.loads(rv.data)
+        if result['user'] != {}:
+            return User.find(result['user']['id'])
+
+    def create_game(self, status=Game.STATUS_CREATED, users=[], owner_id=None):
+        game = Game(status=status)
+        for user in users:
+            game.users.append(user)
+        game.owner_id = owner_id
+        db.session.add(game)
+        db.session.commit()
+        return game
+
+    def batch(self, requests):
+        return self.app.post('/batch', data=json.dumps(dict(requests=requests)),
+                content_type='application/json')
+
+    ################################################################################
+    ## Routes
+    ################################################################################
+
+    def test_batch(self):
+        populate_db()
+        self.login()
+        user = self.get_current_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(users=[user, bot], owner_id=user.id)
+        game.setup(user.id)
+        game_id, user_id = game.id, user.id
+        card_id = game.get_user_hand(user.id).cards[0].id
+        game_path = '/games/' + str(game_id)
+        rv = self.batch([
+            dict(method='POST', path=game_path + '/card/' + str(card_id)),
+            dict(path=game_path + '/users/' + str(user_id) + '/status'),
+            dict(path=game_path + '/users/current/hand'),
+            dict(path=game_path + '/changes?since=1'),
+            dict(method='post', path=game_path + '/card/' + str(card_id)),
+            dict(path='/games/0/columns')
+            ])
+        assert rv.status_code == 200
+        responses = json.loads(rv.data)['responses']
+        assert [response['status'] for response in responses] == \
+                [201, 200, 200, 200, 400, 404]
+        assert responses[0]['body']['chosen_card']['card']['id'] == card_id
+        assert responses[1]['body']['user']['has_chosen_card'] == True
+        assert len(responses[2]['body']['hand']['cards']) == \
+                app.config['HAND_SIZE'] - 1
+        assert responses[3]['body']['changes']['version'] == 2
+        assert responses[5]['body']['error'] == 'Game doesn\'t exist'
+
+    def test_batch_unexpected_error(self):
+        self.login()
+        rv = self.batch([
+            dict(method='POST', path='/games'),
+            dict(path='/games?limit=abc'),
+            dict(path='/games')
+            ])
+        assert rv.status_code == 200
+        responses = json.loads(rv.data)['responses']
+        assert [response['status'] for response in responses] == [201, 500, 200]
+        assert responses[1]['body']['error'] == 'Internal server error'
+        assert [game['id'] for game in responses[2]['body']['games']] == \
+                [responses[0]['body']['game']['id']]
+
+    def test_batch_compression(self):
+        self.login()
+        for index in range(10):
+            self.create_game()
+        rv = self.batch([dict(path='/games', headers={'Accept-Encoding': 'gzip'})])
+        assert rv.status_code == 200
+        responses = json.loads(rv.data)['responses']
+        assert responses[0]['status'] == 200
+        assert len(responses[0]['body']['games']) == 10
+
+    def test_batch_unauthenticated(self):
+        game = self.create_game(Game.STATUS_STARTED)
+        rv = self.batch([
+            dict(path='/games/' + str(game.id)),
+            dict(path='/games/' + str(game.id) + '/users/current/hand')
+            ])
+        assert rv.status_code == 200
+        responses = json.loads(rv.data)['responses']
+        assert [response['status'] for response in responses] == [200, 401]
+
+    def test_batch_rate_limit(self):
+        self.login()
+        game = self.create_game()
+        rate_limits = app.config['RATE_LIMITS']
+        app.config['RATE_LIMIT_ENABLED'] = True
+        app.config['RATE_LIMITS'] = {'read': (1, 2), 'action': (1, 5)}
+        get_limiter().clear()
+        try:
+            rv = self.batch([dict(path='/games/' + str(game.id))] * 3)
+            assert rv.status_code == 200
+            responses = json.loads(rv.data)['responses']
+            assert [response['status'] for response in responses] == \
+                    [200, 200, 429]
+        finally:
+            app.config['RATE_LIMIT_ENABLED'] = False
+            app.config['RATE_LIMITS'] = rate_limits
+            get_limiter().clear()
+
+    def test_batch_errors(self):
+        self.login()
+        # No requests
+        rv = self.app.post('/batch')
+        assert rv.status_code == 400
+        rv = self.batch([])
+        assert rv.status_code == 400
+        # Too many requests
+        rv = self.batch([dict(path='/games')] * (app.config['BATCH_MAX_SIZE'] + 1))
+        assert rv.status_code == 400
+        # No path
+        rv = self.batch([dict(method='GET')])
+        assert rv.status_code == 400
+        # Nested batch
+        rv = self.batch([dict(method='POST', path='/batch/')])
+        assert rv.status_code == 400
+
+if __name__ == '__main__':
+    unittest.main()
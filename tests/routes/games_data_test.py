@@ -5,13 +5,19 @@ from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
 from sixquiprend.models.game import Game
+from sixquiprend.models.game_archive import GameArchive
+from sixquiprend.models.game_event import GameEvent
 from sixquiprend.models.hand import Hand
 from sixquiprend.models.heap import Heap
 from sixquiprend.models.user import User
+from sixquiprend.rate_limit import DatabaseRateLimiter, RateLimiter, \
+        get_limiter
 from sixquiprend.sixquiprend import app, db
 from sixquiprend.utils import *
+import gzip
 import json
 import random
+import time
 import unittest
 
 class GamesDataTestCase(unittest.TestCase):
@@ -24,6 +30,7 @@ class GamesDataTestCase(unittest.TestCase):
     def setUp(self):
         app.config['SERVER_NAME'] = 'localhost'
         app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
         app.config['DATABASE_NAME'] = 'sixquiprend_test'
         db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
         db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
@@ -137,6 +144,57 @@ class GamesDataTestCase(unittest.TestCase):
         assert len(response_columns[0]['cards']) == 1
         assert response_columns[0]['cards'][0] == card.serialize()
 
+        # Test compact format
+        rv = self.app.get('/games/'+str(game.id)+'/columns',
+                query_string=dict(format='compact'))
+        assert rv.status_code == 200
+        response_columns = json.loads(rv.data)['columns']
+        assert response_columns[0]['cards'] == [card.number]
+
+    def test_get_game_changes(self):
+        self.login()
+        user = self.get_current_user()
+        other_user = self.create_user()
+        game = self.create_game(status=Game.STATUS_STARTED)
+        game.users.append(user)
+        game.users.append(other_user)
+        game.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {user.id: [10, 30], other_user.id: [20, 40]},
+            'columns': {1: [5]}
+            })
+        game.record_event(GameEvent.TYPE_CHOOSE, user.id, {'card': 10})
+        game.record_event(GameEvent.TYPE_CHOOSE, other_user.id, {'card': 20})
+        db.session.commit()
+        rv = self.app.get('/games/'+str(game.id)+'/changes',
+                query_string=dict(since=0))
+        assert rv.status_code == 200
+        changes = json.loads(rv.data)['changes']
+        assert changes['version'] == 3
+        assert changes['status'] == Game.STATUS_STARTED
+        assert changes['user_count'] == 2
+        assert [event['version'] for event in changes['events']] == [1, 2, 3]
+        assert changes['events'][0]['data']['hands'] == {str(user.id): [10, 30]}
+        assert changes['events'][1]['data'] == {'card': 10}
+        assert changes['events'][2]['data'] == {}
+        rv = self.app.get('/games/'+str(game.id)+'/changes',
+                query_string=dict(since=3))
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['changes']['events'] == []
+
+        # Test fallback on the whole state
+        changes_max_events = app.config['CHANGES_MAX_EVENTS']
+        app.config['CHANGES_MAX_EVENTS'] = 1
+        rv = self.app.get('/games/'+str(game.id)+'/changes',
+                query_string=dict(since=1))
+        app.config['CHANGES_MAX_EVENTS'] = changes_max_events
+        assert rv.status_code == 200
+        changes = json.loads(rv.data)['changes']
+        assert 'events' not in changes
+        assert changes['state']['version'] == 3
+        assert changes['state']['hands'] == {str(user.id): [30]}
+        assert changes['state']['chosen_cards'] == {str(user.id): 10,
+                str(other_user.id): 20}
+
     def test_get_user_game_status(self):
         self.login()
         user = self.create_user()
@@ -157,6 +215,121 @@ class GamesDataTestCase(unittest.TestCase):
         response_status = json.loads(rv.data)['user']
         assert response_status['has_chosen_card'] == True
 
+    def test_get_archived_game_data(self):
+        self.login()
+        user = self.get_current_user()
+        other_user = self.create_user()
+        cards = [self.create_card(number, 1) for number in [3, 7, 12, 40]]
+        game_archive = GameArchive(id=42, owner_id=user.id,
+                user_ids=[user.id, other_user.id], version=12,
+                heaps={user.id: [3, 40], other_user.id: []}, columns=[[7, 12]])
+        db.session.add(game_archive)
+        db.session.commit()
+        rv = self.app.get('/games/42/columns')
+        assert rv.status_code == 200
+        columns = json.loads(rv.data)['columns']
+        assert [[card['number'] for card in column['cards']] for column in
+                columns] == [[7, 12]]
+        rv = self.app.get('/games/42/users/'+str(user.id)+'/heap')
+        assert rv.status_code == 200
+        heap = json.loads(rv.data)['heap']
+        assert [card['id'] for card in heap['cards']] == [cards[0].id, cards[3].id]
+        rv = self.app.get('/games/42/users/'+str(other_user.id)+'/status')
+        assert rv.status_code == 200
+        status = json.loads(rv.data)['user']
+        assert status['id'] == other_user.id
+        assert status['has_chosen_card'] == False
+        assert status['needs_to_choose_column'] == False
+        rv = self.app.get('/games/42/users/current/hand')
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['hand']['cards'] == []
+        # User not in game
+        rv = self.app.get('/games/42/users/0/heap')
+        assert rv.status_code == 404
+
+    def test_rate_limit(self):
+        self.login()
+        user = self.create_user()
+        game = self.create_game(status=Game.STATUS_STARTED)
+        game.users.append(user)
+        db.session.add(game)
+        db.session.commit()
+        url = '/games/'+str(game.id)+'/users/'+str(user.id)+'/status'
+        rate_limits = app.config['RATE_LIMITS']
+        app.config['RATE_LIMIT_ENABLED'] = True
+        app.config['RATE_LIMITS'] = {'read': (1, 3), 'action': (1, 1)}
+        get_limiter().clear()
+        try:
+            for i in range(3):
+                rv = self.app.get(url)
+                assert rv.status_code == 200
+            rv = self.app.get(url)
+            assert rv.status_code == 429
+            assert rv.headers['Retry-After'] == '1'
+            # Actions have their own bucket
+            rv = self.app.post('/games')
+            assert rv.status_code == 201
+            rv = self.app.post('/games')
+            assert rv.status_code == 429
+        finally:
+            app.config['RATE_LIMIT_ENABLED'] = False
+            app.config['RATE_LIMITS'] = rate_limits
+            get_limiter().clear()
+
+    def test_rate_limit_forwarded_for(self):
+        game = self.create_game(status=Game.STATUS_STARTED)
+        url = '/games/'+str(game.id)
+        rate_limits = app.config['RATE_LIMITS']
+        app.config['RATE_LIMIT_ENABLED'] = True
+        app.config['RATE_LIMITS'] = {'read': (1, 1), 'action': (1, 1)}
+        app.wsgi_app.x_for = 1
+        get_limiter().clear()
+        try:
+            rv = self.app.get(url, headers={'X-Forwarded-For': '10.0.0.1'})
+            assert rv.status_code == 200
+            rv = self.app.get(url, headers={'X-Forwarded-For': '10.0.0.1'})
+            assert rv.status_code == 429
+            # Other clients behind the same proxy have their own buckets
+            rv = self.app.get(url, headers={'X-Forwarded-For': '10.0.0.2'})
+            assert rv.status_code == 200
+            # Only the address added by the proxy is trusted
+            rv = self.app.get(url, headers={'X-Forwarded-For':
+                '10.0.0.3, 10.0.0.2'})
+            assert rv.status_code == 429
+        finally:
+            app.config['RATE_LIMIT_ENABLED'] = False
+            app.config['RATE_LIMITS'] = rate_limits
+            app.wsgi_app.x_for = app.config['PROXY_FIX_X_FOR']
+            get_limiter().clear()
+
+    def test_rate_limiter_prune(self):
+        limiter = RateLimiter(max_size=2, prune_interval=60)
+        limiter.pruned_at -= 60
+        assert limiter.take('action:user:1', 1000, 1) == 0
+        assert limiter.take('read:user:1', 1, 5) == 0
+        time.sleep(0.01)
+        # Full buckets are forgotten, each with its own rate and burst
+        assert limiter.take('read:user:2', 1, 5) == 0
+        assert sorted(limiter.buckets) == ['read:user:1', 'read:user:2']
+        # Not pruned again before prune_interval
+        assert limiter.take('action:user:2', 1000, 1) == 0
+        time.sleep(0.01)
+        assert limiter.take('action:user:3', 1000, 1) == 0
+        assert len(limiter.buckets) == 4
+
+    def test_rate_limit_database(self):
+        limiter = DatabaseRateLimiter()
+        assert limiter.take('read:user:1', 1, 2) == 0
+        assert limiter.take('read:user:1', 1, 2) == 0
+        retry_after = limiter.take('read:user:1', 1, 2)
+        assert 0 < retry_after <= 1
+        assert limiter.take('read:user:2', 1, 2) == 0
+        assert limiter.take('action:user:1', 1000, 1) == 0
+        time.sleep(0.01)
+        assert limiter.take('action:user:1', 1000, 1) == 0
+        limiter.clear()
+        assert limiter.take('read:user:1', 1, 2) == 0
+
     def test_get_user_game_heap(self):
         self.login()
         user = self.create_user()
@@ -172,6 +345,13 @@ class GamesDataTestCase(unittest.TestCase):
         assert len(response_heap['cards']) == 1
         assert response_heap['cards'][0]['id'] == card.id
 
+        # Test compact format
+        rv = self.app.get('/games/'+str(game.id)+'/users/'+str(user.id)+'/heap',
+                query_string=dict(format='compact'))
+        assert rv.status_code == 200
+        response_heap = json.loads(rv.data)['heap']
+        assert response_heap['cards'] == [card.number]
+
     def test_get_current_user_game_hand(self):
         self.login()
         user = self.get_current_user()
@@ -187,6 +367,37 @@ class GamesDataTestCase(unittest.TestCase):
         assert len(response_hand['cards']) == 1
         assert response_hand['cards'][0]['id'] == card.id
 
+        # Test compact format
+        rv = self.app.get('/games/'+str(game.id)+'/users/current/hand',
+                query_string=dict(format='compact'))
+        assert rv.status_code == 200
+        response_hand = json.loads(rv.data)['hand']
+        assert response_hand['cards'] == [card.number]
+
+    def test_response_compression(self):
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(status=Game.STATUS_STARTED)
+        game.users.append(user)
+        db.session.add(game)
+        db.session.commit()
+        cards = [self.create_card(i, 1) for i in range(1, 60)]
+        hand = self.create_hand(game.id, user.id, cards)
+        rv = self.app.get('/games/'+str(game.id)+'/users/current/hand',
+                headers={'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 200
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        response_hand = json.loads(gzip.decompress(rv.data))['hand']
+        assert len(response_hand['cards']) == 59
+
+        # Small or not accepted responses are not compressed
+        rv = self.app.get('/games/'+str(game.id)+'/users/current/hand')
+        assert rv.status_code == 200
+        assert 'Content-Encoding' not in rv.headers
+        rv = self.app.get('/users/current', headers={'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 200
+        assert 'Content-Encoding' not in rv.headers
+
     def test_get_chosen_cards(self):
         self.login()
         user = self.get_current_user()
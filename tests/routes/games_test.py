@@ -1,11 +1,17 @@
 from flask import Flask
+from sixquiprend.broadcast import Broadcaster, get_broadcaster
 from passlib.hash import bcrypt
 from sixquiprend.config import *
 from sixquiprend.models.game import Game
+from sixquiprend.models.game_archive import GameArchive
+from sixquiprend.models.game_event import GameEvent
+from sixquiprend.models.game_state import GameState
 from sixquiprend.models.user import User
 from sixquiprend.sixquiprend import app, db
 from sixquiprend.utils import *
 import json
+import threading
+import time
 import unittest
 
 class GamesTestCase(unittest.TestCase):
@@ -18,6 +24,7 @@ class GamesTestCase(unittest.TestCase):
     def setUp(self):
         app.config['SERVER_NAME'] = 'localhost'
         app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
         app.config['DATABASE_NAME'] = 'sixquiprend_test'
         db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
         db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
@@ -84,6 +91,10 @@ class GamesTestCase(unittest.TestCase):
         db.session.commit()
         return game
 
+    def create_event(self, game, type, user_id=None, data={}):
+        game.record_event(type, user_id, data)
+        db.session.commit()
+
     ################################################################################
     ## Routes
     ################################################################################
@@ -110,6 +121,60 @@ class GamesTestCase(unittest.TestCase):
         assert len(games) == 1
         assert games[0]['id'] == game2.id
 
+        # Test after_id cursor
+        rv = self.app.get('/games', query_string=dict(limit=1, after_id=game1.id))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert len(games) == 1
+        assert games[0]['id'] == game2.id
+        rv = self.app.get('/games', query_string=dict(after_id=game2.id))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert len(games) == 0
+
+    def test_get_games_filters(self):
+        user = self.create_user()
+        game1 = self.create_game(status=Game.STATUS_CREATED)
+        game2 = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        game3 = self.create_game(status=Game.STATUS_CREATED, users=[user])
+
+        # Test status filter
+        rv = self.app.get('/games', query_string=dict(status=Game.STATUS_CREATED))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert [game['id'] for game in games] == [game1.id, game3.id]
+
+        # Test user_id filter
+        rv = self.app.get('/games', query_string=dict(user_id=user.id))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert [game['id'] for game in games] == [game2.id, game3.id]
+
+        # Test combined filters and cursor
+        rv = self.app.get('/games', query_string=dict(user_id=user.id,
+            status=Game.STATUS_CREATED, after_id=game1.id))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert [game['id'] for game in games] == [game3.id]
+
+    def test_get_open_games(self):
+        user = self.create_user()
+        game1 = self.create_game(status=Game.STATUS_CREATED, users=[user])
+        game2 = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        game3 = self.create_game(status=Game.STATUS_CREATED)
+        rv = self.app.get('/games/open')
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert [game['id'] for game in games] == [game1.id, game3.id]
+        assert games[0]['user_count'] == 1
+        assert games[0]['available_seats'] == app.config['MAX_PLAYER_NUMBER'] - 1
+
+        # Test limit and after_id cursor
+        rv = self.app.get('/games/open', query_string=dict(limit=1, after_id=game1.id))
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert [game['id'] for game in games] == [game3.id]
+
     def test_count_games(self):
         game1 = self.create_game()
         game2 = self.create_game()
@@ -118,6 +183,17 @@ class GamesTestCase(unittest.TestCase):
         count = json.loads(rv.data)['count']
         assert count == 2
 
+        # Test status filter
+        game3 = self.create_game(status=Game.STATUS_STARTED)
+        rv = self.app.get('/games/count', query_string=dict(status=Game.STATUS_CREATED))
+        assert rv.status_code == 200
+        count = json.loads(rv.data)['count']
+        assert count == 2
+        rv = self.app.get('/games/count', query_string=dict(status=Game.STATUS_STARTED))
+        assert rv.status_code == 200
+        count = json.loads(rv.data)['count']
+        assert count == 1
+
     def test_get_game(self):
         game = self.create_game()
         self.login()
@@ -126,6 +202,201 @@ class GamesTestCase(unittest.TestCase):
         game_response = json.loads(rv.data)['game']
         assert game_response['id'] == game.id
 
+    def test_get_game_version(self):
+        self.login()
+        for coalesce_reads in [False, True]:
+            app.config['COALESCE_READS'] = coalesce_reads
+            user = self.create_user()
+            game = self.create_game(Game.STATUS_CREATED, users=[user],
+                    owner_id=user.id)
+            game_id = game.id
+            rv = self.app.get('/games/' + str(game_id))
+            assert rv.status_code == 200
+            assert len(json.loads(rv.data)['game']['users']) == 1
+            game.add_user(self.create_user())
+            db.session.commit()
+            rv = self.app.get('/games/' + str(game_id))
+            assert rv.status_code == 200
+            assert len(json.loads(rv.data)['game']['users']) == 2
+            assert Game.reads.count() == 0
+            rv = self.app.get('/games/0')
+            assert rv.status_code == 404
+        app.config['COALESCE_READS'] = False
+
+    def test_get_game_replay(self):
+        user1 = self.create_user()
+        user2 = self.create_user()
+        game = self.create_game(Game.STATUS_FINISHED, users=[user1, user2],
+                owner_id=user1.id)
+        self.create_event(game, GameEvent.TYPE_DEAL, data={
+            'hands': {user1.id: [10], user2.id: [20]},
+            'columns': {1: [5], 2: [15]}
+            })
+        self.create_event(game, GameEvent.TYPE_CHOOSE, user1.id, {'card': 10})
+        self.create_event(game, GameEvent.TYPE_CHOOSE, user2.id, {'card': 20})
+        self.create_event(game, GameEvent.TYPE_PLACE, user1.id,
+                {'column_id': 1, 'card': 10})
+        self.create_event(game, GameEvent.TYPE_PLACE, user2.id,
+                {'column_id': 2, 'card': 20})
+        rv = self.app.get('/games/'+str(game.id)+'/replay')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'application/x-ndjson'
+        states = [json.loads(line) for line in rv.data.splitlines()]
+        assert len(states) == 2
+        assert states[0]['version'] == 1
+        assert states[0]['turn'] == 0
+        assert states[0]['columns'] == {'1': [5], '2': [15]}
+        assert states[0]['hands'] == {str(user1.id): [10], str(user2.id): [20]}
+        assert states[1]['version'] == 5
+        assert states[1]['turn'] == 1
+        assert states[1]['is_finished'] == True
+        assert states[1]['columns'] == {'1': [5, 10], '2': [15, 20]}
+
+    def test_get_game_replay_errors(self):
+        # Game not finished
+        game = self.create_game(Game.STATUS_STARTED)
+        rv = self.app.get('/games/'+str(game.id)+'/replay')
+        assert rv.status_code == 400
+        # Game without events
+        game = self.create_game(Game.STATUS_FINISHED)
+        rv = self.app.get('/games/'+str(game.id)+'/replay')
+        assert rv.status_code == 404
+
+    def test_get_archived_game(self):
+        user = self.create_user()
+        game_archive = GameArchive(id=42, owner_id=user.id, user_ids=[user.id],
+                results={user.username: 12})
+        db.session.add(game_archive)
+        db.session.commit()
+        rv = self.app.get('/games/42')
+        assert rv.status_code == 200
+        response = json.loads(rv.data)
+        assert response['game']['id'] == 42
+        assert response['game']['status'] == Game.STATUS_FINISHED
+        assert response['game']['users'][0]['id'] == user.id
+        assert response['results'] == {user.username: 12}
+
+    def test_watch_game(self):
+        watch_timeout = app.config['WATCH_TIMEOUT']
+        app.config['WATCH_TIMEOUT'] = 5
+        app.config['WATCH_LONG_POLL'] = True
+        get_broadcaster().clear()
+        user = self.create_user()
+        other_user = self.create_user()
+        game = self.create_game(Game.STATUS_STARTED, users=[user, other_user])
+        game.record_event(GameEvent.TYPE_DEAL, data={
+            'hands': {user.id: [10], other_user.id: [20]},
+            'columns': {1: [5]}
+            })
+        db.session.commit()
+        game_id = game.id
+        user_id = user.id
+        other_user_id = other_user.id
+        # Current state, as seen by spectators
+        rv = self.app.get('/games/'+str(game_id)+'/watch')
+        assert rv.status_code == 200
+        response = json.loads(rv.data)
+        assert response['version'] == 1
+        assert response['state']['hands'] == {}
+        assert response['state']['columns'] == {'1': [5]}
+        # Waiting for the next move
+        def choose_card():
+            time.sleep(0.5)
+            with app.app_context():
+                game = Game.query.get(game_id)
+                game.record_event(GameEvent.TYPE_CHOOSE, user_id, {'card': 10})
+                db.session.commit()
+                db.session.remove()
+        thread = threading.Thread(target=choose_card)
+        thread.start()
+        rv = self.app.get('/games/'+str(game_id)+'/watch',
+                query_string=dict(since=1))
+        thread.join()
+        assert rv.status_code == 200
+        response = json.loads(rv.data)
+        assert response['version'] == 2
+        assert response['state']['chosen_cards'] == {str(user_id): None}
+        # Nothing happens
+        app.config['WATCH_TIMEOUT'] = 0.1
+        rv = self.app.get('/games/'+str(game_id)+'/watch',
+                query_string=dict(since=2))
+        assert rv.status_code == 204
+        app.config['WATCH_TIMEOUT'] = watch_timeout
+        app.config['WATCH_LONG_POLL'] = False
+        # Without long polls, answers right away
+        started_at = time.monotonic()
+        rv = self.app.get('/games/'+str(game_id)+'/watch',
+                query_string=dict(since=2))
+        assert rv.status_code == 204
+        assert time.monotonic() - started_at < 1
+        game = Game.query.get(game_id)
+        game.record_event(GameEvent.TYPE_CHOOSE, other_user_id, {'card': 20})
+        db.session.commit()
+        rv = self.app.get('/games/'+str(game_id)+'/watch',
+                query_string=dict(since=2))
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['version'] == 3
+
+    def test_watch_game_errors(self):
+        # Game not found
+        rv = self.app.get('/games/-1/watch')
+        assert rv.status_code == 404
+
+    def test_broadcaster(self):
+        loaded_states = []
+        serialized_states = []
+        def load_game(game_id):
+            return 1, {1, 2}
+        def load_state(game_id, version):
+            loaded_states.append(version)
+            game_state = GameState(game_id)
+            game_state.version = version
+            return game_state
+        def serialize_state(game_state, user_id):
+            serialized_states.append(user_id)
+            return str(user_id).encode()
+        broadcaster = Broadcaster(load_game, load_state, serialize_state)
+        with broadcaster.watch(42, 1) as channel, \
+                broadcaster.watch(42, 3), \
+                broadcaster.watch(42, None):
+            assert broadcaster.get_viewer_counts(42) == {'players': 1,
+                    'spectators': 2}
+            for user_id in [1, 3, None, 4, 1]:
+                payload = broadcaster.get_payload(channel, 0, user_id)
+                assert payload == (b'1' if user_id == 1 else b'None')
+            assert loaded_states == [0]
+            assert serialized_states == [1, None]
+            broadcaster.publish(42, 2)
+            assert broadcaster.wait(channel, 1, 0) == 2
+        assert broadcaster.get_viewer_counts(42) == {'players': 0,
+                'spectators': 0}
+        # Short polls reuse the payloads of their game's latest version
+        loaded_states.clear()
+        serialized_states.clear()
+        for user_id in [1, 3, None, 1]:
+            assert broadcaster.poll(42, 0, user_id) == (1, b'1' if user_id == 1
+                    else b'None')
+        assert broadcaster.poll(42, 1, 1) == (1, None)
+        assert loaded_states == [1]
+        assert serialized_states == [1, None]
+        assert broadcaster.get_viewer_counts(42) == {'players': 0,
+                'spectators': 0}
+
+    def test_get_game_viewers(self):
+        user = self.create_user()
+        game = self.create_game(users=[user])
+        game_id = game.id
+        user_id = user.id
+        rv = self.app.get('/games/'+str(game_id)+'/viewers')
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['viewers'] == {'players': 0, 'spectators': 0}
+        get_broadcaster().clear()
+        with get_broadcaster().watch(game_id, user_id), \
+                get_broadcaster().watch(game_id, None):
+            rv = self.app.get('/games/'+str(game_id)+'/viewers')
+            assert json.loads(rv.data)['viewers'] == {'players': 1,
+                    'spectators': 1}
+
     def test_create_game(self):
         self.login()
         rv = self.app.post('/games', content_type='application/json')
@@ -142,6 +413,38 @@ class GamesTestCase(unittest.TestCase):
         game_db = Game.query.get(game.id)
         assert game_db == None
 
+    def test_purge_games(self):
+        game1 = self.create_game()
+        game2 = self.create_game()
+        game3 = self.create_game()
+        self.login()
+        rv = self.app.post('/games/purge', data=json.dumps(dict(
+            game_ids=[game1.id, game2.id])), content_type='application/json')
+        assert rv.status_code == 401
+        self.login_admin()
+        rv = self.app.post('/games/purge', data=json.dumps(dict(
+            game_ids=[game1.id, game2.id])), content_type='application/json')
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['count'] == 2
+        assert Game.query.all() == [game3]
+
+    def test_purge_games_errors(self):
+        game = self.create_game()
+        self.login_admin()
+        # No body
+        rv = self.app.post('/games/purge')
+        assert rv.status_code == 400
+        # No game ids
+        rv = self.app.post('/games/purge', data=json.dumps(dict(ids=[game.id])),
+                content_type='application/json')
+        assert rv.status_code == 400
+        # Game ids not a list of integers
+        for game_ids in [game.id, 'abc', [str(game.id)], [game.id, None], [True]]:
+            rv = self.app.post('/games/purge', data=json.dumps(dict(
+                game_ids=game_ids)), content_type='application/json')
+            assert rv.status_code == 400
+        assert Game.query.count() == 1
+
     def test_enter_game(self):
         self.login()
         game = self.create_game(status=Game.STATUS_CREATED)
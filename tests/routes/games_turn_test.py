@@ -1,17 +1,23 @@
 from flask import Flask
 from passlib.hash import bcrypt
+from sixquiprend.broadcast import get_broadcaster
 from sixquiprend.config import *
+from sixquiprend.gateway import Gateway
 from sixquiprend.models.card import Card
 from sixquiprend.models.chosen_card import ChosenCard
 from sixquiprend.models.column import Column
 from sixquiprend.models.game import Game
+from sixquiprend.models.game_event import GameEvent
 from sixquiprend.models.hand import Hand
 from sixquiprend.models.heap import Heap
+from sixquiprend.models.idempotency_key import IdempotencyKey
 from sixquiprend.models.user import User
 from sixquiprend.sixquiprend import app, db
 from sixquiprend.utils import *
+from datetime import datetime, timedelta
 import json
 import random
+import threading
 import unittest
 
 class GamesTurnTestCase(unittest.TestCase):
@@ -24,6 +30,7 @@ class GamesTurnTestCase(unittest.TestCase):
     def setUp(self):
         app.config['SERVER_NAME'] = 'localhost'
         app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
         app.config['DATABASE_NAME'] = 'sixquiprend_test'
         db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
         db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
@@ -124,6 +131,26 @@ class GamesTurnTestCase(unittest.TestCase):
         db.session.commit()
         return chosen_card
 
+    class WebSocket:
+        """Stand-in for a gevent-websocket connection, receiving the given
+        messages once the first state has been pushed"""
+
+        def __init__(self, messages):
+            self.messages = list(messages)
+            self.sent_messages = []
+            self.state_pushed = threading.Event()
+
+        def receive(self):
+            assert self.state_pushed.wait(5)
+            if len(self.messages) == 0:
+                return None
+            return self.messages.pop(0)
+
+        def send(self, message):
+            self.sent_messages.append(json.loads(message))
+            if self.sent_messages[-1].get('type') == 'state':
+                self.state_pushed.set()
+
     ################################################################################
     ## Routes
     ################################################################################
@@ -154,6 +181,81 @@ class GamesTurnTestCase(unittest.TestCase):
         assert response_chosen_card['user_id'] == user.id
         assert response_chosen_card['card']['id'] == card.id
 
+    def test_choose_card_for_game_idempotent(self):
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        card = self.create_card()
+        hand = self.create_hand(game_id=game.id, user_id=user.id, cards=[card])
+        url = '/games/'+str(game.id)+'/card/'+str(card.id)
+        headers = {'Idempotency-Key': 'key'}
+        rv = self.app.post(url, headers=headers)
+        assert rv.status_code == 201
+        assert 'Idempotent-Replayed' not in rv.headers
+        data = rv.data
+        # Retries get the original response
+        rv = self.app.post(url, headers=headers)
+        assert rv.status_code == 201
+        assert rv.headers['Idempotent-Replayed'] == 'true'
+        assert rv.data == data
+        assert ChosenCard.query.filter(ChosenCard.game_id == game.id).count() == 1
+        # Client errors are stored too
+        rv = self.app.post(url, headers={'Idempotency-Key': 'other key'})
+        assert rv.status_code == 400
+        data = rv.data
+        rv = self.app.post(url, headers={'Idempotency-Key': 'other key'})
+        assert rv.status_code == 400
+        assert rv.headers['Idempotent-Replayed'] == 'true'
+        assert rv.data == data
+
+    def test_choose_card_for_game_idempotent_errors(self):
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        card = self.create_card()
+        hand = self.create_hand(game_id=game.id, user_id=user.id, cards=[card])
+        game_id, user_id, card_id = game.id, user.id, card.id
+        url = '/games/'+str(game_id)+'/card/'+str(card_id)
+        # Key used for another request
+        rv = self.app.post('/games/'+str(game_id)+'/cards/place',
+                headers={'Idempotency-Key': 'key'})
+        assert rv.status_code == 403
+        rv = self.app.post(url, headers={'Idempotency-Key': 'key'})
+        assert rv.status_code == 422
+        # Invalid key
+        rv = self.app.post(url, headers={'Idempotency-Key': 'k' * 101})
+        assert rv.status_code == 400
+        # Request in progress
+        db.session.add(IdempotencyKey(user_id=user_id, key='in progress',
+            path=url + '?'))
+        db.session.commit()
+        rv = self.app.post(url, headers={'Idempotency-Key': 'in progress'})
+        assert rv.status_code == 409
+        assert rv.headers['Retry-After'] == '1'
+        # Dead request
+        idempotency_key = IdempotencyKey.find(user_id, 'in progress')
+        idempotency_key.created_at = datetime.utcnow() - timedelta(
+                seconds=app.config['IDEMPOTENCY_CLAIM_TIMEOUT'] + 1)
+        db.session.commit()
+        rv = self.app.post(url, headers={'Idempotency-Key': 'in progress'})
+        assert rv.status_code == 201
+        assert IdempotencyKey.find(user_id, 'in progress').status == 201
+        # Purge
+        assert purge_idempotency_keys(0) == 2
+        assert IdempotencyKey.query.count() == 0
+
+    def test_choose_card_for_game_compact(self):
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(status=Game.STATUS_STARTED, users=[user])
+        card = self.create_card(number=42)
+        hand = self.create_hand(game_id=game.id, user_id=user.id, cards=[card])
+        rv = self.app.post('/games/'+str(game.id)+'/card/'+str(card.number),
+                query_string=dict(format='compact'))
+        assert rv.status_code == 201
+        response_chosen_card = json.loads(rv.data)['chosen_card']
+        assert response_chosen_card['card'] == card.number
+
     def test_choose_card_for_bots(self):
         self.login()
         card = self.create_card(1, 1)
@@ -198,6 +300,7 @@ class GamesTurnTestCase(unittest.TestCase):
         game = self.create_game(status=Game.STATUS_STARTED)
         user = self.get_current_user()
         game.users.append(user)
+        game.is_resolving_turn = True
         db.session.add(game)
         db.session.commit()
         card = self.create_card(1, 1)
@@ -213,5 +316,89 @@ class GamesTurnTestCase(unittest.TestCase):
         assert len(response['user_heap']['cards']) == 1
         assert response['user_heap']['cards'][0]['id'] == card2.id
 
+    def test_game_socket(self):
+        populate_db()
+        get_broadcaster().clear()
+        self.login()
+        user = self.get_current_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(users=[user, bot], owner_id=user.id)
+        game.setup(user.id)
+        game_id, user_id, bot_id = game.id, user.id, bot.id
+        card_id = game.get_user_hand(user.id).cards[0].id
+        websocket = self.WebSocket([
+            json.dumps(dict(id=1, action='choose_card', card_id=card_id)),
+            json.dumps(dict(id=2, action='choose_cards_for_bots')),
+            json.dumps(dict(id=3, action='unknown')),
+            json.dumps(dict(id=4, action='choose_card', card_id=card_id)),
+            'not json'
+            ])
+        rv = self.app.get('/games/'+str(game_id)+'/socket',
+                environ_base={'wsgi.websocket': websocket})
+        assert rv.status_code == 200
+        states = [message for message in websocket.sent_messages if
+                message.get('type') == 'state']
+        assert states[0]['version'] == 1
+        assert len(states[0]['state']['hands'][str(user_id)]) == \
+                app.config['HAND_SIZE']
+        assert str(bot_id) not in states[0]['state']['hands']
+        answers = [message for message in websocket.sent_messages if
+                'id' in message]
+        assert [answer['id'] for answer in answers] == [1, 2, 3, 4, None]
+        assert answers[0]['result']['chosen_card']['card']['id'] == card_id
+        assert answers[1]['result'] == {}
+        assert answers[2]['code'] == 400
+        assert answers[3]['code'] == 400
+        assert answers[4]['error'] == 'Invalid message'
+        assert Game.find(game_id).is_resolving_turn == True
+        assert get_broadcaster().get_viewer_counts(game_id) == {'players': 0,
+                'spectators': 0}
+
+    def test_game_socket_database_errors(self):
+        populate_db()
+        user = self.create_user()
+        bot = User.query.filter(User.urole == User.ROLE_BOT).first()
+        game = self.create_game(users=[user, bot], owner_id=user.id)
+        game.setup(user.id)
+        game_id, user_id = game.id, user.id
+        card_id = game.get_user_hand(user.id).cards[0].id
+        # Version taken by a move the game doesn't know of yet
+        event = GameEvent(game_id=game_id, game_created_at=game.created_at,
+                version=game.version + 1, type=GameEvent.TYPE_LEAVE)
+        db.session.add(event)
+        db.session.commit()
+        gateway = Gateway(self.WebSocket([]), game_id, user_id, get_broadcaster())
+        message = json.dumps(dict(id=1, action='choose_card', card_id=card_id))
+        answer = json.loads(gateway.handle(message))
+        assert answer == {'id': 1, 'error': 'Conflicting action, retry',
+                'code': 409}
+        # The session is usable again
+        GameEvent.query.filter(GameEvent.game_id == game_id,
+                GameEvent.type == GameEvent.TYPE_LEAVE).delete()
+        db.session.commit()
+        answer = json.loads(gateway.handle(message))
+        assert answer['result']['chosen_card']['card']['id'] == card_id
+        # Unexpected errors
+        class FailingGateway(Gateway):
+            def perform(self, request):
+                raise RuntimeError('Failed')
+        gateway = FailingGateway(self.WebSocket([]), game_id, user_id,
+                get_broadcaster())
+        answer = json.loads(gateway.handle(json.dumps(dict(id=2,
+            action='place_card'))))
+        assert answer == {'id': 2, 'error': 'Internal server error', 'code': 500}
+
+    def test_game_socket_errors(self):
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(Game.STATUS_STARTED)
+        # Not a WebSocket
+        rv = self.app.get('/games/'+str(game.id)+'/socket')
+        assert rv.status_code == 400
+        # User not in game
+        rv = self.app.get('/games/'+str(game.id)+'/socket',
+                environ_base={'wsgi.websocket': self.WebSocket([])})
+        assert rv.status_code == 404
+
 if __name__ == '__main__':
     unittest.main()
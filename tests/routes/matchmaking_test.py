@@ -0,0 +1,89 @@
+from flask import Flask
+from passlib.hash import bcrypt
+from sixquiprend.config import *
+from sixquiprend.models.game import Game
+from sixquiprend.models.user import User
+from sixquiprend.sixquiprend import app, db
+from sixquiprend.utils import *
+import json
+import unittest
+
+class MatchmakingTestCase(unittest.TestCase):
+
+    USERNAME = 'User'
+    PASSWORD = 'Password'
+
+    def setUp(self):
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
+        app.config['DATABASE_NAME'] = 'sixquiprend_test'
+        db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
+        db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + db_path
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        ctx = app.app_context()
+        ctx.push()
+        create_db()
+        db.create_all()
+        populate_db()
+        user = User(username=self.USERNAME,
+                password=bcrypt.hash(self.PASSWORD),
+                active=True)
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def login(self):
+        rv = self.app.post('/login', data=json.dumps(dict(
+            username=self.USERNAME,
+            password=self.PASSWORD,
+        )), content_type='application/json')
+        assert rv.status_code == 201
+
+    ################################################################################
+    ## Routes
+    ################################################################################
+
+    def test_matchmaking(self):
+        rv = self.app.post('/matchmaking')
+        assert rv.status_code == 401
+        self.login()
+        rv = self.app.post('/matchmaking')
+        assert rv.status_code == 201
+        ticket = json.loads(rv.data)['ticket']
+        assert ticket['game_id'] == None
+        rv = self.app.get('/matchmaking')
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['ticket'] == ticket
+        rv = self.app.delete('/matchmaking')
+        assert rv.status_code == 204
+        rv = self.app.get('/matchmaking')
+        assert rv.status_code == 404
+        rv = self.app.delete('/matchmaking')
+        assert rv.status_code == 404
+
+    def test_matchmaking_timeout(self):
+        self.login()
+        timeout = app.config['MATCHMAKING_TIMEOUT']
+        app.config['MATCHMAKING_TIMEOUT'] = 0
+        try:
+            rv = self.app.post('/matchmaking')
+        finally:
+            app.config['MATCHMAKING_TIMEOUT'] = timeout
+        assert rv.status_code == 201
+        game_id = json.loads(rv.data)['ticket']['game_id']
+        rv = self.app.get('/games/' + str(game_id))
+        assert rv.status_code == 200
+        game = json.loads(rv.data)['game']
+        assert game['status'] == Game.STATUS_STARTED
+        assert self.USERNAME in [user['username'] for user in game['users']]
+        rv = self.app.get('/games/' + str(game_id) + '/users/current/hand')
+        assert rv.status_code == 200
+
+if __name__ == '__main__':
+    unittest.main()
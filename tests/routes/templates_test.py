@@ -16,6 +16,7 @@ class TemplatesTestCase(unittest.TestCase):
     def setUp(self):
         app.config['SERVER_NAME'] = 'localhost'
         app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
         app.config['DATABASE_NAME'] = 'sixquiprend_test'
         db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
         db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
@@ -19,6 +19,7 @@ class UsersTestCase(unittest.TestCase):
     def setUp(self):
         app.config['SERVER_NAME'] = 'localhost'
         app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = False
         app.config['DATABASE_NAME'] = 'sixquiprend_test'
         db_path = app.config['DATABASE_USER'] + ':' + app.config['DATABASE_PASSWORD']
         db_path += '@' + app.config['DATABASE_HOST'] + '/' + app.config['DATABASE_NAME']
@@ -152,6 +153,19 @@ class UsersTestCase(unittest.TestCase):
         assert len(users) == 1
         assert users[-1]['username'] == user.username
 
+        # Test after_id cursor
+        rv = self.app.get('/users', query_string=dict(limit=1))
+        first_user_id = json.loads(rv.data)['users'][-1]['id']
+        rv = self.app.get('/users', query_string=dict(after_id=first_user_id))
+        assert rv.status_code == 200
+        users = json.loads(rv.data)['users']
+        assert len(users) == 2
+        assert users[-1]['username'] == user.username
+        rv = self.app.get('/users', query_string=dict(after_id=user.id))
+        assert rv.status_code == 200
+        users = json.loads(rv.data)['users']
+        assert len(users) == 0
+
         # Test active filter
         inactive_user = self.create_user(active=False)
         rv = self.app.get('/users')
@@ -232,5 +246,26 @@ class UsersTestCase(unittest.TestCase):
         rv = self.app.get('/users/current')
         assert json.loads(rv.data)['user'] == self.get_current_user().serialize()
 
+    def test_get_current_user_games(self):
+        rv = self.app.get('/users/current/games')
+        assert rv.status_code == 401
+        self.login()
+        user = self.get_current_user()
+        game = self.create_game(Game.STATUS_STARTED)
+        game.users.append(user)
+        game.owner_id = user.id
+        other_game = self.create_game(Game.STATUS_FINISHED)
+        other_game.users.append(user)
+        db.session.commit()
+        rv = self.app.get('/users/current/games')
+        assert rv.status_code == 200
+        games = json.loads(rv.data)['games']
+        assert len(games) == 1
+        assert games[0]['id'] == game.id
+        assert games[0]['has_chosen_card'] == False
+        assert games[0]['needs_to_choose_column'] == False
+        assert games[0]['can_place_card'] == False
+        assert games[0]['can_choose_cards_for_bots'] == False
+
 if __name__ == '__main__':
     unittest.main()